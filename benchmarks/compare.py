@@ -0,0 +1,75 @@
+import sys
+import argparse
+import json
+import textwrap
+
+""" Argument parser """
+parser = argparse.ArgumentParser(
+    formatter_class=argparse.RawDescriptionHelpFormatter,
+    description=textwrap.dedent('''\
+        Compare the benchmark records of two commits (JSON lines written by the benchmarks/*.py scripts).
+         --------------------------------
+        Records are matched on their parameters (benchmark, stage, n_samples, metric...). For each metric (times in
+        seconds, memory in MB, throughputs), the ratio current / baseline is printed; throughputs are inverted so that
+        a ratio above 1 is always a regression. Exits with status 1 if a ratio is above --threshold.
+        '''))
+
+parser.add_argument('baseline', help="JSON lines records of the baseline (e.g. the main branch)")
+parser.add_argument('current', help="JSON lines records to compare to the baseline")
+parser.add_argument('--threshold', type=float, default=1.2, help="Ratio above which a metric is a regression, default 1.2")
+parser.add_argument('--min_seconds', type=float, default=0.5,
+                    help="Times (and throughputs) measured on less than min_seconds in the baseline are not compared (too noisy), default 0.5")
+
+args = parser.parse_args()
+
+ENVIRONMENT = ('git_commit', 'python', 'cpu_count', 'status', 'returncode')
+
+
+def flatten(record, prefix=''):
+    flat = {}
+    for key, value in record.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix + key + '.'))
+        else:
+            flat[prefix + key] = value
+    return flat
+
+
+def is_metric(key):
+    return key.endswith('_s') or key.endswith('_mb') or key.endswith('per_s')
+
+
+def load(path):
+    """ {parameters: metrics} of the records of a file, the last record winning """
+    records = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                record = flatten(json.loads(line))
+                parameters = tuple(sorted((key, str(value)) for key, value in record.items()
+                                          if not is_metric(key) and key not in ENVIRONMENT and '.' not in key))
+                records[parameters] = {key: value for key, value in record.items() if is_metric(key) and value is not None}
+    return records
+
+
+baseline, current = load(args.baseline), load(args.current)
+regressions = 0
+for parameters, metrics in current.items():
+    if parameters not in baseline:
+        continue
+    label = ' '.join(f'{key}={value}' for key, value in parameters if key in ('benchmark', 'stage', 'metric', 'n_samples'))
+    for key, value in metrics.items():
+        reference = baseline[parameters].get(key)
+        if reference is None or reference == 0 or value == 0:
+            continue
+        # Throughputs are as noisy as the time they are measured on
+        seconds = baseline[parameters].get(key[:-len('items_per_s')] + 'wall_time_s') if key.endswith('items_per_s') else reference
+        if key.endswith('_s') and (seconds is not None) and seconds < args.min_seconds:
+            continue
+        ratio = reference / value if key.endswith('per_s') else value / reference
+        flag = 'REGRESSION' if ratio > args.threshold else ''
+        regressions += ratio > args.threshold
+        print(f'{label:<60} {key:<40} {reference:>12.3f} {value:>12.3f} {ratio:>7.2f} {flag}')
+
+print(f'{regressions} regression(s) above x{args.threshold}')
+sys.exit(1 if regressions > 0 else 0)
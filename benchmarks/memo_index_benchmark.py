@@ -0,0 +1,75 @@
+import os
+import argparse
+import json
+import tempfile
+import textwrap
+import time
+
+import numpy as np
+from scipy import sparse
+
+from enpkg_meta_analysis.memo_index import MemoIndex
+from enpkg_meta_analysis.memo_matrix import SparseMemoMatrix
+from synthetic import random_memo_matrix
+
+""" Argument parser """
+parser = argparse.ArgumentParser(
+    formatter_class=argparse.RawDescriptionHelpFormatter,
+    description=textwrap.dedent('''\
+        Recall and latency of MemoIndex top-k queries against an exact (brute-force) cosine search,
+        on a random clustered MEMO-like count matrix.
+        '''))
+
+parser.add_argument('--n_samples', type=int, default=10000, help="Number of indexed samples, default 10000")
+parser.add_argument('--n_queries', type=int, default=200, help="Number of new samples queried, default 200")
+parser.add_argument('--n_words', type=int, default=50000, help="Number of words, default 50000")
+parser.add_argument('--words_per_sample', type=int, default=500, help="Average number of words per sample, default 500")
+parser.add_argument('--n_clusters', type=int, default=500, help="Number of samples profiles, default 500")
+parser.add_argument('--top_k', type=int, default=10, help="Number of neighbours, default 10")
+parser.add_argument('--seed', type=int, default=0)
+
+args = parser.parse_args()
+
+rng = np.random.default_rng(args.seed)
+matrix = random_memo_matrix(args.n_samples + args.n_queries, args.n_words, args.words_per_sample, rng, n_clusters=args.n_clusters)
+words = [f'peak_{j}' for j in range(args.n_words)]
+samples = [f'sample_{i}' for i in range(matrix.shape[0])]
+indexed = SparseMemoMatrix(matrix[:args.n_samples], samples[:args.n_samples], words)
+queries = [dict(zip([words[j] for j in row.indices], row.data.tolist())) for row in matrix[args.n_samples:]]
+
+# Exact search: brute-force cosine over the sparse matrix
+norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+normalized = sparse.csr_matrix(sparse.diags(1 / np.where(norms == 0, 1, norms)) @ matrix)
+indexed_t = normalized[:args.n_samples].T.tocsr()
+start = time.perf_counter()
+truth = []
+for i in range(args.n_samples, matrix.shape[0]):
+    scores = (normalized[i] @ indexed_t).toarray().ravel()
+    truth.append(set(np.argsort(-scores, kind='stable')[:args.top_k].tolist()))
+exact_ms = 1000 * (time.perf_counter() - start) / args.n_queries
+matrix_mb = (indexed_t.data.nbytes + indexed_t.indices.nbytes + indexed_t.indptr.nbytes) / 1e6
+print(json.dumps({'benchmark': 'memo_index', 'method': 'exact', 'n_samples': args.n_samples, 'query_ms': round(exact_ms, 3), 'recall': 1.0,
+                  'memory_mb': round(matrix_mb, 1)}))
+
+with tempfile.TemporaryDirectory() as tmp:
+    index = MemoIndex(os.path.join(tmp, 'index.db'))
+    start = time.perf_counter()
+    index.add_matrix(indexed)
+    build_s = time.perf_counter() - start
+    index.query(queries[0], k=args.top_k)
+    position = {sample_id: i for i, sample_id in enumerate(samples)}
+    found = 0
+    start = time.perf_counter()
+    for query, expected in zip(queries, truth):
+        neighbours = index.query(query, k=args.top_k)
+        found += len({position[sample_id] for sample_id, _ in neighbours} & expected)
+    query_ms = 1000 * (time.perf_counter() - start) / args.n_queries
+    postings = index._postings
+    print(json.dumps({'benchmark': 'memo_index', 'method': 'index', 'n_samples': args.n_samples, 'build_s': round(build_s, 3),
+                      'query_ms': round(query_ms, 3), 'recall': round(found / (args.top_k * args.n_queries), 4),
+                      'memory_mb': round((postings.data.nbytes + postings.indices.nbytes + postings.indptr.nbytes) / 1e6, 1)}))
+    start = time.perf_counter()
+    index.add_matrix(SparseMemoMatrix(matrix[args.n_samples:], samples[args.n_samples:], words))
+    print(json.dumps({'benchmark': 'memo_index', 'method': 'incremental_add', 'n_added': args.n_queries,
+                      'add_s': round(time.perf_counter() - start, 3)}))
+    index.close()
@@ -0,0 +1,48 @@
+import os
+import argparse
+import json
+import tempfile
+import textwrap
+import time
+
+import numpy as np
+
+from enpkg_meta_analysis.memo_distances import METRICS, pairwise_distances, pcoa
+from synthetic import random_memo_matrix
+
+""" Argument parser """
+parser = argparse.ArgumentParser(
+    formatter_class=argparse.RawDescriptionHelpFormatter,
+    description=textwrap.dedent('''\
+        Runtime of memo_similarity stages on a random MEMO-like count matrix.
+        '''))
+
+parser.add_argument('--n_samples', nargs='+', type=int, default=[1000, 5000, 10000], help="Numbers of samples to benchmark, default 1000 5000 10000")
+parser.add_argument('--n_words', type=int, default=50000, help="Number of words, default 50000")
+parser.add_argument('--words_per_sample', type=int, default=500, help="Average number of words per sample, default 500")
+parser.add_argument('--metric', nargs='+', choices=METRICS, default=METRICS, help="Metrics to benchmark, default all")
+parser.add_argument('--n_components', type=int, default=10, help="Number of PCoA axes, 0 to skip the PCoA, default 10")
+parser.add_argument('--block_size', type=int, default=256, help="Distance block size, default 256")
+parser.add_argument('--n_jobs', type=int, default=-1, help="Number of processes, default -1 (all cores)")
+parser.add_argument('--seed', type=int, default=0)
+
+args = parser.parse_args()
+
+
+rng = np.random.default_rng(args.seed)
+with tempfile.TemporaryDirectory() as tmp:
+    for n_samples in args.n_samples:
+        matrix = random_memo_matrix(n_samples, args.n_words, args.words_per_sample, rng)
+        for metric in args.metric:
+            distance_path = os.path.join(tmp, f'{metric}_{n_samples}.npy')
+            start = time.perf_counter()
+            _, _, squared_sums = pairwise_distances(matrix, metric, distance_path=distance_path,
+                                                    block_size=args.block_size, n_jobs=args.n_jobs)
+            record = {'benchmark': 'memo_similarity', 'n_samples': n_samples, 'n_words': args.n_words, 'nnz': int(matrix.nnz),
+                      'metric': metric, 'n_jobs': args.n_jobs, 'distances_s': round(time.perf_counter() - start, 3)}
+            if args.n_components > 0:
+                start = time.perf_counter()
+                pcoa(distance_path, [str(i) for i in range(n_samples)], squared_sums, n_components=args.n_components)
+                record['pcoa_s'] = round(time.perf_counter() - start, 3)
+            os.remove(distance_path)
+            print(json.dumps(record))
@@ -0,0 +1,184 @@
+import io
+import json
+import threading
+import time
+import zipfile
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+NPC_PATHWAYS = ['Alkaloids', 'Terpenoids', 'Polyketides', 'Fatty acids', 'Shikimates and Phenylpropanoids']
+
+
+class MockServices:
+    """ Local stand-ins of the NPClassifier, Wikidata SPARQL, ChEMBL activity and GNPS download services
+
+    The services answer from synthetic structures (see synthetic.random_structures) after a fixed latency,
+    and answer 503 to a fraction error_rate of the requests, so that clients retries are exercised. GNPS
+    archives are served with HTTP range support. Use as a context manager; the URLs to give to the scripts are
+    npc_url, wd_url, chembl_url and gnps_url.
+
+    Args:
+        structures (list): (short_inchikey, smiles) pairs
+        n_activities (int): number of activities of each ChEMBL target
+        latency (float): latency of each request, in seconds
+        error_rate (float): fraction of requests answered with a 503 error
+        seed (int): seed of the errors and of the synthetic answers
+        truncated_gnps (int): number of GNPS archive answers cut in the middle (the connection is closed after
+            half of the announced bytes), so that clients range resumes are exercised
+    """
+
+    def __init__(self, structures, n_activities=5000, latency=0.0, error_rate=0.0, seed=0, truncated_gnps=0):
+        self.structures = structures
+        self.truncated_gnps = truncated_gnps
+        # Start byte of each GNPS archive request (0 without Range header)
+        self.gnps_ranges = []
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = np.random.default_rng(seed)
+        self.lock = threading.Lock()
+        self.counts = {}
+        picks = self.rng.integers(0, len(structures), n_activities)
+        self.activities = [{'activity_comment': None, 'molecule_chembl_id': f'CHEMBL{j}', 'canonical_smiles': structures[j][1],
+                            'standard_relation': '=', 'target_chembl_id': None, 'standard_type': 'IC50',
+                            'target_pref_name': 'Synthetic target', 'standard_units': 'nM',
+                            'standard_value': f'{self.rng.uniform(1, 10000):.2f}', 'data_validity_comment': None,
+                            'document_journal': ['J Nat Prod', 'J Med Chem', None][j % 3], 'assay_chembl_id': f'CHEMBL_A{j % 50}',
+                            'document_chembl_id': f'CHEMBL_D{j % 20}'} for j in picks]
+        self.archives = {}
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.thread = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server.server_port}'
+
+    @property
+    def npc_url(self):
+        return self.url + '/npclassifier/classify?smiles='
+
+    @property
+    def wd_url(self):
+        return self.url + '/wikidata/sparql'
+
+    @property
+    def chembl_url(self):
+        return self.url + '/chembl'
+
+    @property
+    def gnps_url(self):
+        return self.url + '/gnps/ProteoSAFe/DownloadResult'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _count(self, service):
+        with self.lock:
+            self.counts[service] = self.counts.get(service, 0) + 1
+            return self.rng.random() < self.error_rate
+
+    def wikidata_csv(self):
+        """ Wikidata P235 dump of the structures (one of two being in Wikidata) """
+        rows = ['ik,wd,isomeric_smiles']
+        rows += [f'{short_inchikey}-UHFFFAOYSA-N,http://www.wikidata.org/entity/Q{i},{smiles}'
+                 for i, (short_inchikey, smiles) in enumerate(self.structures) if i % 2 == 0]
+        return ('\n'.join(rows) + '\n').encode()
+
+    def gnps_archive(self, task):
+        """ Zip archive of a GNPS job: library annotations of structures and a larger unused clustering table """
+        if task not in self.archives:
+            rng = np.random.default_rng(len(self.archives))
+            picks = rng.integers(0, len(self.structures), 2000)
+            annotations = 'SpectrumID\tCompound_Name\tSmiles\tINCHI\tMQScore\n' + ''.join(
+                f'CCMSLIB{j}\tsynthetic {j}\t{self.structures[j][1]}\t\t{rng.random():.3f}\n' for j in picks)
+            buffer = io.BytesIO()
+            with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+                archive.writestr(f'result_specnets_DB/{task}.tsv', annotations)
+                archive.writestr('clusterinfo_summary/clusters.tsv', rng.bytes(2000000).hex())
+                archive.writestr('params.xml', f'<parameters><parameter name="task">{task}</parameter></parameters>')
+            self.archives[task] = buffer.getvalue()
+        return self.archives[task]
+
+    def _handler(self):
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body=b'', headers=None):
+                self.send_response(status)
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _answer(self, service, errors=True):
+                time.sleep(services.latency)
+                if services._count(service) and errors:
+                    self._send(503)
+                    return False
+                return True
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                if url.path.startswith('/npclassifier'):
+                    if self._answer('npclassifier'):
+                        pathway = NPC_PATHWAYS[len(query.get('smiles', [''])[0]) % len(NPC_PATHWAYS)]
+                        body = {'pathway_results': [pathway], 'superclass_results': [pathway + ' superclass'], 'class_results': []}
+                        self._send(200, json.dumps(body).encode(), {'Content-Type': 'application/json'})
+                elif url.path.startswith('/wikidata'):
+                    # The Wikidata dump is a single request, that the index does not retry
+                    if self._answer('wikidata', errors=False):
+                        self._send(200, services.wikidata_csv(), {'Content-Type': 'text/csv'})
+                elif url.path.startswith('/chembl'):
+                    if self._answer('chembl'):
+                        limit, offset = int(query['limit'][0]), int(query['offset'][0])
+                        activities = [dict(activity, target_chembl_id=query['target_chembl_id'][0])
+                                      for activity in services.activities[offset:offset + limit]]
+                        body = {'activities': activities, 'page_meta': {'limit': limit, 'offset': offset, 'total_count': len(services.activities)}}
+                        self._send(200, json.dumps(body).encode(), {'Content-Type': 'application/json'})
+                else:
+                    self._send(404)
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                if not url.path.startswith('/gnps'):
+                    self._send(404)
+                    return
+                if self._answer('gnps'):
+                    archive = services.gnps_archive(parse_qs(url.query)['task'][0])
+                    start = int(self.headers['Range'].split('=')[1].rstrip('-')) if self.headers.get('Range') else 0
+                    with services.lock:
+                        services.gnps_ranges.append(start)
+                        truncated = services.truncated_gnps > 0
+                        services.truncated_gnps -= truncated
+                    if truncated:
+                        self.send_response(200)
+                        self.send_header('Content-Length', str(len(archive)))
+                        self.end_headers()
+                        self.wfile.write(archive[:len(archive) // 2])
+                        self.close_connection = True
+                    elif start > 0:
+                        self._send(206, archive[start:], {'Content-Range': f'bytes {start}-{len(archive) - 1}/{len(archive)}'})
+                    else:
+                        self._send(200, archive, {'Content-Type': 'application/zip'})
+
+        return Handler
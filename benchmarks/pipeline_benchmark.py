@@ -0,0 +1,154 @@
+import os
+import sys
+import argparse
+import json
+import platform
+import shutil
+import subprocess
+import tempfile
+import textwrap
+import time
+
+import numpy as np
+
+from enpkg_meta_analysis.run_report import git_commit
+from mock_services import MockServices
+from synthetic import make_sample_tree, random_structures
+
+REPO = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+STAGES = ['gnps_fetcher', 'chemo_info_fetcher', 'memo_unaligned_repo', 'memo_similarity', 'mgf_aggregator', 'download_chembl']
+BENCH_NAME = 'pipeline_benchmark'
+TARGET_ID = 'CHEMBL_BENCHMARK'
+
+""" Argument parser """
+parser = argparse.ArgumentParser(
+    formatter_class=argparse.RawDescriptionHelpFormatter,
+    description=textwrap.dedent('''\
+        End-to-end runtime, throughput and peak memory of the pipeline scripts, on synthetic sample directories
+        and with local mock NPClassifier, Wikidata, ChEMBL and GNPS services (no network access needed).
+         --------------------------------
+        Each script runs as in production (a subprocess, with --report), one JSON record per script and number of
+        samples is printed and appended to --output. Compare two record files with compare.py.
+        '''))
+
+parser.add_argument('--n_samples', nargs='+', type=int, default=[100, 1000], help="Numbers of samples to benchmark, default 100 1000")
+parser.add_argument('--spectra_per_sample', type=int, default=100, help="Number of spectra per sample and ionization mode, default 100")
+parser.add_argument('--annotations_per_sample', type=int, default=50, help="Number of ISDB and Sirius annotations per sample, default 50")
+parser.add_argument('--ionizations', nargs='+', choices=['pos', 'neg'], default=['pos', 'neg'], help="Ionization modes, default pos neg")
+parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES, help="Scripts to benchmark, default all")
+parser.add_argument('--n_activities', type=int, default=5000, help="Number of activities of the mock ChEMBL target, default 5000")
+parser.add_argument('--latency', type=float, default=0.0, help="Latency of the mock services, in seconds, default 0")
+parser.add_argument('--error_rate', type=float, default=0.0, help="Fraction of the mock services requests answered with a 503 error, default 0")
+parser.add_argument('--n_jobs', type=int, default=-1, help="Number of processes, default -1 (all cores)")
+parser.add_argument('--mgf_mode', choices=['serial', 'streaming', 'parallel'], default='serial',
+                    help="Aggregation mode of mgf_aggregator (see its --streaming and --parallel), default serial")
+parser.add_argument('--output', default=None, help="JSON lines file the records are appended to")
+parser.add_argument('--keep', action='store_true', help="Keep the synthetic sample directories and the run reports (their path is printed)")
+parser.add_argument('--seed', type=int, default=0)
+
+args = parser.parse_args()
+
+
+def commands(stage, tree, tmp, services):
+    """ Command line of a script on the synthetic tree, its inputs and outputs being in tmp """
+    ionization = 'both' if len(args.ionizations) == 2 else args.ionizations[0]
+    caches = ['--wd_index', os.path.join(tmp, 'wd_index.db'), '--wd_url', services.wd_url,
+              '--structure_cache', os.path.join(tmp, 'structures_cache.db')]
+    if stage == 'gnps_fetcher':
+        return ['--sample_dir_path', tree, '--job_id', BENCH_NAME, '--gnps_url', services.gnps_url]
+    if stage == 'chemo_info_fetcher':
+        gnps = ['--gnps_job_id', BENCH_NAME] if 'gnps_fetcher' in args.stages else []
+        return ['--sample_dir_path', tree, '--sql_name', BENCH_NAME + '.db', '--npc_url', services.npc_url, '--npc_rate', '0',
+                '--npc_cache', os.path.join(tmp, 'npc_cache.db'), '--n_jobs', str(args.n_jobs)] + gnps + caches
+    if stage == 'memo_unaligned_repo':
+        return ['--sample_dir_path', tree, '--ionization', ionization, '--output', BENCH_NAME, '--output_format', 'npz',
+                '--no_cache', '--n_jobs', str(args.n_jobs)]
+    if stage == 'memo_similarity':
+        return ['--sample_dir_path', tree, '--input', BENCH_NAME + '.npz', '--output', BENCH_NAME, '--n_jobs', str(args.n_jobs)]
+    if stage == 'mgf_aggregator':
+        mode = [] if args.mgf_mode == 'serial' else ['--' + args.mgf_mode]
+        return ['--sample_dir_path', tree, '--ionization', args.ionizations[0], '--output_name', BENCH_NAME,
+                '--n_jobs', str(args.n_jobs)] + mode
+    if stage == 'download_chembl':
+        return ['--target_id', TARGET_ID, '--chembl_url', services.chembl_url, '--chembl_rate', '0',
+                '--n_jobs', str(args.n_jobs)] + caches
+
+
+def clean_repo_outputs():
+    """ Remove the outputs the scripts write in the repository output_data folder """
+    for path in [os.path.join(REPO, 'output_data', 'sql_db', BENCH_NAME + suffix) for suffix in ('.db', '.db-wal', '.db-shm')]:
+        if os.path.exists(path):
+            os.remove(path)
+    chembl = os.path.join(REPO, 'output_data', 'chembl')
+    shutil.rmtree(os.path.join(chembl, 'pages', TARGET_ID), ignore_errors=True)
+    if os.path.isdir(chembl):
+        for name in os.listdir(chembl):
+            if name.startswith(TARGET_ID):
+                os.remove(os.path.join(chembl, name))
+    # Folders created by the benchmark, left if they hold other outputs
+    for path in ['chembl/pages', 'chembl', 'sql_db', '']:
+        try:
+            os.rmdir(os.path.join(REPO, 'output_data', path))
+        except OSError:
+            pass
+
+
+def run_stage(stage, tree, tmp, services):
+    """ Run a script and summarise its run report as a record """
+    report_path = os.path.join(tmp, f'{stage}_run_report.json')
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, '-m', 'enpkg_meta_analysis.' + stage] + commands(stage, tree, tmp, services)
+                             + ['--report', report_path], cwd=REPO, capture_output=True, text=True)
+    record = {'stage': stage, 'returncode': process.returncode, 'process_wall_time_s': round(time.perf_counter() - start, 3)}
+    if process.returncode != 0:
+        print(f'{stage} failed:\n' + '\n'.join(process.stderr.splitlines()[-10:]), file=sys.stderr)
+    if not os.path.exists(report_path):
+        record['status'] = 'failed'
+        return record
+    with open(report_path) as f:
+        report = json.load(f)
+    peaks = [report['peak_rss_mb'], report['peak_rss_children_mb']]
+    record.update({
+        'status': report['status'] if process.returncode == 0 else 'failed',
+        'wall_time_s': report['wall_time_s'],
+        'peak_rss_mb': max(peak for peak in peaks if peak is not None) if any(peak is not None for peak in peaks) else None,
+        'stages': {stage['stage']: {'wall_time_s': stage['wall_time_s'], 'items_per_s': stage['items_per_s']} for stage in report['stages']},
+        'http_requests': {service: summary['requests'] for service, summary in report['http'].items()},
+        'caches': {name: cache['hit_rate'] for name, cache in report['caches'].items()},
+    })
+    return record
+
+
+environment = {'git_commit': git_commit(), 'python': platform.python_version(), 'cpu_count': os.cpu_count()}
+parameters = {'spectra_per_sample': args.spectra_per_sample, 'annotations_per_sample': args.annotations_per_sample,
+              'ionizations': '+'.join(args.ionizations), 'n_jobs': args.n_jobs, 'mgf_mode': args.mgf_mode, 'latency': args.latency, 'error_rate': args.error_rate}
+
+output = open(args.output, 'a') if args.output else None
+rng = np.random.default_rng(args.seed)
+for n_samples in args.n_samples:
+    tmp = tempfile.mkdtemp(prefix=f'enpkg_benchmark_{n_samples}_')
+    tree = os.path.join(tmp, 'samples')
+    structures = random_structures(max(1000, n_samples * args.annotations_per_sample // 10), rng)
+    start = time.perf_counter()
+    make_sample_tree(tree, n_samples, rng, spectra_per_sample=args.spectra_per_sample, ionizations=args.ionizations,
+                     structures=structures, annotations_per_sample=args.annotations_per_sample)
+    records = [{'stage': 'generate', 'status': 'completed', 'process_wall_time_s': round(time.perf_counter() - start, 3)}]
+    try:
+        with MockServices(structures, n_activities=args.n_activities, latency=args.latency, error_rate=args.error_rate,
+                          seed=args.seed) as services:
+            for stage in STAGES:
+                if stage in args.stages:
+                    records.append(run_stage(stage, tree, tmp, services))
+    finally:
+        clean_repo_outputs()
+        if args.keep:
+            print(f'Samples and run reports kept in {tmp}', file=sys.stderr)
+        else:
+            shutil.rmtree(tmp)
+    for record in records:
+        record = dict({'benchmark': 'pipeline', 'n_samples': n_samples}, **parameters, **record, **environment)
+        print(json.dumps(record))
+        if output is not None:
+            output.write(json.dumps(record) + '\n')
+if output is not None:
+    output.close()
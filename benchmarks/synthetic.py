@@ -0,0 +1,108 @@
+import hashlib
+import os
+
+import numpy as np
+from scipy import sparse
+
+
+def random_memo_matrix(n_samples, n_words, words_per_sample, rng, n_clusters=None, noise=0.3):
+    """ Sparse counts with Zipf-distributed words and geometric counts, as in MEMO matrices
+
+    With n_clusters, each sample draws most of its words from one of n_clusters random profiles (and a
+    fraction noise uniformly at random), so that samples have meaningful nearest neighbours.
+    """
+    nnz = n_samples * words_per_sample
+    rows = np.repeat(np.arange(n_samples), words_per_sample)
+    cols = np.minimum(rng.zipf(1.3, nnz) - 1, n_words - 1)
+    if n_clusters is not None:
+        profiles = rng.integers(0, n_words, size=(n_clusters, words_per_sample))
+        clusters = np.repeat(rng.integers(0, n_clusters, n_samples), words_per_sample)
+        from_profile = rng.random(nnz) >= noise
+        picks = rng.integers(0, profiles.shape[1], nnz)
+        cols = np.where(from_profile, profiles[clusters, picks], rng.integers(0, n_words, nnz))
+    counts = rng.geometric(0.5, nnz).astype(np.float64)
+    return sparse.csr_matrix((counts, (rows, cols)), shape=(n_samples, n_words))
+
+
+FRAGMENTS = ['C', 'CC', 'O', 'N', 'C(=O)O', 'C(C)C', 'c1ccccc1', 'C(=O)N', 'OC', 'C=C']
+SIRIUS_COLUMNS = ['formulaRank', 'ConfidenceScore', 'CSI:FingerIDScore', 'molecularFormula', 'adduct', 'InChIkey2D', 'InChI',
+                  'name', 'smiles', 'xlogp', 'pubchemids', 'links', 'dbflags', 'ionMass', 'retentionTimeInSeconds', 'id', 'featureId']
+ISDB_COLUMNS = ['feature_id', 'score_final', 'rank_final', 'short_inchikey', 'structure_smiles_2D', 'structure_molecular_formula',
+                'structure_taxonomy_npclassifier_01pathway', 'structure_taxonomy_npclassifier_02superclass',
+                'structure_taxonomy_npclassifier_03class', 'organism_name']
+NPC_PATHWAYS = ['Alkaloids', 'Terpenoids', 'Polyketides', 'Fatty acids', 'Shikimates and Phenylpropanoids']
+
+
+def random_structures(n_structures, rng):
+    """ n_structures distinct (short_inchikey, smiles) pairs: valid SMILES chained from a few fragments, with
+    pseudo short InChIKeys derived from them (RDKit gives the real InChIKey of parsed SMILES) """
+    structures = {}
+    while len(structures) < n_structures:
+        smiles = 'C' + ''.join(rng.choice(FRAGMENTS, rng.integers(1, 12)))
+        if smiles not in structures:
+            digest = hashlib.blake2b(smiles.encode(), digest_size=14).digest()
+            structures[smiles] = ''.join(chr(ord('A') + byte % 26) for byte in digest)
+    return [(short_inchikey, smiles) for smiles, short_inchikey in structures.items()]
+
+
+def _zipf_picks(n_items, size, rng):
+    """ Indices of size items among n_items, a few items being frequent as annotations across samples """
+    return np.minimum(rng.zipf(1.5, size) - 1, n_items - 1)
+
+
+def write_mgf(path, n_spectra, rng, peaks_per_spectrum=20):
+    """ Write n_spectra random MS2 spectra in the format of the ENPKG <sample>_features_ms2_<ion>.mgf files """
+    with open(path, 'w') as f:
+        for feature_id in range(1, n_spectra + 1):
+            precursor = rng.uniform(100, 1000)
+            mz = np.sort(rng.uniform(50, precursor, peaks_per_spectrum))
+            intensities = rng.uniform(1, 1000, peaks_per_spectrum)
+            f.write(f'BEGIN IONS\nFEATURE_ID={feature_id}\nPEPMASS={precursor:.4f}\nSCANS={feature_id}\n'
+                    f'RTINSECONDS={rng.uniform(0, 600):.1f}\nCHARGE=1\nMSLEVEL=2\n')
+            f.writelines(f'{m:.4f} {i:.1f}\n' for m, i in zip(mz, intensities))
+            f.write('END IONS\n\n')
+
+
+def make_sample_tree(root, n_samples, rng, spectra_per_sample=100, ionizations=('pos', 'neg'), structures=None,
+                     annotations_per_sample=50, blank_fraction=0.05):
+    """ Write a synthetic samples directory following the ENPKG layout (see sample_discovery.SampleFiles)
+
+    Each sample has a metadata file (a fraction blank_fraction of blanks) and, for each ionization mode, an .mgf
+    file of spectra_per_sample spectra, ISDB and Sirius annotation files of annotations_per_sample structures
+    drawn from structures (frequent structures being annotated in many samples, as in real cohorts).
+
+    Returns:
+        list: the sample ids
+    """
+    if structures is None:
+        structures = random_structures(max(1000, n_samples * annotations_per_sample // 10), rng)
+    samples = []
+    for i in range(n_samples):
+        sample_id = f'SYN{i:06d}'
+        sample_type = 'blank' if rng.random() < blank_fraction else 'sample'
+        os.makedirs(os.path.join(root, sample_id), exist_ok=True)
+        with open(os.path.join(root, sample_id, sample_id + '_metadata.tsv'), 'w') as f:
+            f.write(f'sample_id\tsample_type\tmassive_id\n{sample_id}\t{sample_type}\tMSV000000000\n')
+        for ionization in ionizations:
+            path = os.path.join(root, sample_id, ionization)
+            os.makedirs(os.path.join(path, 'isdb'), exist_ok=True)
+            os.makedirs(os.path.join(path, sample_id + '_WORKSPACE_SIRIUS'), exist_ok=True)
+            write_mgf(os.path.join(path, f'{sample_id}_features_ms2_{ionization}.mgf'), spectra_per_sample, rng)
+            picks = _zipf_picks(len(structures), annotations_per_sample, rng)
+            with open(os.path.join(path, 'isdb', f'{sample_id}_isdb_reweighted_flat_{ionization}.tsv'), 'w') as f:
+                f.write('\t'.join(ISDB_COLUMNS) + '\n')
+                for rank, j in enumerate(picks):
+                    short_inchikey, smiles = structures[j]
+                    pathway = NPC_PATHWAYS[j % len(NPC_PATHWAYS)]
+                    f.write(f'{rank + 1}\t{rng.random():.3f}\t1\t{short_inchikey}\t{smiles}\tC10H10O\t{pathway}\t{pathway} superclass\t'
+                            f'{pathway} class\tSynthetica {j % 97}\n')
+            picks = _zipf_picks(len(structures), annotations_per_sample, rng)
+            with open(os.path.join(path, sample_id + '_WORKSPACE_SIRIUS', 'compound_identifications.tsv'), 'w') as f:
+                f.write('\t'.join(SIRIUS_COLUMNS) + '\n')
+                for rank, j in enumerate(picks):
+                    short_inchikey, smiles = structures[j]
+                    f.write(f'1\t{rng.random():.3f}\t{-rng.random() * 100:.2f}\tC10H10O\t[M+H]+\t{short_inchikey}\tInChI=1S/X\t'
+                            f'synthetic {j}\t{smiles}\t1.0\t{j}\tPubChem:({j})\t1\t{rng.uniform(100, 1000):.4f}\t'
+                            f'{rng.uniform(0, 600):.1f}\t{rank}_{sample_id}\t{rank + 1}\n')
+        samples.append(sample_id)
+    return samples
@@ -0,0 +1,4 @@
+""" Meta-analysis of ENPKG sample directories: annotations metadata, MEMO matrices, spectra aggregation and ChEMBL activities
+
+Each command of the enpkg entry point (see enpkg.py) is a module of this package, with build_parser(), run(args) and main(argv).
+"""
@@ -0,0 +1,3 @@
+from .enpkg import main
+
+main()
@@ -0,0 +1,238 @@
+import json
+import os
+import shutil
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from tqdm import tqdm
+
+from .npc_client import TokenBucket, RETRY_STATUS
+
+CHEMBL_API = 'https://www.ebi.ac.uk/chembl/api/data'
+ACTIVITY_FIELDS = ['activity_comment', 'molecule_chembl_id', 'canonical_smiles', 'standard_relation', 'target_chembl_id',
+                   'standard_type', 'target_pref_name', 'standard_units', 'standard_value', 'data_validity_comment',
+                   'document_journal', 'assay_chembl_id', 'document_chembl_id']
+# The ChEMBL API serves at most 1000 records per page
+MAX_PAGE_SIZE = 1000
+
+
+class ChEMBLActivityDownloader:
+    """ Paginated, concurrent and resumable download of the activities of a ChEMBL target
+
+    The first page gives the number of activities; the other pages are then fetched concurrently from a thread
+    pool sharing one pooled HTTP session, rate-limited and retried with exponential backoff as NPCClient.
+    Each page is checkpointed as a JSON file in checkpoint_dir/<target_id>/ as soon as it is received, so
+    that an interrupted download resumes with the missing pages only.
+
+    Args:
+        checkpoint_dir (str): directory of the pages checkpoints
+        chembl_api (str): ChEMBL API URL (a local stand-in server can be used)
+        max_workers (int): number of concurrent requests
+        rate (float): maximal number of requests per second (<= 0 to disable rate limiting)
+        page_size (int): number of activities per page, at most 1000
+        max_retries (int): number of retries of a failed request
+        backoff_factor (float): retry n waits backoff_factor * 2 ** n seconds
+        timeout (float): timeout of a single request, in seconds
+    """
+
+    def __init__(self, checkpoint_dir, chembl_api=CHEMBL_API, max_workers=4, rate=5, page_size=MAX_PAGE_SIZE,
+                 max_retries=5, backoff_factor=0.5, timeout=60):
+        self.checkpoint_dir = checkpoint_dir
+        self.chembl_api = chembl_api.rstrip('/')
+        self.max_workers = max_workers
+        self.page_size = min(page_size, MAX_PAGE_SIZE)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def target_dir(self, target_id):
+        return os.path.join(self.checkpoint_dir, target_id)
+
+    def page_path(self, target_id, offset):
+        return os.path.join(self.target_dir(target_id), f'page_{offset:09d}.json')
+
+    def fetch_page(self, target_id, offset):
+        """ Return the JSON response of the activities page starting at offset """
+        params = {'target_chembl_id': target_id, 'standard_value__isnull': 'false', 'only': ','.join(ACTIVITY_FIELDS),
+                  'limit': self.page_size, 'offset': offset}
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            try:
+                response = self.session.get(self.chembl_api + '/activity.json', params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                response = None
+            if response is not None and response.status_code not in RETRY_STATUS:
+                response.raise_for_status()
+                return response.json()
+            if attempt == self.max_retries:
+                if response is None:
+                    raise requests.ConnectionError(f'ChEMBL activities page {offset} of {target_id} could not be fetched')
+                response.raise_for_status()
+            time.sleep(self.backoff_factor * 2 ** attempt)
+
+    def _save_page(self, target_id, offset, activities):
+        """ Write a page atomically: a partially written page is never resumed """
+        path = self.page_path(target_id, offset)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(activities, f)
+        os.replace(path + '.tmp', path)
+
+    def _load_page(self, target_id, offset):
+        with open(self.page_path(target_id, offset)) as f:
+            return json.load(f)
+
+    def _download_page(self, target_id, offset):
+        activities = self.fetch_page(target_id, offset)['activities']
+        self._save_page(target_id, offset, activities)
+        return offset, activities
+
+    def _manifest(self, target_id, refresh=False):
+        """ Number of activities of the target, from the checkpoint manifest or from the first page """
+        manifest_path = os.path.join(self.target_dir(target_id), 'manifest.json')
+        if refresh:
+            shutil.rmtree(self.target_dir(target_id), ignore_errors=True)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            if manifest['page_size'] == self.page_size:
+                return manifest['total_count']
+            shutil.rmtree(self.target_dir(target_id))
+        os.makedirs(self.target_dir(target_id), exist_ok=True)
+        first_page = self.fetch_page(target_id, 0)
+        self._save_page(target_id, 0, first_page['activities'])
+        manifest = {'target_id': target_id, 'page_size': self.page_size, 'total_count': first_page['page_meta']['total_count'],
+                    'downloaded_at': time.strftime('%Y-%m-%dT%H:%M:%S')}
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f)
+        return manifest['total_count']
+
+    def iter_pages(self, target_id, refresh=False):
+        """ Yield (offset, activities DataFrame) for every page of the target, checkpointed pages first,
+        then downloaded pages as soon as they are received (not in offset order)
+
+        At most 2 * max_workers pages are in flight at any time. With refresh, checkpointed pages are discarded.
+        """
+        total_count = self._manifest(target_id, refresh=refresh)
+        offsets = list(range(0, total_count, self.page_size)) or [0]
+        missing = [offset for offset in offsets if not os.path.exists(self.page_path(target_id, offset))]
+        with tqdm(total=len(offsets), desc=f'{target_id} pages') as progress:
+            for offset in offsets:
+                if offset not in missing:
+                    progress.update(1)
+                    yield offset, pd.DataFrame(self._load_page(target_id, offset), columns=ACTIVITY_FIELDS)
+            remaining = iter(missing)
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                pending = set()
+                exhausted = False
+                while pending or not exhausted:
+                    while not exhausted and len(pending) < 2 * self.max_workers:
+                        offset = next(remaining, None)
+                        if offset is None:
+                            exhausted = True
+                        else:
+                            pending.add(executor.submit(self._download_page, target_id, offset))
+                    if not pending:
+                        break
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        offset, activities = future.result()
+                        progress.update(1)
+                        yield offset, pd.DataFrame(activities, columns=ACTIVITY_FIELDS)
+
+
+# Same selection as the API activity resource (ACTIVITY_FIELDS), from the tables of a ChEMBL release
+RELEASE_ACTIVITY_QUERY = '''
+    SELECT act.activity_comment AS activity_comment, md.chembl_id AS molecule_chembl_id,
+           cs.canonical_smiles AS canonical_smiles, act.standard_relation AS standard_relation,
+           td.chembl_id AS target_chembl_id, act.standard_type AS standard_type, td.pref_name AS target_pref_name,
+           act.standard_units AS standard_units, act.standard_value AS standard_value,
+           act.data_validity_comment AS data_validity_comment, d.journal AS document_journal,
+           a.chembl_id AS assay_chembl_id, d.chembl_id AS document_chembl_id
+    FROM target_dictionary td
+    JOIN assays a ON a.tid = td.tid
+    JOIN activities act ON act.assay_id = a.assay_id
+    JOIN molecule_dictionary md ON md.molregno = act.molregno
+    LEFT JOIN compound_structures cs ON cs.molregno = act.molregno
+    LEFT JOIN docs d ON d.doc_id = act.doc_id
+    WHERE td.chembl_id = ? AND act.standard_value IS NOT NULL
+    ORDER BY act.activity_id'''
+# Indexes used by RELEASE_ACTIVITY_QUERY, shipped with the ChEMBL SQLite releases
+RELEASE_INDEXES = {'assays': 'tid', 'activities': 'assay_id'}
+
+
+class ChEMBLRelease:
+    """ Activities of ChEMBL targets from a local ChEMBL SQLite release, as ChEMBLActivityDownloader does
+    from the API (same columns, same pages), for offline use
+
+    The release (chembl_XX_sqlite/chembl_XX.db, from https://ftp.ebi.ac.uk/pub/databases/chembl/ChEMBLdb/latest/)
+    is opened read-only. The query only reads the activities of the target, through the indexes of
+    assays.tid and activities.assay_id; missing indexes are reported, since the query then scans the tables.
+
+    Args:
+        path (str): path to the ChEMBL SQLite DB
+        page_size (int): number of activities per page
+    """
+
+    def __init__(self, path, page_size=MAX_PAGE_SIZE):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f'ChEMBL release {path} not found')
+        self.path = path
+        self.page_size = page_size
+        self.conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+        for table, column in RELEASE_INDEXES.items():
+            indexed = {info[2] for index in self.conn.execute(f'PRAGMA index_list({table})')
+                       for info in self.conn.execute(f'PRAGMA index_info({index[1]})') if info[0] == 0}
+            if column not in indexed:
+                print(f'Warning: {table}.{column} is not indexed in {path}, queries will be slow')
+
+    def version(self):
+        """ Name of the ChEMBL release, None if the DB has no version table """
+        try:
+            row = self.conn.execute('SELECT name FROM version').fetchone()
+        except sqlite3.OperationalError:
+            return None
+        return None if row is None else row[0]
+
+    def iter_pages(self, target_id, refresh=False):
+        """ Yield (offset, activities DataFrame) for every page of the target, in offset order
+
+        refresh is ignored: it is only there for compatibility with ChEMBLActivityDownloader.iter_pages.
+        """
+        cursor = self.conn.execute(RELEASE_ACTIVITY_QUERY, (target_id,))
+        columns = [description[0] for description in cursor.description]
+        offset = 0
+        while True:
+            rows = cursor.fetchmany(self.page_size)
+            if len(rows) == 0 and offset > 0:
+                break
+            yield offset, pd.DataFrame(rows, columns=columns)
+            if len(rows) < self.page_size:
+                break
+            offset += len(rows)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,281 @@
+import pandas as pd 
+import os
+from pathlib import Path
+import argparse
+import requests
+import textwrap
+from .npc_client import NPCClient, NPC_API
+from . import structures_db
+from . import wikidata_index
+from . import sample_discovery
+from . import structure_engine
+from . import npc_cache
+from . import run_report
+from functools import partial
+from contextlib import closing
+
+# Relative paths (arguments and outputs) are relative to the repository
+REPO_ROOT = Path(__file__).parents[2]
+
+DESCRIPTION = textwrap.dedent('''\
+        This script generates an SQL DB (structures_metadata.db) in the /output_data/sql_db/ with WD ID and NPClassfier taxonomy for annotated structures.
+        ''')
+
+""" Argument parser """
+
+def build_parser(prog=None):
+    parser = argparse.ArgumentParser(prog=prog, formatter_class=argparse.RawDescriptionHelpFormatter, description=DESCRIPTION)
+    parser.add_argument('-p', '--sample_dir_path', required=True,
+                        help='The path to the directory where samples folders to process are located')
+    parser.add_argument('-sql', '--sql_name', default = 'structures_metadata.db',
+                        help='The name of a previsouly generated SQL DB (that will be updated with new structures). \
+                            If no SQL DB is available, will create new one /output_data/sql_db/')
+    parser.add_argument('-id', '--gnps_job_id', required = False, 
+                        help='The GNPS job ID of the meta-MN corresponding to sample_dir_path')
+    parser.add_argument('--npc_workers', type=int, default=8,
+                        help='Number of concurrent requests to the NPClassifier API, default 8')
+    parser.add_argument('--npc_rate', type=float, default=10,
+                        help='Maximal number of NPClassifier requests per second (0 for no limit), default 10')
+    parser.add_argument('--npc_retries', type=int, default=5,
+                        help='Number of retries (with exponential backoff) of a failed NPClassifier request, default 5')
+    parser.add_argument('--npc_url', default=NPC_API,
+                        help=f'NPClassifier API URL, the SMILES is appended to it. Default {NPC_API}')
+    parser.add_argument('--npc_batch_size', type=int, default=500,
+                        help='Number of NPClassifier results checkpointed to the SQL DB at once, default 500')
+    parser.add_argument('--n_jobs', type=int, default=-1,
+                        help='Number of processes used to load the samples annotation files and process structures, default -1 (all cores)')
+    parser.add_argument('--structure_cache', default=structure_engine.DEFAULT_CACHE_PATH,
+                        help='Path to the cache of processed structures (shared with download_chembl.py). Default output_data/sql_db/structures_cache.db')
+    parser.add_argument('--npc_cache', default=npc_cache.DEFAULT_CACHE_PATH,
+                        help='Path to the NPClassifier results cache, shared between projects. Default output_data/sql_db/npc_cache.db')
+    parser.add_argument('--npc_ttl', type=float, default=30,
+                        help="Number of days after which 'unknown' NPClassifier results are classified again, default 30")
+    parser.add_argument('--wd_index', default=wikidata_index.DEFAULT_INDEX_PATH,
+                        help='Path to the local Wikidata InChIKey index, built on first use. Default output_data/wikidata/inchikey_index.db')
+    parser.add_argument('--wd_max_age', type=float, default=None,
+                        help='Refresh the Wikidata InChIKey index if it is older than this number of days. Default: never refresh')
+    parser.add_argument('--wd_url', default=wikidata_index.WD_URL,
+                        help=f'Wikidata SPARQL endpoint used to build the InChIKey index, default {wikidata_index.WD_URL}')
+    run_report.add_arguments(parser)
+    return parser
+
+""" Functions """
+
+def select_new_structures(candidates, processed_ik, conn, checkpoint=None, npc_cache=None):
+    """ Anti-join of the {short IK: smiles} candidates with the short IK already processed, in DB, checkpointed or cached
+
+    Short IK in DB without any NPClassifier class are selected again once their 'unknown' result expired in npc_cache.
+    Those missing from npc_cache (classified before it existed) are added to it as classified now, to expire later.
+
+    Returns:
+        query (dict): {short IK: smiles} of the new structures, to classify with NPClassifier
+        resumed (dict): {short IK: metadata} of the structures classified by an interrupted run
+        cached (dict): {short IK: metadata} of the structures found in npc_cache
+        retried (set): short IK in DB selected again because their 'unknown' result expired
+    """
+    known = set(processed_ik)
+    candidates = {sik: smiles for sik, smiles in candidates.items() if sik not in known}
+    known = structures_db.known_short_inchikeys(conn, candidates.keys())
+    retried = set()
+    if npc_cache is not None:
+        unknown = structures_db.unknown_short_inchikeys(conn, known)
+        npc_cache.seed_unknown({sik: candidates[sik] for sik in unknown})
+        retried = unknown - set(npc_cache.get_many(unknown))
+        known -= retried
+    query = {sik: smiles for sik, smiles in candidates.items() if sik not in known}
+    resumed = {}
+    if checkpoint:
+        resumed = {sik: checkpoint[sik] for sik in query if sik in checkpoint}
+        query = {sik: smiles for sik, smiles in query.items() if sik not in resumed}
+    cached = {}
+    if npc_cache is not None:
+        cached = npc_cache.get_many(query)
+        query = {sik: smiles for sik, smiles in query.items() if sik not in cached}
+    return query, resumed, cached, retried
+
+ISDB_COLUMNS = {
+    'short_inchikey': 'short_inchikey',
+    'structure_smiles_2D': 'smiles',
+    'structure_taxonomy_npclassifier_01pathway': 'npc_pathway',
+    'structure_taxonomy_npclassifier_02superclass': 'npc_superclass',
+    'structure_taxonomy_npclassifier_03class': 'npc_class',
+}
+
+def load_isdb_metadata(samples, conn, n_jobs=-1):
+    """ Load the metadata of the short IK annotated by ISDB in all samples and not yet in DB
+
+    Only the needed columns of the pos/neg ISDB results are read, in a process pool. All samples are concatenated,
+    deduplicated once (keeping the first annotation, in samples order) and anti-joined with the DB keys.
+    """
+    isdb_files = sample_discovery.select_files(samples, 'isdb')
+    isdb_annotations = sample_discovery.load_files(partial(pd.read_csv, sep='\t', usecols=list(ISDB_COLUMNS)),
+                                                   isdb_files, n_jobs=n_jobs)
+    if len(isdb_annotations) == 0:
+        return {}
+
+    isdb_annotations = pd.concat(isdb_annotations, ignore_index=True).rename(columns=ISDB_COLUMNS)
+    isdb_annotations = isdb_annotations.dropna(subset=['short_inchikey']).drop_duplicates(subset=['short_inchikey'])
+    short_ik_in_db = structures_db.known_short_inchikeys(conn, isdb_annotations['short_inchikey'])
+    isdb_annotations = isdb_annotations[~isdb_annotations['short_inchikey'].isin(short_ik_in_db)]
+    return isdb_annotations.set_index('short_inchikey').to_dict(orient='index')
+
+def gnps_annotations_file(job_dir):
+    """ Path of the GNPS annotations table (the single .tsv file of <job_dir>/result_specnets_DB)
+
+    Files left by an interrupted extraction (.tmp) are ignored. Raises FileNotFoundError if there is no such
+    file, ValueError if there are several.
+    """
+    result_dir = os.path.join(job_dir, 'result_specnets_DB')
+    if not os.path.isdir(result_dir):
+        raise FileNotFoundError(f'No GNPS results in {result_dir}: download the job with gnps_fetcher.py first')
+    files = sorted(name for name in os.listdir(result_dir) if name.endswith('.tsv') and os.path.isfile(os.path.join(result_dir, name)))
+    if len(files) == 0:
+        raise FileNotFoundError(f'No .tsv GNPS annotations file in {result_dir}')
+    if len(files) > 1:
+        raise ValueError(f'Several .tsv files in {result_dir} ({", ".join(files)}): keep only the GNPS annotations file')
+    return os.path.join(result_dir, files[0])
+
+def get_gnps_structures(gnps_annotations, cache, n_jobs=-1):
+    """ {short IK: smiles} of the GNPS annotations, parsed from their SMILES or, when missing, from their InChI
+
+    Unique SMILES and InChI are processed once, in a process pool, through the structures cache.
+    """
+    has_smiles = gnps_annotations['Smiles'].notna() & (gnps_annotations['Smiles'] != ' ')
+    structures = []
+    for kind, inputs in [('smiles', gnps_annotations.loc[has_smiles, 'Smiles']),
+                         ('inchi', gnps_annotations.loc[~has_smiles, 'INCHI'].dropna())]:
+        structures.append(structure_engine.process_structures(inputs, kind=kind, cache=cache, n_jobs=n_jobs))
+    structures = pd.concat(structures)
+    return dict(zip(structures['inchikey'].str[:14], structures['smiles']))
+
+SIRIUS_COLUMNS = ['InChIkey2D', 'smiles']
+
+def load_sirius_structures(samples, n_jobs=-1):
+    """ {short IK: smiles} of the structures annotated by Sirius in all samples
+
+    Only the needed columns of the pos/neg Sirius results are read, in a process pool. All samples are
+    concatenated and deduplicated once (keeping the first annotation, in samples order).
+    """
+    sirius_files = sample_discovery.select_files(samples, 'sirius')
+    sirius_annotations = sample_discovery.load_files(partial(pd.read_csv, sep='\t', usecols=SIRIUS_COLUMNS),
+                                                     sirius_files, n_jobs=n_jobs)
+    if len(sirius_annotations) == 0:
+        return {}
+    sirius_annotations = pd.concat(sirius_annotations, ignore_index=True)
+    sirius_annotations = sirius_annotations.dropna(subset=['InChIkey2D']).drop_duplicates(subset=['InChIkey2D'])
+    return dict(zip(sirius_annotations['InChIkey2D'], sirius_annotations['smiles']))
+
+def run(args):
+    """ Add the structures annotated in the samples of args.sample_dir_path to the SQL DB of metadata
+
+    args are the parsed arguments of build_parser; relative paths are relative to the repository.
+
+    Returns:
+        str: path of the SQL DB
+    """
+    sample_dir_path = os.path.join(REPO_ROOT, args.sample_dir_path)
+    sql_path = os.path.join(REPO_ROOT, 'output_data', 'sql_db', args.sql_name)
+    gnps_id = args.gnps_job_id
+    wd_index = os.path.join(REPO_ROOT, args.wd_index)
+
+    Path(os.path.dirname(sql_path)).mkdir(parents=True, exist_ok=True)
+    report = run_report.RunReport('chemo_info_fetcher', os.path.join(REPO_ROOT, args.report or os.path.splitext(sql_path)[0] + '_run_report.json'),
+                                  profile=args.profile, args=args)
+
+    with report:
+        path = os.path.normpath(sample_dir_path)
+        with report.stage('discover_samples') as stage:
+            samples = sample_discovery.discover_samples(path)
+            stage.items = len(samples)
+        print(f'{len(samples)} samples found')
+
+        # Open (or create) the SQL DB of metadata: known short IK are then looked up by chunks in its index. The DB,
+        # the caches and the NPClassifier client are closed even if the run fails
+        with closing(structures_db.connect(sql_path)) as conn, \
+                NPCClient(args.npc_url, max_workers=args.npc_workers, rate=args.npc_rate, max_retries=args.npc_retries,
+                          batch_size=args.npc_batch_size) as npc_client, \
+                structure_engine.StructureCache(os.path.join(REPO_ROOT, args.structure_cache)) as structure_cache, \
+                npc_cache.NPCCache(os.path.join(REPO_ROOT, args.npc_cache), ttl_days=args.npc_ttl) as npc_results_cache:
+            print(f'{structures_db.count_short_inchikeys(conn)} short IK in DB')
+            report.track_session(npc_client.session, 'npclassifier')
+
+            # Resume NPClassifier results of an interrupted run
+            npc_checkpoint = structures_db.load_npc_checkpoint(conn)
+            if len(npc_checkpoint) > 0:
+                print(f'{len(npc_checkpoint)} NPClassifier results resumed from checkpoint')
+
+            # First load all unique short IK from ISDB annotation as long as their metadata (smiles 2D, NPC classes)
+            print('Processing ISDB results')
+            with report.stage('isdb_annotations') as stage:
+                metadata_short_ik = load_isdb_metadata(samples, conn, n_jobs=args.n_jobs)
+                stage.items = len(metadata_short_ik)
+            print(f'{len(metadata_short_ik)} new short IK from ISDB annotations')
+            npc_results_cache.put_many(metadata_short_ik, source='isdb')
+
+            # Collect the unique short IK (and smiles) annotated by GNPS and Sirius in all samples, before any NPClassifier request
+            candidates = {}
+            if gnps_id is not None:
+                print('Processing GNPS results')
+
+                with report.stage('gnps_annotations') as stage:
+                    gnps_annotations_path = gnps_annotations_file(os.path.join(path, '002_gnps', gnps_id))
+                    gnps_annotations = pd.read_csv(gnps_annotations_path, sep='\t', usecols=['Smiles', 'INCHI'])
+                    candidates.update(get_gnps_structures(gnps_annotations, structure_cache, n_jobs=args.n_jobs))
+                    stage.items = len(gnps_annotations)
+
+            print('Processing Sirius results')
+            with report.stage('sirius_annotations') as stage:
+                sirius_structures = load_sirius_structures(samples, n_jobs=args.n_jobs)
+                stage.items = len(sirius_structures)
+            for sik, smiles in sirius_structures.items():
+                candidates.setdefault(sik, smiles)
+
+            # Drop the short IK already known (from ISDB, in DB, checkpointed or cached), then classify all new ones at once
+            with report.stage('select_new_structures', items=len(candidates)):
+                npc_query, npc_resumed, npc_cached, npc_retried = select_new_structures(candidates, metadata_short_ik, conn, checkpoint=npc_checkpoint,
+                                                                                        npc_cache=npc_results_cache)
+            n_known = len(candidates) - len(npc_query) - len(npc_resumed) - len(npc_cached)
+            print(f'{len(candidates)} short IK from GNPS and Sirius annotations: {n_known} already known, {len(npc_resumed)} resumed from checkpoint, '
+                  f'{len(npc_cached)} from the NPClassifier cache, {len(npc_query)} new (including {len(npc_retried)} expired unknown)')
+            metadata_short_ik.update(npc_resumed)
+            metadata_short_ik.update(npc_cached)
+            if len(npc_query) > 0:
+                def on_batch(batch):
+                    structures_db.save_npc_checkpoint(conn, batch)
+                    npc_results_cache.put_many(batch, source='npclassifier')
+                with report.stage('npclassifier', items=len(npc_query)):
+                    metadata_short_ik.update(npc_client.classify_many(npc_query, on_batch=on_batch))
+
+            df_ik_meta = pd.DataFrame.from_dict(metadata_short_ik, orient='index')\
+                .reset_index().rename(columns={'index':'short_inchikey'}).fillna('unknown')
+
+            print('Getting WD id and formatting results')
+
+            if len(df_ik_meta) > 0:
+                with report.stage('wikidata', items=len(metadata_short_ik)):
+                    with report.track_session(requests.Session(), 'wikidata') as wd_session:
+                        wikidata_index.ensure_index(wd_index, url=args.wd_url, max_age_days=args.wd_max_age, session=wd_session)
+                    wd_filtred = wikidata_index.lookup(wd_index, short_inchikeys=metadata_short_ik.keys())
+
+                df_total = wd_filtred.merge(df_ik_meta, on='short_inchikey', how='outer')
+                df_total['isomeric_smiles'] = df_total['isomeric_smiles'].fillna(df_total['smiles'])
+                df_total = df_total.fillna('no_wikidata_match')
+
+                with report.stage('upsert_structures', items=len(df_total)):
+                    structures_db.upsert_structures(conn, df_total)
+
+            structures_db.clear_npc_checkpoint(conn)
+
+        report.cache('structures', structure_cache.hits, structure_cache.misses)
+        report.cache('npclassifier', len(npc_cached), len(npc_query))
+        print(f'Run report: {report.write()}')
+    return sql_path
+
+
+def main(argv=None, prog=None):
+    """ Run the script with command-line arguments (sys.argv by default) """
+    return run(build_parser(prog).parse_args(argv))
+
+
+if __name__ == '__main__':
+    main()
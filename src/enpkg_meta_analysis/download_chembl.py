@@ -0,0 +1,207 @@
+import pandas as pd
+import argparse
+import textwrap
+from .chembl_client import ChEMBLActivityDownloader, ChEMBLRelease, CHEMBL_API
+import os
+from pathlib import Path
+import requests
+from . import wikidata_index
+from . import structure_engine
+from . import run_report
+
+# Relative paths (arguments and outputs) are relative to the repository, except the input files given by the user
+# (--target_file, --chembl_db), relative to the working directory
+REPO_ROOT = Path(__file__).parents[2]
+
+DESCRIPTION = textwrap.dedent('''\
+         This script will download compounds from ChEMBL DB with an activity against given targets
+         --------------------------------
+            You should just enter the ChEMBL target ID(s)
+            results will be stored in ../output_data/chembl/<target_id>_np_like_min_<NPlike_score>.csv
+            with several targets, all results are also combined in ../output_data/chembl/<combined_name>_np_like_min_<NPlike_score>.csv
+        ''')
+
+
+def build_parser(prog=None):
+    parser = argparse.ArgumentParser(prog=prog, formatter_class=argparse.RawDescriptionHelpFormatter, description=DESCRIPTION)
+    parser.add_argument('-id', '--target_id', nargs='+', default=[],
+                        help='The ChEMBL target ID(s) to use to select compounds')
+    parser.add_argument('--target_file', default=None,
+                        help='A text file with ChEMBL target IDs to use, one per line (added to --target_id)')
+    parser.add_argument('--combined_name', default='combined',
+                        help='Name of the table combining the results of all targets, default combined')
+    parser.add_argument('-npl', '--NPlike_score', default=-1, 
+                        help='The minimal NP likeliness score for compounds. Compounds with \
+                            lower NP likeliness score (i.e. "less natural") will be filterd out. Default -1.')
+    parser.add_argument('--wd_index', default=wikidata_index.DEFAULT_INDEX_PATH,
+                        help='Path to the local Wikidata InChIKey index, built on first use. Default output_data/wikidata/inchikey_index.db')
+    parser.add_argument('--wd_max_age', type=float, default=None,
+                        help='Refresh the Wikidata InChIKey index if it is older than this number of days. Default: never refresh')
+    parser.add_argument('--wd_url', default=wikidata_index.WD_URL,
+                        help=f'Wikidata SPARQL endpoint used to build the InChIKey index, default {wikidata_index.WD_URL}')
+    parser.add_argument('--structure_cache', default=structure_engine.DEFAULT_CACHE_PATH,
+                        help='Path to the cache of processed structures (shared with chemo_info_fetcher.py). Default output_data/sql_db/structures_cache.db')
+    parser.add_argument('--n_jobs', type=int, default=-1,
+                        help='Number of processes used to process structures, default -1 (all cores)')
+    parser.add_argument('--chembl_url', default=CHEMBL_API,
+                        help=f'ChEMBL API URL, default {CHEMBL_API}')
+    parser.add_argument('--chembl_workers', type=int, default=4,
+                        help='Number of activity pages downloaded concurrently, default 4')
+    parser.add_argument('--chembl_rate', type=float, default=5,
+                        help='Maximal number of ChEMBL requests per second (0 for no limit), default 5')
+    parser.add_argument('--chembl_db', default=None,
+                        help='Path to a local ChEMBL SQLite release (chembl_XX.db), relative to the working directory: activities are read from it instead of the ChEMBL API')
+    parser.add_argument('--refresh_pages', action='store_true',
+                        help='Download all activity pages again instead of resuming from the pages checkpointed in output_data/chembl/pages/')
+    run_report.add_arguments(parser)
+    return parser
+
+
+def read_target_ids(target_ids, target_file=None):
+    """ Unique target IDs, in order, of target_ids and of the lines of target_file """
+    target_ids = list(target_ids)
+    if target_file is not None:
+        with open(target_file) as f:
+            target_ids += [line.strip() for line in f if line.strip() != '']
+    return list(dict.fromkeys(target_ids))
+
+
+""" Functions """
+
+# Function used to clean the data downloaded from ChEMBL
+def clean_DB(df_in, NP_cutoff, cache=None, n_jobs=-1, structures=None):
+    '''Function to clean a ChEMBL DB
+
+    structures are the processed structures (see structure_engine.process_structures, with np_score) of the
+    canonical smiles of df_in, processed here if not given.'''
+    
+    df=df_in.copy()
+
+    # Drop rows without Smiles or activity value. Activity values are kept as given: strings from the API,
+    # numbers from a ChEMBL release
+    df.dropna(subset=['canonical_smiles', 'standard_value'], inplace=True)
+
+    # Drop row with a Data Validity Comment "Outside typical range"
+    df.drop(df[df['data_validity_comment'] == "Outside typical range"].index, inplace=True)
+    df.drop(['data_validity_comment', 'relation', 'units', 'value', 'activity_comment', 'type'],axis =1, inplace=True, errors='ignore')
+    
+    # Drop rows with an invalid smiles and add the RDKit isomeric smiles, InChIKey and NP-likeness score.
+    # Each unique smiles is processed once, in a process pool, through the structures cache.
+    if structures is None:
+        structures = structure_engine.process_structures(df['canonical_smiles'], kind='smiles', np_score=True,
+                                                         cache=cache, n_jobs=n_jobs)
+    df = df[df['canonical_smiles'].isin(structures.index)].copy()
+    structures = structures.loc[df['canonical_smiles']]
+
+    df['isomeric_smiles'] = structures['smiles'].values
+    df['inchikey'] = structures['inchikey'].values
+    df['np_score'] = structures['np_score'].values
+    df['short_inchikey'] = df['inchikey'].str[:14]
+    df["document_journal"] = df["document_journal"].fillna("Unknown journal")
+    df = df[(df['np_score'] > NP_cutoff) | (df['document_journal'] == 'J Nat Prod')]
+    
+    return df
+
+
+def download_target(target_id, downloader, refresh=False):
+    '''Download (or read, from a ChEMBLRelease) all the activities pages of a target, None if it has no activity
+
+    The structures are not processed here: the process pool is only started once the downloader threads are done.'''
+    pages = dict(downloader.iter_pages(target_id, refresh=refresh))
+    pages = [pages[offset] for offset in sorted(pages) if len(pages[offset]) > 0]
+    if len(pages) == 0:
+        return None
+    return pd.concat(pages, ignore_index=True)
+
+
+def open_downloader(args, pages_path):
+    """ The ChEMBLRelease of args.chembl_db if given, else a ChEMBLActivityDownloader checkpointing pages in pages_path """
+    if args.chembl_db is not None:
+        return ChEMBLRelease(os.path.abspath(os.path.expanduser(args.chembl_db)))
+    return ChEMBLActivityDownloader(pages_path, chembl_api=args.chembl_url, max_workers=args.chembl_workers, rate=args.chembl_rate)
+
+
+def run(args):
+    """ Download, clean and write the activities of the targets of args, the parsed arguments of build_parser
+
+    Returns:
+        dict: {target_id: pd.DataFrame} of the cleaned activities, with their Wikidata ID
+    """
+    target_ids = read_target_ids(args.target_id, args.target_file)
+    if len(target_ids) == 0:
+        raise ValueError('Give at least one ChEMBL target ID with --target_id or --target_file')
+    sql_folder_path = os.path.join(REPO_ROOT, 'output_data', 'chembl')
+    Path(sql_folder_path).mkdir(parents=True, exist_ok=True)
+    structure_cache_path, wd_index = os.path.join(REPO_ROOT, args.structure_cache), os.path.join(REPO_ROOT, args.wd_index)
+
+    Path(os.path.dirname(structure_cache_path)).mkdir(parents=True, exist_ok=True)
+    report_name = target_ids[0] if len(target_ids) == 1 else args.combined_name
+    report = run_report.RunReport('download_chembl', os.path.join(REPO_ROOT, args.report or os.path.join(sql_folder_path, report_name + '_np_like_min_' + str(args.NPlike_score) + '_run_report.json')),
+                                  profile=args.profile, args=args)
+
+    with report:
+        # Download selected activities (only compounds with an activity value), page by page: each page is checkpointed
+        # as soon as it is received, while the next pages are downloaded. With --chembl_db, the same pages are read from
+        # a local ChEMBL release instead. Once the pages of all targets are received, their unique structures (and
+        # NP score) are processed at once, in one process pool and through the structures cache, then the activities
+        # of each target are cleaned. The cache and the downloader are closed even if the run fails.
+        with structure_engine.StructureCache(structure_cache_path) as structure_cache, \
+                open_downloader(args, os.path.join(sql_folder_path, 'pages')) as downloader:
+            if args.chembl_db is not None:
+                print(f'Fetching results from local ChEMBL release {downloader.version() or args.chembl_db}')
+            else:
+                report.track_session(downloader.session, 'chembl')
+                print('Fetching results from ChEMBL')
+            targets_activities = {}
+            for target_id in target_ids:
+                with report.stage(f'download_{target_id}') as stage:
+                    df = download_target(target_id, downloader, refresh=args.refresh_pages)
+                    stage.items = 0 if df is None else len(df)
+                if df is None:
+                    print(f'No activity found in ChEMBL for {target_id}')
+                else:
+                    targets_activities[target_id] = df
+            all_smiles = pd.unique(pd.concat([df.canonical_smiles for df in targets_activities.values()]).dropna()) if targets_activities else []
+            with report.stage('structures', items=len(all_smiles)):
+                structures = structure_engine.process_structures(all_smiles, kind='smiles', np_score=True, cache=structure_cache,
+                                                                 n_jobs=args.n_jobs)
+                targets_clean = {target_id: clean_DB(df, int(args.NPlike_score), structures=structures)
+                                 for target_id, df in targets_activities.items()}
+        print('Fetching results from ChEMBL: Done!')
+        print(f'Structures: {structure_cache.hits} unique smiles from cache, {structure_cache.misses} processed')
+        report.cache('structures', structure_cache.hits, structure_cache.misses)
+
+        # Wikidata IDs of all targets compounds are looked up at once
+        all_inchikeys = pd.unique(pd.concat([df_clean.inchikey for df_clean in targets_clean.values()])) if targets_clean else []
+        with report.stage('wikidata', items=len(all_inchikeys)):
+            with report.track_session(requests.Session(), 'wikidata') as wd_session:
+                wikidata_index.ensure_index(wd_index, url=args.wd_url, max_age_days=args.wd_max_age, session=wd_session)
+            wd_all = wikidata_index.lookup(wd_index, inchikeys=all_inchikeys)
+
+        targets_total = {}
+        for target_id, df_clean in targets_clean.items():
+            wd_filtred = wd_all[wd_all['inchikey'].isin(df_clean.inchikey)]
+            df_total = df_clean.merge(wd_filtred[['inchikey', 'wikidata_id']], on='inchikey', how='outer')
+            df_total['wikidata_id'] = df_total['wikidata_id'] .fillna('no_wikidata_match')
+
+            path_to_folder = os.path.expanduser(os.path.join(sql_folder_path, target_id + '_np_like_min_' + str(args.NPlike_score) + '.csv'))
+            df_total.to_csv(path_to_folder)
+            print(f'{target_id}: {len(df_total)} activities. Results are in: {path_to_folder}')
+            targets_total[target_id] = df_total
+
+        if len(targets_total) > 1:
+            path_to_folder = os.path.expanduser(os.path.join(sql_folder_path, args.combined_name + '_np_like_min_' + str(args.NPlike_score) + '.csv'))
+            pd.concat(targets_total.values(), ignore_index=True).to_csv(path_to_folder)
+            print(f'Combined results of {len(targets_total)} targets are in: {path_to_folder}')
+        print(f'Run report: {report.write()}')
+    print('Finished.')
+    return targets_total
+
+
+def main(argv=None, prog=None):
+    """ Run the script with command-line arguments (sys.argv by default) """
+    return run(build_parser(prog).parse_args(argv))
+
+
+if __name__ == '__main__':
+    main()
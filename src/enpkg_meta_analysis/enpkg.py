@@ -0,0 +1,96 @@
+import argparse
+import importlib
+import shlex
+import sys
+import textwrap
+import traceback
+
+# Command: (module, help). A command's module, and the heavy packages it needs, are only imported when it runs
+COMMANDS = {
+    'gnps': ('gnps_fetcher', 'Download GNPS jobs'),
+    'chemo_info': ('chemo_info_fetcher', "Fetch the Wikidata ID and NPClassifier taxonomy of the structures annotated in the samples"),
+    'memo': ('memo_unaligned_repo', 'Compute the MEMO matrix of the samples'),
+    'memo_similarity': ('memo_similarity', 'Compute samples distances, nearest neighbours and PCoA from a MEMO matrix'),
+    'memo_index': ('memo_index', 'Manage the nearest-neighbour index of MEMO vectors'),
+    'mgf_aggregator': ('mgf_aggregator', 'Aggregate the samples spectra in a single .mgf for GNPS'),
+    'chembl': ('download_chembl', 'Download ChEMBL compounds with an activity against given targets'),
+    'npc_cache': ('npc_cache', 'Manage the NPClassifier results cache'),
+    'wikidata_index': ('wikidata_index', 'Manage the local Wikidata InChIKey index'),
+}
+
+DESCRIPTION = textwrap.dedent('''\
+        Single entry point of the enpkg_meta_analysis scripts.
+         --------------------------------
+        Each command takes the arguments of its script, e.g.
+            enpkg chemo_info -p path/to/your/data/directory/ -id {gnps_job_id}
+        and `enpkg <command> --help` prints them.
+        With batch, the commands of a text file (one per line) run one after the other in this process:
+        Python and the shared packages are then loaded once for all of them.
+        ''')
+
+
+def build_parser(prog=None):
+    parser = argparse.ArgumentParser(prog=prog, formatter_class=argparse.RawDescriptionHelpFormatter, description=DESCRIPTION)
+    subparsers = parser.add_subparsers(dest='command', required=True, metavar='command')
+    for name, (_, help) in COMMANDS.items():
+        # The arguments of the command are parsed by its own module
+        subparsers.add_parser(name, help=help, add_help=False)
+    batch = subparsers.add_parser('batch', help='Run the commands of a text file, one per line, in this process')
+    batch.add_argument('jobs', help='Text file of commands (e.g. "memo -p path/to/cohort --ionization pos --output memo_pos"), '
+                                    'one per line; empty lines and lines starting with # are skipped')
+    batch.add_argument('--keep_going', action='store_true',
+                       help='Run the next commands when a command fails, instead of stopping')
+    return parser
+
+
+def run_command(command, argv, prog='enpkg'):
+    """ Run a command (a key of COMMANDS) in this process with the arguments of its script; return its result
+
+    Scripts can also be used as libraries: e.g. chemo_info_fetcher.run(chemo_info_fetcher.build_parser().parse_args([...])),
+    or their stage functions and classes directly.
+    """
+    module = importlib.import_module(f'.{COMMANDS[command][0]}', __package__)
+    return module.main(argv, prog=f'{prog} {command}')
+
+
+def run_batch(jobs_path, keep_going=False, prog='enpkg'):
+    """ Run the commands of a text file one after the other; return the line numbers of the failed commands """
+    with open(jobs_path) as f:
+        jobs = [(number, shlex.split(line)) for number, line in enumerate(f, start=1)
+                if line.strip() != '' and not line.lstrip().startswith('#')]
+    for number, job in jobs:
+        if job[0] not in COMMANDS:
+            raise ValueError(f'{jobs_path}, line {number}: unknown command {job[0]}, choose from {", ".join(COMMANDS)}')
+    failed = []
+    for number, job in jobs:
+        print(f'\n[{jobs_path}:{number}] {shlex.join(job)}')
+        try:
+            run_command(job[0], job[1:], prog=prog)
+        except SystemExit as error:
+            # argparse errors and scripts exiting with a status (e.g. gnps with failed jobs)
+            if error.code in (None, 0):
+                continue
+            failed.append(number)
+        except Exception:
+            traceback.print_exc()
+            failed.append(number)
+        if failed and not keep_going:
+            break
+    return failed
+
+
+def main(argv=None):
+    parser = build_parser(prog='enpkg')
+    args, rest = parser.parse_known_args(argv)
+    if args.command != 'batch':
+        return run_command(args.command, rest, prog=parser.prog)
+    if len(rest) > 0:
+        parser.error(f'unrecognized arguments: {" ".join(rest)}')
+    failed = run_batch(args.jobs, keep_going=args.keep_going, prog=parser.prog)
+    if len(failed) > 0:
+        print(f'\nFailed command(s) at line(s) {", ".join(map(str, failed))} of {args.jobs}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
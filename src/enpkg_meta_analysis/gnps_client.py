@@ -0,0 +1,219 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from tqdm import tqdm
+
+from .npc_client import RETRY_STATUS
+
+GNPS_URL = 'https://gnps.ucsd.edu/ProteoSAFe/DownloadResult'
+# Members of the job archive used by the meta-analyses (chemo_info_fetcher.py reads the library annotations)
+DEFAULT_MEMBERS = ['result_specnets_DB']
+MANIFEST_NAME = 'gnps_download.json'
+
+
+class IncompleteDownload(Exception):
+    pass
+
+
+class GNPSJobDownloader:
+    """ In-process, resumable download of GNPS jobs results
+
+    The job archive is written to <output_dir>/<job_id>.zip.part and, if the connection is lost, the download
+    resumes from the bytes already received (HTTP range request; if the server ignores it, the download starts
+    over). The size received is checked against the size announced by the server and failed requests are retried
+    with exponential backoff. Only the archive members under the requested folders are then extracted, one at a
+    time, to <output_dir>/<job_id>/: the CRC of each member is checked while it is streamed to disk. Several jobs
+    can be downloaded concurrently.
+
+    A manifest (gnps_download.json) records the size and SHA-256 of the archive, and the extracted members with their
+    SHA-256: a job already extracted with the same members is not downloaded again, as long as its extracted files
+    match the manifest. A kept (or not yet extracted) archive is only reused if it matches the manifest.
+
+    Args:
+        output_dir (str): directory of the jobs results, e.g. <sample_dir_path>/002_gnps
+        gnps_url (str): GNPS download URL (a local stand-in server can be used)
+        max_workers (int): number of jobs downloaded concurrently
+        max_retries (int): number of retries of a failed or interrupted request
+        backoff_factor (float): retry n waits backoff_factor * 2 ** n seconds
+        timeout (float): timeout of the connection and of each read, in seconds
+        chunk_size (int): size of the chunks written to disk, in bytes
+        keep_zip (bool): keep the job archive after the extraction
+    """
+
+    def __init__(self, output_dir, gnps_url=GNPS_URL, max_workers=4, max_retries=5, backoff_factor=0.5, timeout=60,
+                 chunk_size=1 << 20, keep_zip=False):
+        self.output_dir = output_dir
+        self.gnps_url = gnps_url
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.keep_zip = keep_zip
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def job_dir(self, job_id):
+        return os.path.join(self.output_dir, job_id)
+
+    def zip_path(self, job_id):
+        return os.path.join(self.output_dir, job_id + '.zip')
+
+    def _read_manifest(self, job_id):
+        path = os.path.join(self.job_dir(job_id), MANIFEST_NAME)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def file_sha256(self, path):
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    def verified(self, job_id, manifest, members=DEFAULT_MEMBERS):
+        """ True if the job was extracted with the given members and its extracted files match the manifest SHA-256 """
+        if (manifest is None) or (manifest['members'] != members) or ('files' not in manifest):
+            return False
+        for member, sha256 in manifest['files'].items():
+            path = os.path.join(self.job_dir(job_id), member)
+            if not os.path.exists(path) or self.file_sha256(path) != sha256:
+                return False
+        return True
+
+    def fetch(self, job_id):
+        """ Download the archive of a job to zip_path(job_id), resuming a partial download; return its size """
+        path = self.zip_path(job_id)
+        part = path + '.part'
+        params = {'task': job_id, 'view': 'download_cytoscape_data'}
+        for attempt in range(self.max_retries + 1):
+            offset = os.path.getsize(part) if os.path.exists(part) else 0
+            headers = {'Range': f'bytes={offset}-'} if offset > 0 else {}
+            try:
+                with self.session.post(self.gnps_url, params=params, headers=headers, stream=True, timeout=self.timeout) as response:
+                    if response.status_code == 416:
+                        # The partial file does not match the archive anymore
+                        os.remove(part)
+                        continue
+                    if response.status_code in RETRY_STATUS:
+                        raise IncompleteDownload(f'GNPS answered {response.status_code}')
+                    response.raise_for_status()
+                    if response.status_code == 206:
+                        total = int(response.headers['Content-Range'].rsplit('/', 1)[1])
+                        mode = 'ab'
+                    else:
+                        length = response.headers.get('Content-Length')
+                        total = int(length) if length is not None else None
+                        offset = 0
+                        mode = 'wb'
+                    with open(part, mode) as f, tqdm(total=total, initial=offset, unit='B', unit_scale=True,
+                                                     desc=job_id[:8], leave=False) as progress:
+                        for chunk in response.iter_content(self.chunk_size):
+                            f.write(chunk)
+                            progress.update(len(chunk))
+                size = os.path.getsize(part)
+                if (total is not None) and (size != total):
+                    raise IncompleteDownload(f'{size} bytes received out of {total}')
+                os.replace(part, path)
+                return size
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError, IncompleteDownload):
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(self.backoff_factor * 2 ** attempt)
+        raise IncompleteDownload(f'GNPS job {job_id} could not be downloaded')
+
+    def extract(self, job_id, members=DEFAULT_MEMBERS):
+        """ Stream the archive members under the given folders (all members if None) to job_dir(job_id)
+
+        Returns:
+            list: the extracted members
+        """
+        extracted = []
+        job_dir = os.path.realpath(self.job_dir(job_id))
+        os.makedirs(job_dir, exist_ok=True)
+        with zipfile.ZipFile(self.zip_path(job_id)) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                if (members is not None) and not any(info.filename == member or info.filename.startswith(member.rstrip('/') + '/')
+                                                     for member in members):
+                    continue
+                target = os.path.realpath(os.path.join(job_dir, info.filename))
+                if not target.startswith(job_dir + os.sep):
+                    raise zipfile.BadZipFile(f'Unsafe path in the archive of GNPS job {job_id}: {info.filename}')
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                # ZipExtFile checks the member CRC once it is read entirely
+                with archive.open(info) as source, open(target + '.tmp', 'wb') as destination:
+                    shutil.copyfileobj(source, destination, self.chunk_size)
+                os.replace(target + '.tmp', target)
+                extracted.append(info.filename)
+        return extracted
+
+    def download(self, job_id, members=DEFAULT_MEMBERS, refresh=False):
+        """ Download and extract a job, unless it was already extracted with the same members (see verified); return its folder """
+        manifest = self._read_manifest(job_id)
+        if (not refresh) and self.verified(job_id, manifest, members):
+            return self.job_dir(job_id)
+        path = self.zip_path(job_id)
+        if refresh and os.path.exists(path + '.part'):
+            os.remove(path + '.part')
+        if os.path.exists(path) and (refresh or ((manifest is not None) and (self.file_sha256(path) != manifest['sha256']))):
+            os.remove(path)
+        if not os.path.exists(path):
+            self.fetch(job_id)
+        sha256 = self.file_sha256(path)
+        try:
+            extracted = self.extract(job_id, members)
+        except zipfile.BadZipFile:
+            # Corrupted archive: the next run downloads it again
+            os.remove(path)
+            raise
+        files = {member: self.file_sha256(os.path.join(self.job_dir(job_id), member)) for member in extracted}
+        manifest = {'job_id': job_id, 'size': os.path.getsize(path), 'sha256': sha256, 'members': members,
+                    'extracted': extracted, 'files': files, 'downloaded_at': time.strftime('%Y-%m-%dT%H:%M:%S')}
+        manifest_path = os.path.join(self.job_dir(job_id), MANIFEST_NAME)
+        with open(manifest_path + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(manifest_path + '.tmp', manifest_path)
+        if not self.keep_zip:
+            os.remove(path)
+        return self.job_dir(job_id)
+
+    def download_many(self, job_ids, members=DEFAULT_MEMBERS, refresh=False):
+        """ Download several jobs concurrently
+
+        Returns:
+            results (dict): {job_id: folder}, for the jobs downloaded
+            errors (dict): {job_id: exception}, for the jobs that failed
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        results = {}
+        errors = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {job_id: executor.submit(self.download, job_id, members, refresh) for job_id in dict.fromkeys(job_ids)}
+            for job_id, future in futures.items():
+                try:
+                    results[job_id] = future.result()
+                except Exception as error:
+                    errors[job_id] = error
+        return results, errors
@@ -0,0 +1,81 @@
+import os
+import sys
+import argparse
+import textwrap
+
+from .gnps_client import GNPSJobDownloader, DEFAULT_MEMBERS, GNPS_URL
+from . import run_report
+
+DESCRIPTION = textwrap.dedent('''\
+         This script will download GNPS jobs
+         --------------------------------
+        Results will be stored in sample_dir_path/002_gnps/<job_id>/
+        By default, only the result_specnets_DB folder (library annotations) of each job is extracted
+        ''')
+
+
+def build_parser(prog=None):
+    parser = argparse.ArgumentParser(prog=prog, formatter_class=argparse.RawDescriptionHelpFormatter, description=DESCRIPTION)
+    parser.add_argument('-p', '--sample_dir_path', required=True,
+                        help='The path to the directory where samples folders coresponding to the GNPS job_id are located')
+    parser.add_argument('--job_id', required=True, nargs='+',
+                        help='the identifier(s) of the GNPS job(s) to download')
+    parser.add_argument('--members', nargs='+', default=DEFAULT_MEMBERS,
+                        help=f'Folders of the job archive to extract, default {" ".join(DEFAULT_MEMBERS)}')
+    parser.add_argument('--all_members', action='store_true',
+                        help='Extract the whole job archive')
+    parser.add_argument('--keep_zip', action='store_true',
+                        help='Keep the job archive in sample_dir_path/002_gnps/ after the extraction')
+    parser.add_argument('--refresh', action='store_true',
+                        help='Download the jobs again, even if they were already downloaded')
+    parser.add_argument('--gnps_workers', type=int, default=4,
+                        help='Number of jobs downloaded concurrently, default 4')
+    parser.add_argument('--gnps_retries', type=int, default=5,
+                        help='Number of retries of a failed or interrupted download, default 5')
+    parser.add_argument('--gnps_url', default=GNPS_URL,
+                        help=f'GNPS download URL, default {GNPS_URL}')
+    run_report.add_arguments(parser)
+    return parser
+
+
+def run(args):
+    """ Download the GNPS jobs of args, the parsed arguments of build_parser
+
+    Returns:
+        results (dict): {job_id: path of the extracted job}
+        errors (dict): {job_id: exception} of the jobs that could not be downloaded
+    """
+    pathout = os.path.join(os.path.normpath(args.sample_dir_path), '002_gnps')
+    report = run_report.RunReport('gnps_fetcher', args.report or os.path.join(pathout, 'gnps_fetcher_run_report.json'), profile=args.profile,
+                                  args=args)
+
+    with report:
+        # Downloading GNPS files
+
+        print('\nFetching the GNPS job(s): ' + ', '.join(args.job_id))
+
+        members = None if args.all_members else args.members
+        with GNPSJobDownloader(pathout, gnps_url=args.gnps_url, max_workers=args.gnps_workers, max_retries=args.gnps_retries,
+                               keep_zip=args.keep_zip) as downloader:
+            report.track_session(downloader.session, 'gnps')
+            with report.stage('download', items=len(args.job_id)):
+                results, errors = downloader.download_many(args.job_id, members=members, refresh=args.refresh)
+
+        for job_id, path_to_folder in results.items():
+            print('\nJob successfully downloaded: results are in: ' + path_to_folder)
+        for job_id, error in errors.items():
+            print(f'\nJob {job_id} could not be downloaded: {error!r}')
+        print(f'Run report: {report.write(status="completed" if len(errors) == 0 else "failed")}')
+    return results, errors
+
+
+def main(argv=None, prog=None):
+    """ Run the script with command-line arguments (sys.argv by default); exit with status 1 if a job failed """
+    results, errors = run(build_parser(prog).parse_args(argv))
+    if len(errors) > 0:
+        sys.exit(1)
+    return results, errors
+
+
+if __name__ == '__main__':
+    main()
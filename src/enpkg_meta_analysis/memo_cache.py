@@ -0,0 +1,89 @@
+import hashlib
+import json
+import sqlite3
+import time
+import zlib
+
+
+class MemoVectorCache:
+    """ Content-addressed cache of per-sample MEMO vectors, stored in a SQLite DB
+
+    Vectors are keyed by the sha256 of the sample .mgf file and of the vectorization parameters, so that
+    a sample is only vectorized again if its spectra or the parameters change. Once the cache is larger
+    than max_size_mb, the least recently used vectors are evicted.
+
+    Args:
+        path (str): path to the cache SQLite DB, created if needed
+        max_size_mb (float): maximal size of the stored vectors, in MB
+    """
+
+    def __init__(self, path, max_size_mb=1024):
+        self.path = path
+        self.max_size = max_size_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS memo_vectors (
+                                 key TEXT PRIMARY KEY,
+                                 vector BLOB NOT NULL,
+                                 size INTEGER NOT NULL,
+                                 last_used REAL NOT NULL)''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_last_used ON memo_vectors (last_used)')
+        self.conn.commit()
+
+    @staticmethod
+    def key(mgf_path, parameters):
+        """ sha256 of the .mgf content, the vectorization parameters and the memo_ms version """
+        import memo_ms
+        sha = hashlib.sha256()
+        with open(mgf_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+        sha.update(json.dumps(parameters, sort_keys=True).encode())
+        sha.update(memo_ms.__version__.encode())
+        return sha.hexdigest()
+
+    def get(self, key):
+        row = self.conn.execute('SELECT vector FROM memo_vectors WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.conn.execute('UPDATE memo_vectors SET last_used = ? WHERE key = ?', (time.time(), key))
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, key, vector):
+        blob = zlib.compress(json.dumps(vector).encode())
+        self.conn.execute('INSERT OR REPLACE INTO memo_vectors VALUES (?, ?, ?, ?)', (key, blob, len(blob), time.time()))
+        self.conn.commit()
+
+    def size(self):
+        return self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM memo_vectors').fetchone()[0]
+
+    def evict(self):
+        """ Remove the least recently used vectors until the cache fits in max_size_mb; return the number removed """
+        excess = self.size() - self.max_size
+        removed = 0
+        if excess > 0:
+            query = self.conn.execute('SELECT key, size FROM memo_vectors ORDER BY last_used')
+            keys = []
+            for key, size in query:
+                if excess <= 0:
+                    break
+                keys.append((key,))
+                excess -= size
+            self.conn.executemany('DELETE FROM memo_vectors WHERE key = ?', keys)
+            removed = len(keys)
+        self.conn.commit()
+        return removed
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,187 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.linalg import LinearOperator, eigsh
+
+from . import sample_discovery
+
+METRICS = ['braycurtis', 'cosine', 'jaccard']
+
+# Precomputed matrices of the metric, set once per worker process by _init_worker
+_STATE = None
+
+
+def prepare(matrix, metric, dense_fraction=0.1):
+    """ Precompute the sparse operands of a metric, so that a block of distances is a few sparse products
+
+    - cosine: L2-normalized rows; similarity is a dot product
+    - jaccard: binary presence matrix and row sizes; intersection is a dot product
+    - braycurtis: for non-negative counts, sum(min(u, v)) is the weighted sum, over the distinct values t
+      of the matrix, of the dot products of the (X >= t) binary matrices. Exact, its cost grows with the
+      number of distinct counts. Words present in more than dense_fraction of the samples would make
+      most of these products dense: their minimums are taken directly, word by word.
+    """
+    matrix = sparse.csr_matrix(matrix, dtype=np.float64)
+    if metric not in METRICS:
+        raise ValueError(f'metric must be one of {METRICS}')
+    if (matrix.data < 0).any():
+        raise ValueError('MEMO distances require a non-negative matrix')
+    state = {'metric': metric, 'n_samples': matrix.shape[0]}
+    if metric == 'cosine':
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        normalized = sparse.csr_matrix(sparse.diags(1 / norms) @ matrix)
+        state['layers'] = [(1.0, normalized, normalized.T.tocsr())]
+    else:
+        matrix.eliminate_zeros()
+        if metric == 'jaccard':
+            state['sums'] = np.diff(matrix.indptr).astype(np.float64)
+            levels = np.unique(matrix.data)[:1]
+        else:
+            state['sums'] = np.asarray(matrix.sum(axis=1)).ravel()
+            frequent = np.bincount(matrix.indices, minlength=matrix.shape[1]) > dense_fraction * matrix.shape[0]
+            state['dense'] = matrix[:, np.flatnonzero(frequent)].toarray()
+            matrix = matrix[:, np.flatnonzero(~frequent)]
+            levels = np.unique(matrix.data)
+        state['layers'] = []
+        previous = 0
+        for level in levels:
+            layer = matrix.copy()
+            layer.data = (layer.data >= level).astype(np.float64)
+            layer.eliminate_zeros()
+            weight = level - previous if metric == 'braycurtis' else 1.0
+            state['layers'].append((weight, layer, layer.T.tocsr()))
+            previous = level
+    return state
+
+
+def block_distances(state, start, stop):
+    """ Dense (stop - start) x n_samples block of distances between rows start:stop and all samples """
+    shared = np.zeros((stop - start, state['n_samples']))
+    for weight, layer, layer_t in state['layers']:
+        shared += weight * (layer[start:stop] @ layer_t).toarray()
+    if 'dense' in state:
+        dense = state['dense']
+        for j in range(dense.shape[1]):
+            shared += np.minimum(dense[start:stop, j, None], dense[None, :, j])
+    if state['metric'] == 'cosine':
+        distances = 1 - shared
+    else:
+        sums = state['sums']
+        total = sums[start:stop, None] + sums[None, :]
+        if state['metric'] == 'jaccard':
+            total = total - shared
+        else:
+            shared = 2 * shared
+        with np.errstate(divide='ignore', invalid='ignore'):
+            distances = np.where(total > 0, 1 - shared / np.where(total > 0, total, 1), 0)
+    distances = np.clip(distances, 0, 1)
+    distances[np.arange(stop - start), np.arange(start, stop)] = 0
+    return distances
+
+
+def top_k(distances, start, k):
+    """ Indices and distances of the k nearest other samples of each row of a block, closest first """
+    distances = distances.copy()
+    distances[np.arange(distances.shape[0]), np.arange(start, start + distances.shape[0])] = np.inf
+    k = min(k, distances.shape[1] - 1)
+    if k <= 0:
+        return np.empty((distances.shape[0], 0), dtype=np.int64), np.empty((distances.shape[0], 0))
+    indices = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    values = np.take_along_axis(distances, indices, axis=1)
+    order = np.argsort(values, axis=1, kind='stable')
+    return np.take_along_axis(indices, order, axis=1), np.take_along_axis(values, order, axis=1)
+
+
+def _init_worker(state, distance_path, k):
+    global _STATE
+    _STATE = dict(state, distance_path=distance_path, k=k)
+
+
+def _process_block(bounds):
+    """ Compute a block of rows, write it to the distance matrix memory map and return its top-k and squared row sums """
+    start, stop = bounds
+    distances = block_distances(_STATE, start, stop)
+    if _STATE['distance_path'] is not None:
+        output = np.load(_STATE['distance_path'], mmap_mode='r+')
+        output[start:stop] = distances
+        output.flush()
+        del output
+    indices, values = top_k(distances, start, _STATE['k'])
+    return start, indices, values, (distances ** 2).sum(axis=1)
+
+
+def pairwise_distances(matrix, metric, distance_path=None, k=10, block_size=256, n_jobs=-1):
+    """ Blocked pairwise distances between the rows of a sparse matrix, computed in a process pool
+
+    Only blocks of block_size x n_samples distances are held in memory by each worker. When distance_path
+    is given, the full matrix is written there as a float32 .npy memory map.
+
+    Returns:
+        indices, distances (np.ndarray): n_samples x k nearest neighbours (closest first) and their distances
+        squared_sums (np.ndarray): sum of the squared distances of each sample, used by pcoa
+    """
+    state = prepare(matrix, metric)
+    n_samples = state['n_samples']
+    if distance_path is not None:
+        output = np.lib.format.open_memmap(distance_path, mode='w+', dtype=np.float32, shape=(n_samples, n_samples))
+        del output
+    blocks = [(start, min(start + block_size, n_samples)) for start in range(0, n_samples, block_size)]
+    results = sample_discovery.load_files(_process_block, blocks, n_jobs=n_jobs, chunksize=1, desc=f'{metric} distances',
+                                          initializer=_init_worker, initargs=(state, distance_path, k))
+    k = min(k, max(n_samples - 1, 0))
+    indices = np.empty((n_samples, k), dtype=np.int64)
+    distances = np.empty((n_samples, k))
+    squared_sums = np.empty(n_samples)
+    for start, block_indices, block_values, block_sums in results:
+        stop = start + block_indices.shape[0]
+        indices[start:stop], distances[start:stop], squared_sums[start:stop] = block_indices, block_values, block_sums
+    return indices, distances, squared_sums
+
+
+def neighbours_table(samples, indices, distances):
+    """ Long table of nearest neighbours: sample, rank (1 = closest), neighbour, distance """
+    samples = np.asarray(samples, dtype=object)
+    k = indices.shape[1]
+    return pd.DataFrame({'sample': np.repeat(samples, k), 'rank': np.tile(np.arange(1, k + 1), len(samples)),
+                         'neighbour': samples[indices.ravel()], 'distance': distances.ravel()})
+
+
+def pcoa(distance_path, samples, squared_sums, n_components=10, block_size=1024):
+    """ Principal coordinate analysis of the .npy distance matrix, without loading it in memory
+
+    The Gower-centered matrix B = -1/2 J D^2 J is applied block by block from the memory map, and its
+    largest eigenpairs are found with scipy eigsh: same coordinates (up to sign) as skbio pcoa.
+    """
+    from skbio import OrdinationResults
+    distances = np.load(distance_path, mmap_mode='r')
+    n_samples = distances.shape[0]
+    if n_samples < 2:
+        raise ValueError(f'PCoA needs at least 2 samples, the distance matrix has {n_samples}')
+    row_means = -0.5 * squared_sums / n_samples
+    grand_mean = row_means.mean()
+
+    def matmat(vectors):
+        vectors = np.asarray(vectors, dtype=np.float64)
+        if vectors.ndim == 1:
+            return matmat(vectors[:, None]).ravel()
+        product = np.empty((n_samples, vectors.shape[1]))
+        for start in range(0, n_samples, block_size):
+            block = distances[start:start + block_size].astype(np.float64)
+            product[start:start + block_size] = -0.5 * (block ** 2) @ vectors
+        column_sums = vectors.sum(axis=0)
+        return product - np.outer(row_means, column_sums) - (row_means @ vectors)[None, :] + grand_mean * column_sums[None, :]
+
+    operator = LinearOperator((n_samples, n_samples), matvec=matmat, matmat=matmat, dtype=np.float64)
+    n_components = min(n_components, n_samples - 1)
+    eigvals, eigvecs = eigsh(operator, k=n_components, which='LA')
+    order = np.argsort(eigvals)[::-1]
+    eigvals, eigvecs = eigvals[order], eigvecs[:, order]
+    coordinates = eigvecs * np.sqrt(np.clip(eigvals, 0, None))
+    axes = [f'PC{i + 1}' for i in range(n_components)]
+    # trace(B) = sum of all eigenvalues = -n * grand mean, since the diagonal of D is 0
+    trace = -n_samples * grand_mean
+    return OrdinationResults(short_method_name='PCoA', long_method_name='Principal Coordinate Analysis',
+                             eigvals=pd.Series(eigvals, index=axes),
+                             samples=pd.DataFrame(coordinates, index=list(samples), columns=axes),
+                             proportion_explained=pd.Series(eigvals / trace, index=axes))
@@ -0,0 +1,218 @@
+import argparse
+import json
+import os
+import sqlite3
+import textwrap
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from .memo_matrix import SparseMemoMatrix, load_matrix, load_metadata, vectorize_sample, VECTORIZATION_PARAMETERS
+
+DEFAULT_INDEX_NAME = 'memo_index.db'
+CHUNK_SIZE = 900
+
+
+class MemoIndex:
+    """ Persistent exact nearest-neighbour index of MEMO vectors, for the cosine distance
+
+    Each sample is stored with its sparse MEMO vector (word ids and counts), so that new samples (with new
+    words) can be added at any time. The L2-normalized vectors of all samples are read once in a word-major
+    sparse matrix (an inverted index): a query only reads the entries of its own words, and the scores of all
+    samples are exact cosine similarities.
+
+    Args:
+        path (str): path to the index SQLite DB, created if needed
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, value TEXT)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS words (word_id INTEGER PRIMARY KEY, word TEXT UNIQUE NOT NULL)')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS samples (
+                                 sample_id TEXT PRIMARY KEY,
+                                 word_ids BLOB NOT NULL,
+                                 counts BLOB NOT NULL)''')
+        if 'sketch' in [column[1] for column in self.conn.execute('PRAGMA table_info(samples)')]:
+            # Indexes of previous versions also stored a random-projection sketch of each sample
+            self.conn.execute('ALTER TABLE samples RENAME TO sketched_samples')
+            self.conn.execute('''CREATE TABLE samples (
+                                     sample_id TEXT PRIMARY KEY,
+                                     word_ids BLOB NOT NULL,
+                                     counts BLOB NOT NULL)''')
+            self.conn.execute('INSERT INTO samples SELECT sample_id, word_ids, counts FROM sketched_samples ORDER BY rowid')
+            self.conn.execute('DROP TABLE sketched_samples')
+            self.conn.execute("DELETE FROM metadata WHERE key IN ('n_components', 'seed', 'projection')")
+        self.conn.commit()
+        self.word_ids = dict(self.conn.execute('SELECT word, word_id FROM words'))
+        self.words = [word for word, _ in sorted(self.word_ids.items(), key=lambda item: item[1])]
+        self._samples = None
+
+    def get_metadata(self, key):
+        row = self.conn.execute('SELECT value FROM metadata WHERE key = ?', (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def set_metadata(self, key, value):
+        self.conn.execute('INSERT OR REPLACE INTO metadata VALUES (?, ?)', (key, value))
+        self.conn.commit()
+
+    def lookup(self, words):
+        """ word_id of the words, -1 for words not in the index """
+        return np.fromiter((self.word_ids.get(word, -1) for word in words), dtype=np.int64, count=len(words))
+
+    def add_matrix(self, table):
+        """ Add (or replace) the samples of a SparseMemoMatrix; return the number of samples added """
+        new_words = [(len(self.word_ids) + i, word) for i, word in enumerate(word for word in table.words if word not in self.word_ids)]
+        self.conn.executemany('INSERT INTO words VALUES (?, ?)', new_words)
+        self.word_ids.update((word, word_id) for word_id, word in new_words)
+        self.words.extend(word for _, word in new_words)
+        ids = np.asarray([self.word_ids[word] for word in table.words], dtype=np.int32)
+        matrix = table.matrix.tocsr()
+        rows = []
+        for i, sample_id in enumerate(table.samples):
+            row = slice(matrix.indptr[i], matrix.indptr[i + 1])
+            rows.append((sample_id, ids[matrix.indices[row]].tobytes(), matrix.data[row].astype(np.float32).tobytes()))
+        self.conn.executemany('INSERT OR REPLACE INTO samples VALUES (?, ?, ?)', rows)
+        self.conn.commit()
+        self._samples = None
+        return len(rows)
+
+    def add(self, sample_id, vector):
+        """ Add (or replace) a single sample from its {word: count} vector """
+        return self.add_matrix(SparseMemoMatrix.from_vectors([(sample_id, vector)]))
+
+    def samples(self):
+        self._load()
+        return list(self._samples)
+
+    def _load(self):
+        """ Read the normalized vectors of all samples in a words x samples CSR matrix, once and after each add """
+        if self._samples is None:
+            rows = self.conn.execute('SELECT sample_id, word_ids, counts FROM samples ORDER BY rowid').fetchall()
+            self._samples = np.asarray([row[0] for row in rows], dtype=object)
+            self._rows = {sample_id: i for i, sample_id in enumerate(self._samples)}
+            word_ids = np.frombuffer(b''.join(row[1] for row in rows), dtype=np.int32)
+            counts = np.frombuffer(b''.join(row[2] for row in rows), dtype=np.float32)
+            indptr = np.concatenate([[0], np.cumsum([len(row[1]) // 4 for row in rows], dtype=np.int64)])
+            vectors = sparse.csr_matrix((counts, word_ids, indptr), shape=(len(rows), len(self.words)))
+            norms = np.sqrt(np.asarray(vectors.multiply(vectors).sum(axis=1), dtype=np.float64).ravel())
+            norms[norms == 0] = 1
+            self._postings = sparse.csr_matrix(sparse.diags((1 / norms).astype(np.float32)) @ vectors).T.tocsr()
+
+    def vectors(self, sample_ids):
+        """ {sample_id: (word_ids, counts)} of indexed samples """
+        vectors = {}
+        sample_ids = list(sample_ids)
+        for start in range(0, len(sample_ids), CHUNK_SIZE):
+            chunk = sample_ids[start:start + CHUNK_SIZE]
+            query = f"SELECT sample_id, word_ids, counts FROM samples WHERE sample_id IN ({','.join('?' * len(chunk))})"
+            for sample_id, word_ids, counts in self.conn.execute(query, chunk):
+                vectors[sample_id] = np.frombuffer(word_ids, dtype=np.int32), np.frombuffer(counts, dtype=np.float32)
+        return vectors
+
+    def query(self, vector, k=10, exclude=None):
+        """ The k indexed samples closest to a {word: count} vector, as a list of (sample_id, cosine distance)
+
+        Only the rows of the query words are read from the inverted index: the cost of a query grows with the
+        number of samples sharing its words, not with the size of the index.
+        """
+        self._load()
+        if len(self._samples) == 0:
+            return []
+        words = list(vector)
+        counts = np.asarray([vector[word] for word in words], dtype=np.float64)
+        ids = self.lookup(words)
+        known = ids >= 0
+        postings = self._postings[ids[known]]
+        norm = np.linalg.norm(counts)
+        scores = np.bincount(postings.indices, weights=np.repeat(counts[known], np.diff(postings.indptr)) * postings.data,
+                             minlength=len(self._samples)) / (norm if norm > 0 else 1)
+        distances = np.clip(1 - scores, 0, 1)
+        if exclude is not None:
+            distances[[self._rows[sample_id] for sample_id in exclude if sample_id in self._rows]] = np.inf
+        k = min(k, len(distances))
+        best = np.argpartition(distances, k - 1)[:k] if k < len(distances) else np.arange(len(distances))
+        best = best[np.lexsort((best, distances[best]))]
+        return [(self._samples[i], float(distances[i])) for i in best if np.isfinite(distances[i])]
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM samples').fetchone()[0]
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main(argv=None, prog=None):
+    """ Manage the MEMO vectors index from the command line (sys.argv by default) """
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent('''\
+            Manage the nearest-neighbour index of MEMO vectors, to find the samples closest to new ones.
+             --------------------------------
+                add: add (or replace) the samples of a MEMO matrix to the index, created if needed
+                query: print the --top_k indexed samples closest to the samples of a MEMO matrix or to a .mgf file
+                status: print the index size and parameters
+            '''))
+    parser.add_argument('command', choices=['add', 'query', 'status'])
+    parser.add_argument('-p', '--sample_dir_path', required=True, help='The path to the directory where samples folders to process are located')
+    parser.add_argument('--index_name', default=DEFAULT_INDEX_NAME, help=f"Index file in <sample_dir_path>/003_memo_analysis/, default {DEFAULT_INDEX_NAME}")
+    parser.add_argument('--input', help="With add and query, MEMO matrix file in <sample_dir_path>/003_memo_analysis/, as exported by memo_unaligned_repo.py")
+    parser.add_argument('--samples', nargs='+', help="With query --input, only query these samples")
+    parser.add_argument('--mgf', help="With query, .mgf file of a new sample, vectorized with the index vectorization parameters")
+    parser.add_argument('--ionization', choices=['pos', 'neg'], help="Ionization mode of the --mgf file")
+    parser.add_argument('--top_k', type=int, default=10, help="Number of neighbours returned by query, default 10")
+    parser.add_argument('--output', help="With query, write the neighbours to this CSV file in <sample_dir_path>/003_memo_analysis/")
+    args = parser.parse_args(argv)
+    if (args.input is None) and ((args.command == 'add') or ((args.command == 'query') and (args.mgf is None))):
+        parser.error(f'{args.command} needs --input' + (' or --mgf' if args.command == 'query' else ''))
+
+    PATH = os.path.normpath(args.sample_dir_path + '/003_memo_analysis/')
+    index = MemoIndex(os.path.join(PATH, args.index_name))
+    with index:
+        if args.command == 'add':
+            metadata = load_metadata(os.path.join(PATH, args.input))
+            if metadata is not None:
+                index.set_metadata('vectorization_parameters', json.dumps(metadata['vectorization_parameters']))
+            n = index.add_matrix(load_matrix(os.path.join(PATH, args.input)))
+            print(f'{n} samples added, {len(index)} samples indexed')
+        elif args.command == 'query':
+            if args.mgf is not None:
+                if args.ionization is None:
+                    raise ValueError('Set --ionization to query a .mgf file')
+                parameters = json.loads(index.get_metadata('vectorization_parameters') or '{}')
+                parameters = {parameter: parameters[parameter] for parameter in VECTORIZATION_PARAMETERS if parameter in parameters}
+                vector = vectorize_sample(args.mgf, **parameters)
+                queries = [(os.path.basename(args.mgf), {f'{word}_{args.ionization}': count for word, count in vector.items()})]
+            else:
+                table = load_matrix(os.path.join(PATH, args.input))
+                if args.samples is not None:
+                    table = table.select_samples(args.samples)
+                queries = [(sample_id, vector) for sample_id, vector in
+                           zip(table.samples, (dict(zip([table.words[j] for j in row.indices], row.data)) for row in table.matrix))]
+            neighbours = []
+            for sample_id, vector in queries:
+                for rank, (neighbour, distance) in enumerate(index.query(vector, k=args.top_k, exclude=[sample_id]), start=1):
+                    neighbours.append({'sample': sample_id, 'rank': rank, 'neighbour': neighbour, 'distance': distance})
+            neighbours = pd.DataFrame(neighbours, columns=['sample', 'rank', 'neighbour', 'distance'])
+            if args.output is not None:
+                neighbours.to_csv(os.path.join(PATH, args.output), index=False)
+            else:
+                print(neighbours.to_string(index=False))
+        else:
+            print(f'samples: {len(index)}')
+            for key, value in index.conn.execute('SELECT key, value FROM metadata'):
+                print(f'{key}: {value}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,389 @@
+import json
+import os
+from array import array
+from functools import partial
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from . import sample_discovery
+
+# memo_ms, spec2vec and pyarrow are imported by the functions using them: loading a .npz / .npy matrix needs none of them
+
+VECTORIZATION_PARAMETERS = ['min_relative_intensity', 'max_relative_intensity', 'min_peaks_required',
+                            'losses_from', 'losses_to', 'n_decimals']
+
+
+def vectorize_sample(mgf_path, min_relative_intensity=0.01, max_relative_intensity=1.00, min_peaks_required=10,
+                     losses_from=10, losses_to=200, n_decimals=2):
+    """ Return the MEMO vector of a sample: the {word: count} of the peaks and losses of its spectra
+
+    Same processing as memo_ms.MemoMatrix.memo_from_unaligned_samples, for a single .mgf file.
+    """
+    from memo_ms import import_data
+    from spec2vec import SpectrumDocument
+    spectra = import_data.load_and_filter_from_mgf(
+        path=mgf_path, min_relative_intensity=min_relative_intensity, max_relative_intensity=max_relative_intensity,
+        loss_mz_from=losses_from, loss_mz_to=losses_to, n_required=min_peaks_required
+        )
+    counts = Counter()
+    for spectrum in spectra:
+        counts.update(SpectrumDocument(spectrum, n_decimals=n_decimals).words)
+    return dict(counts)
+
+
+class SparseMemoMatrix:
+    """ MEMO matrix stored as a CSR sparse matrix of word counts
+
+    Args:
+        matrix (scipy.sparse.csr_matrix): samples x words counts
+        samples (list): row labels (sample_id)
+        words (list): column labels (peak_/loss_ words)
+    """
+
+    def __init__(self, matrix, samples, words):
+        self.matrix = sparse.csr_matrix(matrix)
+        self.samples = list(samples)
+        self.words = list(words)
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    @classmethod
+    def from_vectors(cls, vectors):
+        """ Build the matrix from an iterable of (sample_id, {word: count}), without any dense intermediate
+
+        Words are ordered by first appearance, as in memo_ms MEMO matrices.
+        """
+        vocabulary = {}
+        samples = []
+        indptr = array('q', [0])
+        indices = array('q')
+        data = array('d')
+        for sample_id, counts in vectors:
+            samples.append(sample_id)
+            for word, count in counts.items():
+                indices.append(vocabulary.setdefault(word, len(vocabulary)))
+                data.append(count)
+            indptr.append(len(indices))
+        matrix = sparse.csr_matrix((np.frombuffer(data, dtype=np.float64), np.frombuffer(indices, dtype=np.int64),
+                                    np.frombuffer(indptr, dtype=np.int64)), shape=(len(samples), len(vocabulary)))
+        matrix.sort_indices()
+        return cls(matrix, samples, list(vocabulary))
+
+    def select_samples(self, samples):
+        index = {sample: i for i, sample in enumerate(self.samples)}
+        rows = [index[sample] for sample in samples]
+        return SparseMemoMatrix(self.matrix[rows], samples, self.words)
+
+    def drop_samples(self, samples):
+        samples = set(samples)
+        return self.select_samples([sample for sample in self.samples if sample not in samples])
+
+    def select_words(self, mask):
+        """ Keep the words (columns) where mask is True """
+        mask = np.asarray(mask, dtype=bool)
+        return SparseMemoMatrix(self.matrix[:, np.flatnonzero(mask)], self.samples, np.asarray(self.words, dtype=object)[mask])
+
+    def word_occurrences(self, samples=None):
+        """ Number of samples (among samples, default all) in which each word occurs
+
+        Counted with a single bincount over the stored non-zero entries: no dense or sparse copy of the matrix is made.
+        """
+        matrix = self.matrix
+        if samples is None:
+            indices = matrix.indices[matrix.data != 0]
+        else:
+            index = {sample: i for i, sample in enumerate(self.samples)}
+            rows = [index[sample] for sample in samples]
+            indices = [matrix.indices[matrix.indptr[row]:matrix.indptr[row + 1]][matrix.data[matrix.indptr[row]:matrix.indptr[row + 1]] != 0]
+                       for row in rows]
+            indices = np.concatenate(indices) if len(indices) > 0 else np.array([], dtype=np.int64)
+        return np.bincount(indices, minlength=len(self.words))
+
+    def prune_words(self):
+        """ Remove the words that do not occur in any sample """
+        return self.select_words(self.word_occurrences() > 0)
+
+    def add_suffix(self, suffix):
+        return SparseMemoMatrix(self.matrix, self.samples, [word + suffix for word in self.words])
+
+    def merge(self, other):
+        """ Inner join of two matrices on samples (e.g. pos and neg), keeping self samples order """
+        other_samples = set(other.samples)
+        samples = [sample for sample in self.samples if sample in other_samples]
+        return SparseMemoMatrix(sparse.hstack([self.select_samples(samples).matrix, other.select_samples(samples).matrix], format='csr'),
+                                samples, self.words + other.words)
+
+    def to_dataframe(self):
+        """ Dense DataFrame with a filename column, as exported by previous versions """
+        df = pd.DataFrame(self.matrix.toarray(), columns=self.words)
+        df.insert(0, 'filename', self.samples)
+        return df
+
+    def save_labels(self, path_prefix, metadata=None):
+        """ Write the samples / words, one per line, to <path_prefix>_samples.txt / _words.txt, and metadata to <path_prefix>_metadata.json """
+        for suffix, labels in [('_samples.txt', self.samples), ('_words.txt', self.words)]:
+            with open(path_prefix + suffix, 'w') as f:
+                f.writelines(label + '\n' for label in labels)
+        if metadata is not None:
+            with open(path_prefix + '_metadata.json', 'w') as f:
+                json.dump(metadata, f, indent=2)
+
+    def save_npz(self, path_prefix, metadata=None):
+        """ Write the sparse matrix to <path_prefix>.npz, with its labels and metadata (see save_labels) """
+        sparse.save_npz(path_prefix + '.npz', self.matrix)
+        self.save_labels(path_prefix, metadata)
+
+    def save_npy(self, path_prefix, metadata=None, block_size=1024):
+        """ Write the dense matrix to <path_prefix>.npy, with its labels and metadata (see save_labels)
+
+        The .npy is filled block of rows by block of rows, so that the dense matrix is never held in memory.
+        It can be memory-mapped with numpy.load(path, mmap_mode='r').
+        """
+        dense = np.lib.format.open_memmap(path_prefix + '.npy', mode='w+', dtype=self.matrix.dtype, shape=self.shape)
+        for start in range(0, self.shape[0], block_size):
+            dense[start:start + block_size] = self.matrix[start:start + block_size].toarray()
+        dense.flush()
+        del dense
+        self.save_labels(path_prefix, metadata)
+
+    def arrow_schema(self, metadata=None):
+        """ Arrow schema of the Parquet / Feather exports: a long table of the non-zero counts (filename, word, count)
+
+        filename and word are dictionary-encoded. The samples and words, in the matrix order, are stored as JSON
+        in the schema metadata (keys b'memo_samples' and b'memo_words'), and metadata as JSON under b'memo'.
+        If it has a 'suffixes' entry ({ionization: suffix}), the words of each ionization are added to it as
+        ranges of word indices ('ionization_columns': {ionization: [[start, stop], ...]}, stop excluded).
+        """
+        import pyarrow as pa
+        if (metadata is not None) and ('suffixes' in metadata):
+            ionization_columns = {}
+            previous = None
+            for k, word in enumerate(self.words):
+                ionization = next((ion for ion, suffix in metadata['suffixes'].items() if word.endswith(suffix)), None)
+                if ionization is not None:
+                    if ionization == previous:
+                        ionization_columns[ionization][-1][1] = k + 1
+                    else:
+                        ionization_columns.setdefault(ionization, []).append([k, k + 1])
+                previous = ionization
+            metadata = dict(metadata, ionization_columns=ionization_columns)
+        schema_metadata = {'memo_samples': json.dumps(self.samples), 'memo_words': json.dumps(self.words)}
+        if metadata is not None:
+            schema_metadata['memo'] = json.dumps(metadata)
+        fields = [pa.field('filename', pa.dictionary(pa.int32(), pa.string())),
+                  pa.field('word', pa.dictionary(pa.int32(), pa.string())),
+                  pa.field('count', pa.from_numpy_dtype(self.matrix.dtype))]
+        return pa.schema(fields, metadata=schema_metadata)
+
+    def arrow_block_size(self, max_rows=2 ** 20):
+        """ Number of samples of the record batches, so that a batch holds about max_rows non-zero counts """
+        return max(1, max_rows * self.shape[0] // max(1, self.matrix.nnz))
+
+    def iter_record_batches(self, schema, block_size=None):
+        """ Arrow record batches of the non-zero counts of block_size samples, in samples order
+
+        Every batch shares the same filename and word dictionaries (all samples and words).
+        """
+        import pyarrow as pa
+        block_size = block_size or self.arrow_block_size()
+        samples = pa.array(self.samples, type=pa.string())
+        words = pa.array(self.words, type=pa.string())
+        for start in range(0, self.shape[0], block_size):
+            block = self.matrix[start:start + block_size]
+            rows = np.repeat(np.arange(start, start + block.shape[0], dtype=np.int32), np.diff(block.indptr))
+            columns = [pa.DictionaryArray.from_arrays(pa.array(rows), samples),
+                       pa.DictionaryArray.from_arrays(pa.array(block.indices.astype(np.int32)), words),
+                       pa.array(block.data)]
+            yield pa.RecordBatch.from_arrays(columns, schema=schema)
+
+    def to_arrow(self, metadata=None, block_size=None):
+        """ Arrow long table of the non-zero counts (see arrow_schema), held in memory """
+        import pyarrow as pa
+        schema = self.arrow_schema(metadata)
+        return pa.Table.from_batches(list(self.iter_record_batches(schema, block_size)), schema=schema)
+
+    def save_parquet(self, path, metadata=None, block_size=None):
+        """ Write the non-zero counts as Parquet, one row group per block of samples
+
+        Rows are sorted by sample, so that a filter on filename only reads the matching row groups.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet
+        schema = self.arrow_schema(metadata)
+        with pyarrow.parquet.ParquetWriter(path, schema, compression='zstd') as writer:
+            for batch in self.iter_record_batches(schema, block_size):
+                writer.write_table(pa.Table.from_batches([batch], schema=schema))
+
+    def save_feather(self, path, metadata=None, block_size=None):
+        """ Write the non-zero counts as uncompressed Feather (Arrow IPC file), one record batch per block of samples
+
+        The file can be memory-mapped without decompression.
+        """
+        import pyarrow as pa
+        schema = self.arrow_schema(metadata)
+        with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, schema) as writer:
+            for batch in self.iter_record_batches(schema, block_size):
+                writer.write_batch(batch)
+
+    @classmethod
+    def load_arrow(cls, path, samples=None, words=None):
+        """ Load a Parquet / Feather export (see arrow_schema) straight into a sparse matrix
+
+        Only the rows of the given samples and words (default all, in the export order) are read, through
+        an Arrow dataset filter on the filename and word columns.
+        """
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.dataset as ds
+        dataset = ds.dataset(path, format='parquet' if path.endswith('.parquet') else 'ipc')
+        labels = {key: json.loads(dataset.schema.metadata[('memo_' + key).encode()]) for key in ['samples', 'words']}
+        condition = None
+        for column, selected in [('filename', samples), ('word', words)]:
+            if selected is not None:
+                expression = ds.field(column).isin(pa.array(list(selected), type=pa.string()))
+                condition = expression if condition is None else condition & expression
+        table = dataset.to_table(filter=condition)
+        samples = labels['samples'] if samples is None else list(samples)
+        words = labels['words'] if words is None else list(words)
+
+        def positions(column, labels):
+            """ Positions in labels of the values of a dictionary-encoded column, decoding only the dictionaries """
+            value_set = pa.array(labels, type=pa.string())
+            chunks = [pc.index_in(chunk.dictionary, value_set=value_set).fill_null(-1).to_numpy()[chunk.indices.to_numpy()]
+                      for chunk in column.chunks]
+            return np.concatenate(chunks) if chunks else np.array([], dtype=np.int64)
+
+        matrix = sparse.csr_matrix((table['count'].to_numpy(), (positions(table['filename'], samples), positions(table['word'], words))),
+                                   shape=(len(samples), len(words)))
+        return cls(matrix, samples, words)
+
+    @staticmethod
+    def load_labels(path_prefix):
+        labels = []
+        for suffix in ['_samples.txt', '_words.txt']:
+            with open(path_prefix + suffix) as f:
+                labels.append(f.read().splitlines())
+        return labels
+
+    @classmethod
+    def load_npz(cls, path_prefix):
+        return cls(sparse.load_npz(path_prefix + '.npz'), *cls.load_labels(path_prefix))
+
+    @classmethod
+    def load_npy(cls, path_prefix, block_size=1024):
+        """ Load a dense .npy export, block of rows by block of rows through a memory map """
+        dense = np.load(path_prefix + '.npy', mmap_mode='r')
+        blocks = [sparse.csr_matrix(dense[start:start + block_size]) for start in range(0, dense.shape[0], block_size)]
+        matrix = sparse.vstack(blocks, format='csr') if blocks else sparse.csr_matrix(dense.shape)
+        return cls(matrix, *cls.load_labels(path_prefix))
+
+    @classmethod
+    def from_dataframe(cls, df):
+        """ Build the matrix from a DataFrame with a filename column, as returned by to_dataframe """
+        words = [column for column in df.columns if column != 'filename']
+        return cls(sparse.csr_matrix(df[words].to_numpy(dtype=np.float64)), df['filename'].astype(str), words)
+
+    @classmethod
+    def load_csv(cls, path, max_cells=2 ** 23):
+        """ Load a dense CSV export (e.g. .gz, see to_dataframe) by chunks of rows of at most max_cells values
+
+        Each chunk is converted to a sparse matrix before the next one is read, so that the dense matrix is never held in memory.
+        """
+        n_columns = len(pd.read_csv(path, nrows=0).columns)
+        chunks = [cls.from_dataframe(chunk) for chunk in pd.read_csv(path, chunksize=max(1, max_cells // n_columns))]
+        if len(chunks) == 0:
+            return cls.from_dataframe(pd.read_csv(path))
+        return cls(sparse.vstack([chunk.matrix for chunk in chunks], format='csr'),
+                   [sample for chunk in chunks for sample in chunk.samples], chunks[0].words)
+
+
+def load_matrix(path):
+    """ Load a MEMO matrix exported by memo_unaligned_repo.py, in any --output_format, from its file path """
+    if path.endswith('.npz'):
+        return SparseMemoMatrix.load_npz(path[:-len('.npz')])
+    if path.endswith('.npy'):
+        return SparseMemoMatrix.load_npy(path[:-len('.npy')])
+    if path.endswith('.parquet') or path.endswith('.feather'):
+        return SparseMemoMatrix.load_arrow(path)
+    return SparseMemoMatrix.load_csv(path)
+
+
+def load_metadata(path):
+    """ Metadata (ionizations, suffixes, vectorization parameters...) stored with a MEMO matrix export, None if unavailable """
+    for extension in ['.npz', '.npy']:
+        if path.endswith(extension):
+            metadata_path = path[:-len(extension)] + '_metadata.json'
+            if not os.path.exists(metadata_path):
+                return None
+            with open(metadata_path) as f:
+                return json.load(f)
+    if path.endswith('.parquet'):
+        import pyarrow.parquet
+        schema = pyarrow.parquet.read_schema(path)
+    elif path.endswith('.feather'):
+        import pyarrow.ipc
+        schema = pyarrow.ipc.open_file(path).schema
+    else:
+        return None
+    metadata = (schema.metadata or {}).get(b'memo')
+    return None if metadata is None else json.loads(metadata)
+
+
+def filter_blanks(table, blanks, word_max_occ_blanks):
+    """ Remove the words present in more than word_max_occ_blanks blanks, then the blanks and the words left empty
+
+    Returns:
+        table (SparseMemoMatrix): the filtered matrix
+        report (dict): number of blank samples, blank words (above word_max_occ_blanks) and empty words removed
+    """
+    table_samples = set(table.samples)
+    blanks = [blank for blank in blanks if blank in table_samples]
+    keep = table.word_occurrences(blanks) <= word_max_occ_blanks
+    table = table.select_words(keep).drop_samples(blanks)
+    n_words = len(table.words)
+    table = table.prune_words()
+    report = {'blank_samples': len(blanks), 'blank_words': int((~keep).sum()), 'empty_words': n_words - len(table.words)}
+    return table, report
+
+
+def memo_from_samples(samples, ionizations, parameters, cache=None, n_jobs=1):
+    """ Vectorize the .mgf of every sample, for each ionization mode, and build their sparse MEMO matrices
+
+    The .mgf of all ionization modes are vectorized together in a process pool of n_jobs workers, started once
+    memo_ms and spec2vec are imported. With a
+    MemoVectorCache, only samples whose .mgf (or the vectorization parameters) changed are vectorized.
+    Matrices are then assembled in samples order, so that they do not depend on n_jobs.
+
+    Returns:
+        tables (dict): {ionization: SparseMemoMatrix}
+    """
+    mgf_files = [(ionization, sample.sample_id, sample.ionization(ionization).mgf)
+                 for ionization in ionizations for sample in samples if sample.ionization(ionization).mgf is not None]
+    mgf_paths = [mgf_path for _, _, mgf_path in mgf_files]
+    vectors = [None] * len(mgf_files)
+    keys = None
+    if cache is not None:
+        keys = sample_discovery.load_files(partial(cache.key, parameters=parameters), mgf_paths, n_jobs=n_jobs, desc='Hashing')
+        vectors = [cache.get(key) for key in keys]
+    missing = [k for k, vector in enumerate(vectors) if vector is None]
+    if len(missing) > 0:
+        # Imported before the process pool is started, so that forked workers inherit them instead of each
+        # importing them (and matchms) again
+        from memo_ms import import_data
+        from spec2vec import SpectrumDocument
+    computed = sample_discovery.load_files(partial(vectorize_sample, **parameters), [mgf_paths[k] for k in missing],
+                                           n_jobs=n_jobs, chunksize=1, desc='Vectorizing')
+    for k, vector in zip(missing, computed):
+        vectors[k] = vector
+        if cache is not None:
+            cache.put(keys[k], vector)
+
+    tables = {}
+    for ionization in ionizations:
+        tables[ionization] = SparseMemoMatrix.from_vectors(
+            (sample_id, vector) for (ion, sample_id, _), vector in zip(mgf_files, vectors) if ion == ionization)
+    return tables
@@ -0,0 +1,81 @@
+import os
+import argparse
+import textwrap
+import pandas as pd
+from .memo_matrix import load_matrix
+from .memo_distances import METRICS, pairwise_distances, neighbours_table, pcoa
+from . import run_report
+
+DESCRIPTION = textwrap.dedent('''\
+        Compute samples distances, nearest neighbours and PCoA from a MEMO matrix.
+        ''')
+
+""" Argument parser """
+
+def build_parser(prog=None):
+    parser = argparse.ArgumentParser(prog=prog, formatter_class=argparse.RawDescriptionHelpFormatter, description=DESCRIPTION)
+    parser.add_argument('-p', '--sample_dir_path', required=True, help='The path to the directory where samples folders to process are located')
+    parser.add_argument('--input', required=True, help="MEMO matrix file in <sample_dir_path>/003_memo_analysis/, as exported by memo_unaligned_repo.py (.gz, .npz, .npy, .parquet or .feather)", type= str)
+    parser.add_argument('--metric', nargs='+', choices=METRICS, default=['braycurtis'], help="Distance metric(s) to compute, default braycurtis")
+    parser.add_argument('--top_k', help="Number of nearest neighbours reported for each sample, default 10", type= int, default= 10)
+    parser.add_argument('--n_components', help="Number of PCoA axes, 0 to skip the PCoA, default 10", type= int, default= 10)
+    parser.add_argument('--block_size', help="Number of samples (rows of the distance matrix) computed at once by a worker, default 256", type= int, default= 256)
+    parser.add_argument('--n_jobs', type=int, default=-1, help="Number of processes used to compute the distance blocks, default -1 (all cores)")
+    parser.add_argument('--output', required=True, help="Output name to use for the generated files", type= str)
+    run_report.add_arguments(parser)
+    return parser
+
+
+def run(args):
+    """ Compute the distances, nearest neighbours and PCoA of the MEMO matrix of args, the parsed arguments of build_parser
+
+    Returns:
+        dict: {stage: runtime in seconds}
+    """
+    PATH = os.path.normpath(args.sample_dir_path + '/003_memo_analysis/')
+
+    report = run_report.RunReport('memo_similarity', args.report or f"{PATH}/{args.output}_similarity_run_report.json", profile=args.profile,
+                                  args=args)
+
+    with report:
+        with report.stage('load') as stage:
+            table = load_matrix(os.path.join(PATH, args.input))
+            stage.items = table.shape[0]
+        print(f"MEMO matrix loaded: {table.shape[0]} samples, {table.shape[1]} words")
+
+        for metric in args.metric:
+            prefix = f"{PATH}/{args.output}_{metric}"
+            with report.stage(f'{metric}_distances', items=table.shape[0]):
+                indices, distances, squared_sums = pairwise_distances(table.matrix, metric, distance_path=prefix + '_distances.npy',
+                                                                      k=args.top_k, block_size=args.block_size, n_jobs=args.n_jobs)
+                with open(prefix + '_distances_samples.txt', 'w') as f:
+                    f.writelines(sample + '\n' for sample in table.samples)
+                neighbours_table(table.samples, indices, distances).to_csv(prefix + f'_top{args.top_k}.csv', index=False)
+
+            if args.n_components > 0:
+                with report.stage(f'{metric}_pcoa', items=table.shape[0]):
+                    ordination = pcoa(prefix + '_distances.npy', table.samples, squared_sums, n_components=args.n_components)
+                    ordination.write(prefix + '_pcoa.txt')
+                    ordination.samples.to_csv(prefix + '_pcoa_coordinates.csv', index_label='sample')
+
+        timings = {stage['stage']: stage['wall_time_s'] for stage in report.stages}
+        for stage, seconds in timings.items():
+            print(f"{stage}: {seconds:.2f} s")
+
+        params = pd.DataFrame.from_dict(vars(args).items()).rename(columns={0:'parameter', 1:'value'})
+        timings_df = pd.DataFrame({'parameter': [f'runtime_{stage}_s' for stage in timings], 'value': list(timings.values())})
+        params = pd.concat([params, timings_df], ignore_index=True)
+        params.to_csv(f"{PATH}/{args.output}_similarity_params.csv", index=False)
+
+        print(f'results are in {PATH}')
+        print(f'Run report: {report.write()}')
+    return timings
+
+
+def main(argv=None, prog=None):
+    """ Run the script with command-line arguments (sys.argv by default) """
+    return run(build_parser(prog).parse_args(argv))
+
+
+if __name__ == '__main__':
+    main()
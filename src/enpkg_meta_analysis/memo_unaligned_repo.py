@@ -0,0 +1,154 @@
+import os
+import argparse
+import pandas as pd
+import textwrap
+from functools import partial
+from . import sample_discovery
+from .memo_matrix import memo_from_samples, filter_blanks, VECTORIZATION_PARAMETERS
+from .memo_cache import MemoVectorCache
+from . import run_report
+
+DESCRIPTION = textwrap.dedent('''\
+        Compute MEMO matrix for a set of unaligned mgf files.
+        ''')
+
+""" Argument parser """
+
+def build_parser(prog=None):
+    parser = argparse.ArgumentParser(prog=prog, formatter_class=argparse.RawDescriptionHelpFormatter, description=DESCRIPTION)
+    parser.add_argument('-p', '--sample_dir_path', required=True, help='The path to the directory where samples folders to process are located')
+    parser.add_argument('--ionization', required=True, help="ionization mode to use to build the memo_matrix: pos, neg or both", type= str)
+    parser.add_argument('--min_relative_intensity', help="Minimal relative intensity to keep a peak max_relative_intensity, default 0.01", type= float, default= 0.01)
+    parser.add_argument('--max_relative_intensity', help="Maximal relative intensity to keep a peak max_relative_intensity, default 1", type= float, default= 1.0)
+    parser.add_argument('--min_peaks_required', help="Minimum number of peaks to keep a spectrum, default 10", type= int, default= 10)
+    parser.add_argument('--losses_from', help="Minimal m/z value for losses losses_to (int): maximal m/z value for losses, default 10", type= int, default= 10)
+    parser.add_argument('--losses_to', help="Maximal m/z value for losses losses_to (int): maximal m/z value for losses, default 200", type= int, default= 200)
+    parser.add_argument('--n_decimals', help="Number of decimal when translating peaks/losses into words, default 2", type= int, default= 2)
+    parser.add_argument('--filter_blanks', help="Remove blanks samples from the MEMO matrix", type= bool, default= False)
+    parser.add_argument('--word_max_occ_blanks', help="Set --filter_blanks to True to use. If word is present in more than n blanks, word is removed from MEMO matrix, default -1 (all words kept)", type= int, default= -1)
+    parser.add_argument('--n_jobs', type=int, default=-1, help="Number of processes used to vectorize the samples (both ionization modes at once) and load their metadata, default -1 (all cores)")
+    parser.add_argument('--cache_path', help="Path to the cache of per-sample MEMO vectors, default <sample_dir_path>/003_memo_analysis/memo_vectors_cache.db", type= str, default= None)
+    parser.add_argument('--cache_max_size', help="Maximal size of the MEMO vectors cache in MB, least recently used vectors are evicted beyond, default 1024", type= float, default= 1024)
+    parser.add_argument('--no_cache', help="Vectorize all samples without using the MEMO vectors cache", action='store_true')
+    parser.add_argument('--output_format', choices=['gz', 'npz', 'npy', 'parquet', 'feather'], default='gz',
+                        help="gz: dense gzip CSV matrix (default), npz: sparse matrix (.npz), npy: memory-mappable dense matrix (.npy), parquet / feather: Arrow long table of the non-zero counts, with metadata")
+    parser.add_argument('--output', required=True, help="Output name to use for the generated MEMO matrix", type= str)
+    run_report.add_arguments(parser)
+    return parser
+
+def get_blanks(samples, n_jobs):
+    """ Return the sample_id of blank samples, reading samples metadata in a process pool """
+    metadata = sample_discovery.load_files(partial(pd.read_csv, sep='\t', usecols=['sample_id', 'sample_type']),
+                                           sample_discovery.select_files(samples, 'metadata'), n_jobs=n_jobs)
+    return [m['sample_id'].values[0] for m in metadata if m['sample_type'].values[0] == "blank"]
+
+def run(args):
+    """ Compute the MEMO matrix of the samples of args, the parsed arguments of build_parser, and export it
+
+    Returns:
+        SparseMemoMatrix: the MEMO matrix
+    """
+    sample_dir_path = os.path.normpath(args.sample_dir_path)
+    ionization = args.ionization
+
+    if ionization == 'both':
+        ionizations = ['pos', 'neg']
+    elif ionization in ['pos', 'neg']:
+        ionizations = [ionization]
+    else:
+        raise ValueError('ionization must be pos, neg or both')
+
+    if (args.filter_blanks is False) & (args.word_max_occ_blanks != -1):
+        raise ValueError('Set --filter_blanks to True to use word_max_occ_blanks')
+
+    PATH = os.path.normpath(sample_dir_path + '/003_memo_analysis/')
+    if not os.path.exists(PATH):
+        os.makedirs(PATH)
+    report = run_report.RunReport('memo_unaligned_repo', args.report or f"{PATH}/{args.output}_run_report.json", profile=args.profile, args=args)
+
+    with report:
+        with report.stage('discover_samples') as stage:
+            samples = sample_discovery.discover_samples(sample_dir_path)
+            stage.items = len(samples)
+        parameters = {parameter: getattr(args, parameter) for parameter in VECTORIZATION_PARAMETERS}
+
+        cache = None
+        if not args.no_cache:
+            cache = MemoVectorCache(args.cache_path or os.path.join(PATH, 'memo_vectors_cache.db'), max_size_mb=args.cache_max_size)
+
+        # The vectors cache is closed even if the run fails
+        try:
+            # Blanks are identified once, for all ionization modes
+            blanks = None
+            if args.word_max_occ_blanks != -1:
+                with report.stage('blanks', items=len(samples)):
+                    blanks = get_blanks(samples, args.n_jobs)
+                print(f"{len(blanks)} blank samples found.")
+
+            i = len(sample_discovery.select_files(samples, 'mgf', ionizations=ionizations))
+            print(f"Generating MEMO matrix from {i} input files.") 
+            with report.stage('vectorize', items=i):
+                tables = memo_from_samples(samples, ionizations, parameters, cache=cache, n_jobs=args.n_jobs)
+
+            table = None
+            blank_filtering = {}
+            with report.stage('filter_merge') as stage:
+                for ion in ionizations:
+                    table_ion = tables.pop(ion)
+                    if blanks is not None:
+                        table_ion, blank_filtering[ion] = filter_blanks(table_ion, blanks, args.word_max_occ_blanks)
+                        print(f"{ion}: {blank_filtering[ion]['blank_samples']} blank samples removed, "
+                              f"{blank_filtering[ion]['blank_words']} words found in more than {args.word_max_occ_blanks} blanks removed, "
+                              f"{blank_filtering[ion]['empty_words']} words left empty removed")
+                    table_ion = table_ion.add_suffix('_' + ion)
+                    print(table_ion.shape)
+                    table = table_ion if table is None else table.merge(table_ion)
+                stage.items = table.shape[0]
+
+            if cache is not None:
+                evicted = cache.evict()
+                print(f"MEMO vectors cache: {cache.hits} samples reused, {cache.misses} samples vectorized, {evicted} vectors evicted")
+                report.cache('memo_vectors', cache.hits, cache.misses)
+        finally:
+            if cache is not None:
+                cache.close()
+
+        # export
+        metadata = {'ionizations': ionizations, 'suffixes': {ion: '_' + ion for ion in ionizations},
+                    'vectorization_parameters': parameters, 'blank_filtering': blank_filtering}
+        with report.stage('export', items=table.shape[0]):
+            if args.output_format == 'npz':
+                table.save_npz(f"{PATH}/{args.output}", metadata)
+            elif args.output_format == 'npy':
+                table.save_npy(f"{PATH}/{args.output}", metadata)
+            elif args.output_format == 'parquet':
+                table.save_parquet(f"{PATH}/{args.output}.parquet", metadata)
+            elif args.output_format == 'feather':
+                table.save_feather(f"{PATH}/{args.output}.feather", metadata)
+            else:
+                import datatable as dt
+                datatable = dt.Frame(table.to_dataframe())
+                datatable.to_csv(f"{PATH}/{args.output}.gz", compression="gzip")    
+        params = pd.DataFrame.from_dict(vars(args).items()).rename(columns={0:'parameter', 1:'value'})
+        included_samples_df = df = pd.DataFrame(index=[0], columns=['parameter', 'value'])
+        included_samples_df.loc[0, 'parameter'] = 'included_samples'
+        included_samples_df.loc[0, 'value'] = table.samples
+
+        blank_filtering_df = pd.DataFrame({'parameter': [f'blank_filtering_{ion}' for ion in blank_filtering],
+                                           'value': list(blank_filtering.values())})
+
+        params = pd.concat([params, included_samples_df, blank_filtering_df], ignore_index=True)
+        params.to_csv(f"{PATH}/{args.output}_params.csv", index=False)
+
+        print(f'results are in {PATH}') 
+        print(f'Run report: {report.write()}')
+    return table
+
+
+def main(argv=None, prog=None):
+    """ Run the script with command-line arguments (sys.argv by default) """
+    return run(build_parser(prog).parse_args(argv))
+
+
+if __name__ == '__main__':
+    main()
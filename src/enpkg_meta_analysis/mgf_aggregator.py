@@ -0,0 +1,468 @@
+import numpy as np
+import pandas as pd
+import os
+import argparse
+import textwrap
+from pathlib import Path
+from functools import partial
+import csv
+import json
+import shutil
+import hashlib
+from itertools import islice
+from tqdm import tqdm
+from . import sample_discovery
+from . import run_report
+
+# matchms is imported by the functions reading or writing spectra, so that importing this module stays fast
+
+# Relative sample paths are relative to the folder containing the repository
+BASE_DIR = Path(__file__).parents[3]
+
+DESCRIPTION = textwrap.dedent('''\
+        This script generate an aggregated .mgf spectra file from unaligned individual .mgf files for further GNPS classical MN processing. 
+         --------------------------------
+            Arguments:
+            - Path to the directory where samples folders are located
+            - ionization mode of spectra to aggregate
+            - Output name for the output
+        ''')
+
+""" Argument parser """
+
+def build_parser(prog=None):
+    parser = argparse.ArgumentParser(prog=prog, formatter_class=argparse.RawDescriptionHelpFormatter, description=DESCRIPTION)
+    parser.add_argument('-p', '--sample_dir_path', required=True,
+                        help='The path to the directory where samples folders to process are located')
+    parser.add_argument('-ion', '--ionization', required=True,
+                        help='The ionization mode to aggregate')
+    parser.add_argument('-out', '--output_name', required=True,
+                        help='The the output name for the .mgf and the .csv file to generate')
+    parser.add_argument('--n_jobs', type=int, default=-1,
+                        help='Number of processes used to load the samples spectra, default -1 (all cores)')
+    parser.add_argument('--streaming', action='store_true',
+                        help='Write spectra and their metadata sample by sample: memory is bounded by the largest sample instead of the whole cohort')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Update an existing aggregate: only new, changed or removed samples are processed and feature_id of unchanged samples are kept')
+    parser.add_argument('--parallel', action='store_true',
+                        help='Parse and rewrite samples in --n_jobs processes, then merge them with the same feature numbering as a serial run')
+    run_report.add_arguments(parser)
+    return parser
+
+""" Functions """
+
+def load_sample(sample, ionization):
+    """ Load the metadata of a sample and, if it is not a blank/QC, its spectra """
+    from matchms.importing import load_from_mgf
+    metadata = pd.read_csv(sample.metadata, sep='\t')
+    if metadata['sample_type'][0] != 'sample':
+        return metadata, None
+    return metadata, list(load_from_mgf(sample.ionization(ionization).mgf))
+
+def renumber_spectrum(spectrum, metadata, ionization, feature_id):
+    """ Link a spectrum to its original feature and give it its aggregated feature_id / scans number """
+    usi = 'mzspec:' + metadata['massive_id'][0] + ':' + metadata.sample_id[0] + '_features_ms2_'+ ionization + '.mgf:scan:' + str(spectrum.metadata['scans'])
+    original_feat_id = 'lcms_feature_' + usi 
+    #original_feat_id = sample_directory + '_feature_' + spectrum.metadata['scans'] + '_' + ionization
+    spectrum.set('original_feature_id', original_feat_id)
+    spectrum.set('feature_id', feature_id)
+    spectrum.set('scans', feature_id)
+    return spectrum
+
+def aggregate(samples, ionization, spec_path, metadata_path, n_jobs):
+    """ Load all samples spectra, then write them at once """
+    from matchms.exporting import save_as_mgf
+    loaded_samples = sample_discovery.load_files(partial(load_sample, ionization=ionization), samples, n_jobs=n_jobs)
+    spectrums = []
+    i = 1
+    treated_samples = []
+    for sample, (metadata, sample_spec) in zip(samples, loaded_samples):
+        if sample_spec is not None:
+            treated_samples.append(sample.sample_id)
+            for spectrum in sample_spec:
+                renumber_spectrum(spectrum, metadata, ionization, i)
+                i += 1
+            spectrums.extend(sample_spec)
+
+    metadata_df = pd.DataFrame(s.metadata for s in spectrums)
+    metadata_df.to_csv(metadata_path, index=False)
+    save_as_mgf(spectrums, spec_path)
+    return treated_samples
+
+def aggregate_streaming(samples, ionization, spec_path, metadata_path):
+    """ Renumber and append spectra to the aggregated .mgf sample by sample
+
+    Metadata rows are spooled to a JSON lines file as spectra are written, then converted to CSV with
+    the union of all metadata keys as columns and the dtypes of pd.DataFrame, by chunks (see write_metadata_csv).
+    """
+    from matchms.importing import load_from_mgf
+    from matchms.exporting import save_as_mgf
+    spool_path = metadata_path + '.jsonl'
+    columns = {}
+    i = 1
+    treated_samples = []
+    with open(spool_path, 'w') as spool:
+        for sample in tqdm(samples):
+            metadata = pd.read_csv(sample.metadata, sep='\t')
+            if metadata['sample_type'][0] != 'sample':
+                continue
+            treated_samples.append(sample.sample_id)
+            sample_spec = []
+            for spectrum in load_from_mgf(sample.ionization(ionization).mgf):
+                renumber_spectrum(spectrum, metadata, ionization, i)
+                i += 1
+                columns.update(dict.fromkeys(spectrum.metadata))
+                spool.write(json.dumps(spectrum.metadata, default=spool_json_default) + '\n')
+                sample_spec.append(spectrum)
+            if len(sample_spec) > 0:
+                save_as_mgf(sample_spec, spec_path)
+
+    write_metadata_csv([spool_path], list(columns), metadata_path)
+    os.remove(spool_path)
+    return treated_samples
+
+def spool_value_kind(value):
+    if (value is None) or (isinstance(value, float) and value != value):
+        return 'missing'
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, (int, float)):
+        return type(value).__name__
+    return 'object'
+
+def spool_dtypes(spool_paths, columns):
+    """ dtypes pandas infers for the columns of the rows of JSON lines spools, as pd.DataFrame(all rows) would
+
+    Integer columns with missing values or float values become float64 (e.g. charge written 1.0), columns
+    mixing other kinds stay object.
+    """
+    kinds = {column: set() for column in columns}
+    for spool_path in spool_paths:
+        with open(spool_path) as spool:
+            for line in spool:
+                row = json.loads(line)
+                if len(row) < len(columns):
+                    for column in columns:
+                        if column not in row:
+                            kinds[column].add('missing')
+                for column, value in row.items():
+                    kinds[column].add(spool_value_kind(value))
+    dtypes = {}
+    for column, column_kinds in kinds.items():
+        values = column_kinds - {'missing'}
+        if (values == {'int'}) and ('missing' not in column_kinds):
+            dtypes[column] = 'int64'
+        elif (len(values) > 0) and (values <= {'int', 'float'}):
+            dtypes[column] = 'float64'
+        elif (values == {'bool'}) and ('missing' not in column_kinds):
+            dtypes[column] = 'bool'
+        else:
+            dtypes[column] = 'object'
+    return dtypes
+
+def spool_json_default(value):
+    """ JSON encoding of the metadata values that are not JSON types: numpy scalars as Python numbers, others as str """
+    return value.item() if isinstance(value, np.generic) else str(value)
+
+def write_metadata_csv(spool_paths, columns, metadata_path, offsets=None, chunksize=10000):
+    """ Convert JSON lines metadata spools to a single CSV, shifting feature_id / scans of each spool by its offset
+
+    Rows are written by chunks of DataFrames cast to the dtypes of the whole table (see spool_dtypes), so that the
+    CSV is the one pd.DataFrame(all rows).to_csv writes in the default mode, with memory bounded by chunksize.
+    """
+    dtypes = spool_dtypes(spool_paths, columns)
+    with open(metadata_path, 'w', newline='') as out:
+        pd.DataFrame(columns=columns).to_csv(out, index=False)
+        for k, spool_path in enumerate(spool_paths):
+            offset = 0 if offsets is None else offsets[k]
+            with open(spool_path) as spool:
+                while True:
+                    rows = [json.loads(line) for line in islice(spool, chunksize)]
+                    if len(rows) == 0:
+                        break
+                    chunk = pd.DataFrame(rows, columns=columns)
+                    if offset > 0:
+                        chunk['feature_id'] += offset
+                        chunk['scans'] += offset
+                    chunk.astype(dtypes).to_csv(out, header=False, index=False)
+
+def write_shard(item, ionization, shard_dir):
+    """ Worker of the parallel mode: write a sample's spectra, numbered from 1, and metadata to shard files
+
+    Returns:
+        (n_spectra, metadata columns) of the sample, None if it is not a 'sample' (blank, QC...)
+    """
+    from matchms.importing import load_from_mgf
+    from matchms.exporting import save_as_mgf
+    index, sample = item
+    metadata = pd.read_csv(sample.metadata, sep='\t')
+    if metadata['sample_type'][0] != 'sample':
+        return None
+    shard_path = os.path.join(shard_dir, f'{index:06d}')
+    columns = {}
+    sample_spec = []
+    with open(shard_path + '.jsonl', 'w') as spool:
+        for spectrum in load_from_mgf(sample.ionization(ionization).mgf):
+            renumber_spectrum(spectrum, metadata, ionization, len(sample_spec) + 1)
+            columns.update(dict.fromkeys(spectrum.metadata))
+            spool.write(json.dumps(spectrum.metadata, default=spool_json_default) + '\n')
+            sample_spec.append(spectrum)
+    if len(sample_spec) > 0:
+        save_as_mgf(sample_spec, shard_path + '.mgf')
+    return len(sample_spec), list(columns)
+
+def shift_mgf_numbering(line, offset):
+    key, sep, value = line.partition('=')
+    if sep and key.upper() in ('FEATURE_ID', 'SCANS'):
+        return f'{key}={int(value) + offset}\n'
+    return line
+
+def aggregate_parallel(samples, ionization, spec_path, metadata_path, n_jobs):
+    """ Write samples to shards in a process pool, then merge them in samples order
+
+    Shards are numbered from 1: the merge shifts feature_id / scans by the number of spectra of the previous
+    samples, so that the output is identical to a serial run.
+    """
+    shard_dir = spec_path + '_shards'
+    if os.path.isdir(shard_dir):
+        shutil.rmtree(shard_dir)
+    os.makedirs(shard_dir)
+    shards = sample_discovery.load_files(partial(write_shard, ionization=ionization, shard_dir=shard_dir),
+                                         list(enumerate(samples)), n_jobs=n_jobs, chunksize=1)
+    treated_samples = []
+    spool_paths = []
+    offsets = []
+    columns = {}
+    offset = 0
+    with open(spec_path, 'w') as out:
+        for index, (sample, shard) in enumerate(tqdm(zip(samples, shards), total=len(samples))):
+            if shard is None:
+                continue
+            n_spectra, shard_columns = shard
+            treated_samples.append(sample.sample_id)
+            shard_path = os.path.join(shard_dir, f'{index:06d}')
+            if n_spectra > 0:
+                with open(shard_path + '.mgf') as shard_mgf:
+                    for line in shard_mgf:
+                        out.write(shift_mgf_numbering(line, offset))
+            spool_paths.append(shard_path + '.jsonl')
+            offsets.append(offset)
+            columns.update(dict.fromkeys(shard_columns))
+            offset += n_spectra
+    write_metadata_csv(spool_paths, list(columns), metadata_path, offsets)
+    shutil.rmtree(shard_dir)
+    return treated_samples
+
+def file_sha256(file_path):
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def filter_mgf(spec_path, retired_ids):
+    """ Rewrite an .mgf without the spectra whose feature_id is in retired_ids, one spectrum at a time """
+    tmp_path = spec_path + '.tmp'
+    with open(spec_path) as mgf, open(tmp_path, 'w') as out:
+        block = []
+        keep = True
+        for line in mgf:
+            block.append(line)
+            key, sep, value = line.partition('=')
+            if sep and key.upper() == 'FEATURE_ID':
+                keep = int(value) not in retired_ids
+            if line.strip() == 'END IONS':
+                if keep:
+                    out.writelines(block)
+                block = []
+                keep = True
+        out.writelines(block)
+    os.replace(tmp_path, spec_path)
+
+def update_metadata_csv(metadata_path, retired_ids, spool_path, spool_columns):
+    """ Drop the rows of retired_ids from the metadata CSV and append the spooled rows
+
+    The CSV is only rewritten if rows are retired or if new spectra bring new metadata columns, otherwise rows are appended.
+    """
+    header = []
+    if os.path.isfile(metadata_path):
+        with open(metadata_path, newline='') as f:
+            header = next(csv.reader(f), [])
+    columns = header + [column for column in spool_columns if column not in header]
+    rewrite = (len(header) == 0) or (len(retired_ids) > 0) or (columns != header)
+    out_path = metadata_path + '.tmp' if rewrite else metadata_path
+    with open(out_path, 'w' if rewrite else 'a', newline='') as out:
+        writer = csv.DictWriter(out, fieldnames=columns, restval='', lineterminator='\n')
+        if rewrite:
+            writer.writeheader()
+            if len(header) > 0:
+                with open(metadata_path, newline='') as f:
+                    for row in csv.DictReader(f):
+                        if int(row['feature_id']) not in retired_ids:
+                            writer.writerow(row)
+        with open(spool_path) as spool:
+            for line in spool:
+                writer.writerow({key: ('' if value is None else value) for key, value in json.loads(line).items()})
+    if rewrite:
+        os.replace(out_path, metadata_path)
+
+def output_sizes(spec_path, metadata_path):
+    return {'mgf_size': os.path.getsize(spec_path), 'metadata_size': os.path.getsize(metadata_path)}
+
+def aggregate_incremental(samples, ionization, spec_path, metadata_path, manifest_path):
+    """ Update an existing aggregate from its manifest
+
+    The manifest stores, for each sample, the sha256 of its .mgf and metadata files and its feature_id range (empty
+    for blanks and QC). Spectra of removed or changed samples are dropped from the aggregate, new and changed samples
+    are appended with feature_id above any previously attributed one: feature_id of unchanged samples never change and
+    are never reused.
+
+    New samples are parsed to pending files first, then the aggregate and its manifest are written. The manifest also
+    records the size of the .mgf and metadata CSV: if they differ (a run was interrupted while writing them), the
+    aggregate is rebuilt from scratch instead of being trusted.
+
+    Returns:
+        treated_samples (list), manifest (dict)
+    """
+    from matchms.importing import load_from_mgf
+    from matchms.exporting import save_as_mgf
+    manifest = {'ionization': ionization, 'next_feature_id': 1, 'samples': {}}
+    if os.path.isfile(manifest_path) and os.path.isfile(spec_path) and os.path.isfile(metadata_path):
+        with open(manifest_path) as f:
+            previous_manifest = json.load(f)
+        if previous_manifest['ionization'] != ionization:
+            raise ValueError(f"{manifest_path} was generated for {previous_manifest['ionization']} spectra")
+        if all(previous_manifest.get(key, size) == size for key, size in output_sizes(spec_path, metadata_path).items()):
+            manifest = previous_manifest
+        else:
+            # feature_id attributed before stay retired
+            print(f'{spec_path} does not match its manifest (interrupted run?): rebuilding the aggregate')
+            manifest['next_feature_id'] = previous_manifest['next_feature_id']
+    if len(manifest['samples']) == 0:
+        # No usable manifest: build the aggregate from scratch
+        for file_path in [spec_path, metadata_path]:
+            if os.path.isfile(file_path):
+                os.remove(file_path)
+    previous = manifest['samples']
+
+    current = {}
+    to_process = []
+    for sample in tqdm(samples, desc='Hashing samples'):
+        hashes = {'mgf_sha256': file_sha256(sample.ionization(ionization).mgf),
+                  'metadata_sha256': file_sha256(sample.metadata)}
+        entry = previous.get(sample.sample_id)
+        if (entry is not None) and all(entry[key] == value for key, value in hashes.items()):
+            current[sample.sample_id] = entry
+        else:
+            to_process.append((sample, hashes))
+    retired = [sample_id for sample_id in previous if sample_id not in current]
+    print(f'{len(current)} unchanged samples, {len(retired)} removed or changed samples, {len(to_process)} samples to process')
+
+    retired_ids = set()
+    for sample_id in retired:
+        retired_ids.update(range(previous[sample_id]['first_feature_id'], previous[sample_id]['last_feature_id'] + 1))
+
+    i = manifest['next_feature_id']
+    spool_path = metadata_path + '.jsonl'
+    pending_path = spec_path + '.pending'
+    if os.path.isfile(pending_path):
+        os.remove(pending_path)
+    columns = {}
+    with open(spool_path, 'w') as spool:
+        for sample, hashes in tqdm(to_process):
+            metadata = pd.read_csv(sample.metadata, sep='\t')
+            first_feature_id = i
+            if metadata['sample_type'][0] == 'sample':
+                sample_spec = []
+                for spectrum in load_from_mgf(sample.ionization(ionization).mgf):
+                    renumber_spectrum(spectrum, metadata, ionization, i)
+                    i += 1
+                    columns.update(dict.fromkeys(spectrum.metadata))
+                    spool.write(json.dumps(spectrum.metadata, default=spool_json_default) + '\n')
+                    sample_spec.append(spectrum)
+                if len(sample_spec) > 0:
+                    save_as_mgf(sample_spec, pending_path)
+            # Blanks and QC are recorded with an empty feature_id range, so that they are not read again
+            current[sample.sample_id] = dict(hashes, sample_type=metadata['sample_type'][0],
+                                             first_feature_id=first_feature_id, last_feature_id=i - 1)
+
+    if len(retired_ids) > 0:
+        filter_mgf(spec_path, retired_ids)
+    if os.path.isfile(pending_path):
+        with open(pending_path) as pending, open(spec_path, 'a') as out:
+            shutil.copyfileobj(pending, out)
+        os.remove(pending_path)
+    elif not os.path.isfile(spec_path):
+        open(spec_path, 'w').close()
+    update_metadata_csv(metadata_path, retired_ids, spool_path, list(columns))
+    os.remove(spool_path)
+
+    manifest['next_feature_id'] = i
+    manifest['samples'] = current
+    manifest.update(output_sizes(spec_path, metadata_path))
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    treated_samples = [sample_id for sample_id, entry in current.items() if entry.get('sample_type', 'sample') == 'sample']
+    return treated_samples, manifest
+
+def run(args):
+    """ Aggregate the spectra of the samples of args, the parsed arguments of build_parser
+
+    Returns:
+        list: sample_id of the aggregated samples
+    """
+    sample_dir_path = os.path.join(BASE_DIR, args.sample_dir_path)
+    ionization = args.ionization
+    output_name = args.output_name
+
+    if ionization not in sample_discovery.IONIZATIONS:
+        raise ValueError('ionization must be pos or neg')
+
+    path = os.path.normpath(sample_dir_path)
+    os.makedirs(path + '/001_aggregated_spectra/' , exist_ok=True)
+    report = run_report.RunReport('mgf_aggregator', os.path.join(BASE_DIR, args.report or os.path.normpath(path + '/001_aggregated_spectra/' + output_name + '_run_report.json')),
+                                  profile=args.profile, args=args)
+
+    with report:
+        with report.stage('discover_samples') as stage:
+            samples = [sample for sample in sample_discovery.discover_samples(path)
+                       if (sample.metadata is not None) & (sample.ionization(ionization).mgf is not None)]
+            stage.items = len(samples)
+
+        metadata_path = os.path.normpath(path + '/001_aggregated_spectra/' + output_name + '_metadata.csv')
+        spec_path = os.path.normpath(path + '/001_aggregated_spectra/' + output_name +'.mgf')
+        param_path = os.path.normpath(path + '/001_aggregated_spectra/' + output_name +'_params.csv')
+        manifest_path = os.path.normpath(path + '/001_aggregated_spectra/' + output_name +'_manifest.json')
+        # Spectra are appended to the .mgf: remove the output of a previous run, and its manifest, whose feature_id
+        # ranges would no longer match the renumbered aggregate
+        if not args.incremental:
+            for file_path in [spec_path, manifest_path]:
+                if os.path.isfile(file_path):
+                    os.remove(file_path)
+
+        with report.stage('aggregate', items=len(samples)):
+            if args.incremental:
+                treated_samples, manifest = aggregate_incremental(samples, ionization, spec_path, metadata_path, manifest_path)
+                params = pd.DataFrame.from_dict({sample_id: manifest['samples'][sample_id] for sample_id in treated_samples},
+                                                orient='index').rename_axis('treated_samples').reset_index()
+                params.to_csv(param_path, index=False)
+            elif args.parallel:
+                treated_samples = aggregate_parallel(samples, ionization, spec_path, metadata_path, args.n_jobs)
+            elif args.streaming:
+                treated_samples = aggregate_streaming(samples, ionization, spec_path, metadata_path)
+            else:
+                treated_samples = aggregate(samples, ionization, spec_path, metadata_path, args.n_jobs)
+        if not args.incremental:
+            pd.DataFrame(treated_samples, columns=['treated_samples']).to_csv(param_path, index=False)
+        print(f'Run report: {report.write()}')
+    return treated_samples
+
+
+def main(argv=None, prog=None):
+    """ Run the script with command-line arguments (sys.argv by default) """
+    return run(build_parser(prog).parse_args(argv))
+
+
+if __name__ == '__main__':
+    main()
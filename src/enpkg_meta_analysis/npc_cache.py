@@ -0,0 +1,189 @@
+import argparse
+import os
+import sqlite3
+import textwrap
+import time
+from pathlib import Path
+
+import pandas as pd
+
+DEFAULT_CACHE_PATH = os.path.join('output_data', 'sql_db', 'npc_cache.db')
+NPC_FIELDS = ['npc_pathway', 'npc_superclass', 'npc_class']
+BUNDLE_COLUMNS = ['short_inchikey', 'smiles'] + NPC_FIELDS + ['source', 'updated_at']
+SOURCES = ('npclassifier', 'isdb')
+
+# SQLite limits the number of host parameters of a statement (999 in older versions)
+CHUNK_SIZE = 900
+
+# An entry replaces the cached one if it is classified and the cached one is not, or if it is as classified and newer.
+# Merging is thus order-independent: importing the bundles of several runs in any order gives the same cache.
+MERGE_STATEMENT = f'''
+    INSERT INTO npc_results ({', '.join(BUNDLE_COLUMNS)}, unknown) VALUES ({', '.join('?' * (len(BUNDLE_COLUMNS) + 1))})
+    ON CONFLICT(short_inchikey) DO UPDATE SET
+        {', '.join(f'{column}=excluded.{column}' for column in BUNDLE_COLUMNS[1:])}, unknown=excluded.unknown
+    WHERE excluded.unknown < npc_results.unknown
+       OR (excluded.unknown = npc_results.unknown AND excluded.updated_at > npc_results.updated_at)'''
+
+
+def is_unknown(metadata):
+    """ True if NPClassifier gave no class at all, e.g. because the request failed """
+    return all((metadata.get(field) is None) or (metadata.get(field) != metadata.get(field)) or (metadata.get(field) == 'unknown')
+               for field in NPC_FIELDS)
+
+
+class NPCCache:
+    """ Persistent cache of NPClassifier results, keyed by short InChIKey, to share between projects
+
+    Each entry records its smiles, its provenance (classified by the NPClassifier API or provided with the ISDB
+    annotations) and when it was classified. Results without any class ('unknown', usually a failed request)
+    expire after ttl_days, so that they are classified again instead of being cached forever.
+
+    Caches filled by parallel runs (e.g. on several cluster nodes) are merged by exporting them as bundles
+    (gzip-compressed CSV) and importing the bundles in a single cache: each structure keeps one row, the
+    classified and most recent one.
+
+    Args:
+        path (str): path to the cache SQLite DB, created if needed
+        ttl_days (float): lifetime of 'unknown' results, in days (None: never expire)
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl_days=30):
+        self.path = path
+        self.ttl_days = ttl_days
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS npc_results (
+                                 short_inchikey TEXT PRIMARY KEY,
+                                 smiles TEXT,
+                                 npc_pathway TEXT,
+                                 npc_superclass TEXT,
+                                 npc_class TEXT,
+                                 source TEXT NOT NULL,
+                                 updated_at REAL NOT NULL,
+                                 unknown INTEGER NOT NULL)''')
+        self.conn.commit()
+
+    def get_many(self, short_inchikeys):
+        """ {short_inchikey: metadata} of the cached results, 'unknown' results older than ttl_days excluded """
+        short_inchikeys = list(short_inchikeys)
+        expiry = 0 if self.ttl_days is None else time.time() - self.ttl_days * 86400
+        results = {}
+        for start in range(0, len(short_inchikeys), CHUNK_SIZE):
+            chunk = short_inchikeys[start:start + CHUNK_SIZE]
+            query = f'''SELECT short_inchikey, smiles, {', '.join(NPC_FIELDS)} FROM npc_results
+                        WHERE short_inchikey IN ({','.join('?' * len(chunk))}) AND (unknown = 0 OR updated_at >= ?)'''
+            for row in self.conn.execute(query, chunk + [expiry]):
+                results[row[0]] = dict(zip(['smiles'] + NPC_FIELDS, row[1:]))
+        return results
+
+    def put_many(self, results, source='npclassifier'):
+        """ Merge {short_inchikey: metadata} results classified now """
+        if source not in SOURCES:
+            raise ValueError(f'source must be one of {SOURCES}')
+        now = time.time()
+        rows = [(sik, metadata.get('smiles')) + tuple(metadata.get(field) for field in NPC_FIELDS) + (source, now, int(is_unknown(metadata)))
+                for sik, metadata in results.items()]
+        with self.conn:
+            self.conn.executemany(MERGE_STATEMENT, rows)
+
+    def seed_unknown(self, results, source='npclassifier'):
+        """ Add {short_inchikey: smiles} 'unknown' results, classified now, that are not in the cache yet; return their number
+
+        Used for the 'unknown' results of runs made before the cache existed: they expire after ttl_days from now
+        instead of being classified again at once. Entries already in the cache are left unchanged.
+        """
+        if source not in SOURCES:
+            raise ValueError(f'source must be one of {SOURCES}')
+        now = time.time()
+        rows = [(sik, smiles) + ('unknown',) * len(NPC_FIELDS) + (source, now, 1) for sik, smiles in results.items()]
+        changes = self.conn.total_changes
+        with self.conn:
+            self.conn.executemany(f'''INSERT OR IGNORE INTO npc_results ({', '.join(BUNDLE_COLUMNS)}, unknown)
+                                      VALUES ({', '.join('?' * (len(BUNDLE_COLUMNS) + 1))})''', rows)
+        return self.conn.total_changes - changes
+
+    def export_bundle(self, path, since=None):
+        """ Write the cache (or the entries updated since the `since` timestamp) to a bundle; return its size """
+        query = f"SELECT {', '.join(BUNDLE_COLUMNS)} FROM npc_results"
+        params = ()
+        if since is not None:
+            query += ' WHERE updated_at >= ?'
+            params = (since,)
+        bundle = pd.read_sql(query, self.conn, params=params)
+        bundle.to_csv(path, index=False, compression='gzip')
+        return len(bundle)
+
+    def import_bundle(self, path, chunksize=100000):
+        """ Merge a bundle in the cache; return the number of entries read and of entries added or updated """
+        n_read = 0
+        changes = self.conn.total_changes
+        for bundle in pd.read_csv(path, compression='gzip', chunksize=chunksize, dtype={'updated_at': float}):
+            bundle = bundle.reindex(columns=BUNDLE_COLUMNS)
+            bundle = bundle[bundle['source'].isin(SOURCES) & bundle['short_inchikey'].notna()]
+            unknown = [int(is_unknown(metadata)) for metadata in bundle[NPC_FIELDS].to_dict(orient='records')]
+            bundle = bundle.astype(object).where(bundle.notna(), None)
+            with self.conn:
+                self.conn.executemany(MERGE_STATEMENT, [row + (flag,) for row, flag in zip(bundle.itertuples(index=False, name=None), unknown)])
+            n_read += len(bundle)
+        return n_read, self.conn.total_changes - changes
+
+    def summary(self):
+        """ Number of entries by source, classified or unknown """
+        return pd.read_sql('SELECT source, unknown, COUNT(*) AS entries FROM npc_results GROUP BY source, unknown', self.conn)
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM npc_results').fetchone()[0]
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main(argv=None, prog=None):
+    """ Manage the NPClassifier results cache from the command line (sys.argv by default) """
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent('''\
+            Manage the NPClassifier results cache shared by chemo_info_fetcher.py runs.
+             --------------------------------
+                export: write the cache to a bundle (gzip-compressed CSV), e.g. at the end of a run on a cluster node
+                import: merge bundles in the cache, without duplicates (classified and most recent results are kept)
+                status: print the cache size by source
+            '''))
+    parser.add_argument('command', choices=['export', 'import', 'status'])
+    parser.add_argument('bundles', nargs='*', help='Bundle(s) to write (export, a single one) or to merge (import)')
+    parser.add_argument('--npc_cache', default=DEFAULT_CACHE_PATH,
+                        help=f'Path to the NPClassifier results cache, default {DEFAULT_CACHE_PATH}')
+    parser.add_argument('--since_days', type=float, default=None,
+                        help='With export, only export the entries updated in the last since_days days')
+    args = parser.parse_args(argv)
+
+    # Bundles are relative to the working directory, the cache to the repository
+    bundles = [os.path.abspath(bundle) for bundle in args.bundles]
+    npc_cache_path = os.path.join(Path(__file__).parents[2], args.npc_cache)
+    os.makedirs(os.path.dirname(npc_cache_path), exist_ok=True)
+    with NPCCache(npc_cache_path) as cache:
+        if args.command == 'export':
+            if len(bundles) != 1:
+                parser.error('export takes a single bundle path')
+            since = None if args.since_days is None else time.time() - args.since_days * 86400
+            print(f'{cache.export_bundle(bundles[0], since=since)} entries exported to {bundles[0]}')
+        elif args.command == 'import':
+            for bundle in bundles:
+                n_read, n_changed = cache.import_bundle(bundle)
+                print(f'{bundle}: {n_read} entries read, {n_changed} added or updated')
+        if args.command in ('import', 'status'):
+            print(f'{len(cache)} entries in {args.npc_cache}')
+            print(cache.summary().to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+from tqdm import tqdm
+
+NPC_API = "https://npclassifier.ucsd.edu/classify?smiles="
+SEPARATOR = "|"
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+def unknown_npc():
+    return {'npc_pathway': 'unknown', 'npc_superclass': 'unknown', 'npc_class': 'unknown'}
+
+
+def parse_npc_response(data):
+    """ Convert a NPClassifier JSON response into the npc_pathway / npc_superclass / npc_class fields """
+    result = {}
+    for field, key in [('npc_pathway', 'pathway_results'), ('npc_superclass', 'superclass_results'), ('npc_class', 'class_results')]:
+        values = data.get(key) or []
+        result[field] = SEPARATOR.join(values) if len(values) > 0 else 'unknown'
+    return result
+
+
+class TokenBucket:
+    """ Thread-safe token bucket: allows on average `rate` acquisitions per second, with bursts up to `capacity` """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity is not None else max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+
+class NPCClient:
+    """ Concurrent NPClassifier client
+
+    Requests are sent from a thread pool sharing one pooled HTTP session. The request rate is limited by a token
+    bucket, failed requests (connection errors, timeouts, 429 and 5xx) are retried with exponential backoff and
+    structures that still fail are classified as 'unknown'.
+
+    Args:
+        npc_api (str): NPClassifier URL, the SMILES is appended to it
+        max_workers (int): number of concurrent requests
+        rate (float): maximal number of requests per second (<= 0 to disable rate limiting)
+        max_retries (int): number of retries of a failed request
+        backoff_factor (float): retry n waits backoff_factor * 2 ** n seconds
+        timeout (float): timeout of a single request, in seconds
+        batch_size (int): number of results handed to the on_batch callback at once
+    """
+
+    def __init__(self, npc_api=NPC_API, max_workers=8, rate=10, max_retries=5, backoff_factor=0.5, timeout=30, batch_size=500):
+        self.npc_api = npc_api
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.bucket = TokenBucket(rate)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def classify(self, smiles):
+        """ Return the NPClassifier taxonomy of a single SMILES """
+        url = self.npc_api + quote(smiles, safe='')
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                response = None
+            if response is not None and response.status_code not in RETRY_STATUS:
+                try:
+                    return parse_npc_response(response.json())
+                except (ValueError, AttributeError):
+                    return unknown_npc()
+            if attempt < self.max_retries:
+                time.sleep(self.backoff_factor * 2 ** attempt)
+        return unknown_npc()
+
+    def _classify_item(self, item):
+        sik, smiles = item
+        result = {'smiles': smiles}
+        result.update(self.classify(smiles))
+        return sik, result
+
+    def classify_many(self, short_ik_smiles, on_batch=None):
+        """ Classify a {short_inchikey: smiles} dict
+
+        At most 2 * max_workers requests are in flight at any time. Every batch_size results, on_batch is called
+        with the {short_inchikey: metadata} dict of the batch, e.g. to persist them.
+
+        Returns:
+            results (dict): {short_inchikey: {'smiles', 'npc_pathway', 'npc_superclass', 'npc_class'}}
+        """
+        results = {}
+        batch = {}
+        items = iter(short_ik_smiles.items())
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor, \
+                tqdm(total=len(short_ik_smiles), leave=False) as progress:
+            pending = set()
+            exhausted = False
+            while pending or not exhausted:
+                while not exhausted and len(pending) < 2 * self.max_workers:
+                    item = next(items, None)
+                    if item is None:
+                        exhausted = True
+                    else:
+                        pending.add(executor.submit(self._classify_item, item))
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    sik, result = future.result()
+                    results[sik] = result
+                    batch[sik] = result
+                    progress.update(1)
+                if on_batch is not None and len(batch) >= self.batch_size:
+                    on_batch(batch)
+                    batch = {}
+        if on_batch is not None and len(batch) > 0:
+            on_batch(batch)
+        return results
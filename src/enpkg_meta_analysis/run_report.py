@@ -0,0 +1,319 @@
+import atexit
+import cProfile
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows: the lifetime peak RSS is then not reported
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    # The peak RSS of the run and of its stages is then not reported
+    psutil = None
+
+PROFILERS = ('cprofile', 'pyinstrument')
+
+
+def add_arguments(parser):
+    """ Add the --report and --profile options shared by the scripts """
+    parser.add_argument('--report', default=None,
+                        help='Path to the JSON run report (stages wall time, peak memory, throughput, HTTP requests and caches), '
+                             'default next to the outputs')
+    parser.add_argument('--profile', choices=PROFILERS, default=None,
+                        help='Profile the run with cProfile (<report>.prof, open it with snakeviz or pstats) '
+                             'or pyinstrument (<report>.html, pyinstrument must be installed)')
+
+
+def lifetime_peak_rss_mb(children=False):
+    """ Peak resident memory of the process since it started (or of its largest terminated child process), in MB
+
+    This includes what ran before the run being reported, e.g. the previous jobs of a batch.
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # ru_maxrss is in bytes on macOS, in kB elsewhere
+    return usage.ru_maxrss / (1024 ** 2 if sys.platform == 'darwin' else 1024)
+
+
+class MemorySampler:
+    """ Peak resident memory of the process and of its live child processes (e.g. workers), sampled every interval
+    seconds from a thread between start and stop, in MB (None without psutil)
+
+    Memory allocated and freed between two samples is missed, so the peaks are lower bounds. Running samplers
+    are paused while the process forks (e.g. a process pool), so that no child inherits a half-done sample.
+    """
+
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self.peak_rss_mb = None
+        self.peak_rss_children_mb = None
+        self.stopped = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.process = psutil.Process() if psutil is not None else None
+
+    def sample(self):
+        with self.lock:
+            try:
+                rss = self.process.memory_info().rss
+            except psutil.Error:
+                return
+            children = 0
+            for child in self.process.children(recursive=True):
+                try:
+                    children += child.memory_info().rss
+                except psutil.Error:
+                    pass
+            self.peak_rss_mb = max(self.peak_rss_mb or 0, rss / 1024 ** 2)
+            self.peak_rss_children_mb = max(self.peak_rss_children_mb or 0, children / 1024 ** 2)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        if self.process is not None:
+            self.sample()
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+            _RUNNING_SAMPLERS.add(self)
+        return self
+
+    def stop(self):
+        if self.thread is not None:
+            _RUNNING_SAMPLERS.discard(self)
+            self.stopped.set()
+            self.thread.join()
+            self.thread = None
+            self.sample()
+        return self
+
+    def peaks(self):
+        """ (peak RSS of the process, peak total RSS of its child processes), in MB, rounded """
+        return tuple(None if peak is None else round(peak, 1) for peak in (self.peak_rss_mb, self.peak_rss_children_mb))
+
+
+# Samplers whose thread is running, and those paused by the current fork
+_RUNNING_SAMPLERS = weakref.WeakSet()
+_PAUSED_SAMPLERS = []
+
+
+def _pause_samplers():
+    """ Before a fork: wait for the running samplers to finish their current sample and keep them from starting another """
+    _PAUSED_SAMPLERS[:] = list(_RUNNING_SAMPLERS)
+    for sampler in _PAUSED_SAMPLERS:
+        sampler.lock.acquire()
+
+
+def _resume_samplers():
+    """ After a fork, in the parent: let the samplers sample again """
+    for sampler in _PAUSED_SAMPLERS:
+        sampler.lock.release()
+    _PAUSED_SAMPLERS.clear()
+
+
+def _forget_samplers():
+    """ After a fork, in the child: the sampler threads were not copied, the samplers are stopped """
+    for sampler in _PAUSED_SAMPLERS:
+        sampler.thread = None
+        sampler.stopped.set()
+    _resume_samplers()
+    _RUNNING_SAMPLERS.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    # Not available on Windows, where child processes are spawned
+    os.register_at_fork(before=_pause_samplers, after_in_parent=_resume_samplers, after_in_child=_forget_samplers)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Stage:
+    """ A stage being measured: set items to the number of items it processed to report its throughput """
+
+    def __init__(self, name, items=None):
+        self.name = name
+        self.items = items
+
+
+class RunReport:
+    """ Measurements of a script run, written as a JSON report
+
+    Stages are measured with `with report.stage(name) as stage:` (wall and CPU time, peak memory sampled during
+    the stage, see MemorySampler, and throughput if stage.items is set). HTTP requests sent through a
+    requests.Session are counted and timed once the session is tracked with track_session; cache hit rates are
+    recorded with cache. Use the report as a context manager around the run: if the run fails (or is interrupted),
+    the report is written when it leaves the context, with status 'failed' (or 'interrupted'). Otherwise, a report
+    that was not written is written at exit, with status 'interrupted'.
+
+    Args:
+        script (str): name of the script
+        path (str): path of the JSON report
+        profile (str): None, 'cprofile' or 'pyinstrument', to profile the whole run
+        args (argparse.Namespace): arguments of the run, recorded in the report
+    """
+
+    def __init__(self, script, path, profile=None, args=None):
+        self.script = script
+        self.path = path
+        self.args = args
+        self.stages = []
+        self.caches = {}
+        self.requests = {}
+        self.lock = threading.Lock()
+        self.started_at = time.strftime('%Y-%m-%dT%H:%M:%S')
+        self.start = time.perf_counter()
+        self.memory = MemorySampler().start()
+        self.written = False
+        self.profile = profile
+        self.profiler = None
+        if profile == 'cprofile':
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        elif profile == 'pyinstrument':
+            try:
+                from pyinstrument import Profiler
+            except ImportError:
+                raise ImportError('Install pyinstrument to use --profile pyinstrument (pip install pyinstrument)')
+            self.profiler = Profiler()
+            self.profiler.start()
+        elif profile is not None:
+            raise ValueError(f'profile must be one of {PROFILERS}')
+        atexit.register(self._write_at_exit)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if not self.written:
+            if exc_type is None:
+                self.write()
+            else:
+                self.write(status='failed' if issubclass(exc_type, Exception) else 'interrupted')
+
+    @contextmanager
+    def stage(self, name, items=None):
+        stage = Stage(name, items)
+        start, cpu_start = time.perf_counter(), time.process_time()
+        memory = MemorySampler().start()
+        try:
+            yield stage
+        finally:
+            wall_time = time.perf_counter() - start
+            peak_rss, peak_rss_children = memory.stop().peaks()
+            self.stages.append({
+                'stage': name,
+                'wall_time_s': round(wall_time, 4),
+                'cpu_time_s': round(time.process_time() - cpu_start, 4),
+                'items': stage.items,
+                'items_per_s': round(stage.items / wall_time, 2) if (stage.items is not None) and (wall_time > 0) else None,
+                'peak_rss_mb': peak_rss,
+                'peak_rss_children_mb': peak_rss_children,
+            })
+
+    def track_session(self, session, service):
+        """ Count and time the requests sent through a requests.Session, under the name of the service """
+        send = session.request
+
+        def request(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                response = send(*args, **kwargs)
+            except Exception:
+                self._record_request(service, time.perf_counter() - start, None)
+                raise
+            self._record_request(service, time.perf_counter() - start, response.status_code)
+            return response
+
+        session.request = request
+        return session
+
+    def _record_request(self, service, seconds, status):
+        with self.lock:
+            self.requests.setdefault(service, []).append((seconds, status))
+
+    def cache(self, name, hits, misses):
+        """ Record the hits and misses of a cache """
+        total = hits + misses
+        self.caches[name] = {'hits': hits, 'misses': misses, 'hit_rate': round(hits / total, 4) if total > 0 else None}
+
+    def http_summary(self):
+        summary = {}
+        for service, requests in self.requests.items():
+            latencies = np.asarray([seconds for seconds, _ in requests])
+            statuses = {}
+            for _, status in requests:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+            summary[service] = {
+                'requests': len(requests),
+                'errors': sum(1 for _, status in requests if (status is None) or (status >= 400)),
+                'status_counts': statuses,
+                'latency_s': {'mean': round(float(latencies.mean()), 4), 'p50': round(float(np.percentile(latencies, 50)), 4),
+                              'p95': round(float(np.percentile(latencies, 95)), 4), 'max': round(float(latencies.max()), 4)},
+            }
+        return summary
+
+    def profile_path(self):
+        return os.path.splitext(self.path)[0] + ('.prof' if self.profile == 'cprofile' else '.html')
+
+    def write(self, status='completed'):
+        """ Stop the profiler and write the report (and the profile); return the report path """
+        if self.profiler is not None:
+            if self.profile == 'cprofile':
+                self.profiler.disable()
+                self.profiler.dump_stats(self.profile_path())
+            else:
+                self.profiler.stop()
+                with open(self.profile_path(), 'w') as f:
+                    f.write(self.profiler.output_html())
+            self.profiler = None
+        peak_rss, peak_rss_children = self.memory.stop().peaks()
+        report = {
+            'script': self.script,
+            'status': status,
+            'argv': sys.argv[1:],
+            'arguments': None if self.args is None else vars(self.args),
+            'started_at': self.started_at,
+            'wall_time_s': round(time.perf_counter() - self.start, 4),
+            'peak_rss_mb': peak_rss,
+            'peak_rss_children_mb': peak_rss_children,
+            'process_lifetime_peak_rss_mb': lifetime_peak_rss_mb(),
+            'largest_child_lifetime_peak_rss_mb': lifetime_peak_rss_mb(children=True),
+            'stages': self.stages,
+            'http': self.http_summary(),
+            'caches': self.caches,
+            'environment': {'git_commit': git_commit(), 'python': platform.python_version(), 'platform': platform.platform(),
+                            'cpu_count': os.cpu_count()},
+        }
+        if self.profile is not None:
+            report['profile'] = self.profile_path()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, 'w') as f:
+            json.dump(report, f, indent=1, default=str)
+        self.written = True
+        atexit.unregister(self._write_at_exit)
+        return self.path
+
+    def _write_at_exit(self):
+        if not self.written:
+            self.write(status='interrupted')
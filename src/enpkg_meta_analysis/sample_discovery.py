@@ -0,0 +1,106 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from tqdm import tqdm
+
+IONIZATIONS = ('pos', 'neg')
+
+
+@dataclass
+class IonizationFiles:
+    """ Files of a sample for one ionization mode, None when missing """
+    mgf: Optional[str] = None
+    isdb: Optional[str] = None
+    sirius: Optional[str] = None
+
+
+@dataclass
+class SampleFiles:
+    """ Files of a sample folder organized following the ENPKG layout:
+
+        <sample>/<sample>_metadata.tsv
+        <sample>/<pos|neg>/<sample>_features_ms2_<pos|neg>.mgf
+        <sample>/<pos|neg>/isdb/<sample>_isdb_reweighted_flat_<pos|neg>.tsv
+        <sample>/<pos|neg>/<sample>_WORKSPACE_SIRIUS/compound_identifications.tsv
+    """
+    sample_id: str
+    path: str
+    metadata: Optional[str] = None
+    pos: IonizationFiles = field(default_factory=IonizationFiles)
+    neg: IonizationFiles = field(default_factory=IonizationFiles)
+
+    def ionization(self, ionization):
+        if ionization not in IONIZATIONS:
+            raise ValueError('ionization must be pos or neg')
+        return getattr(self, ionization)
+
+
+def _existing(file_path):
+    return file_path if os.path.isfile(file_path) else None
+
+
+def discover_samples(sample_dir_path):
+    """ Scan the samples directory once and return the SampleFiles manifest of every sample folder
+
+    Samples are returned in os.listdir order, as the scripts always did, so that outputs numbering is unchanged.
+    """
+    path = os.path.normpath(sample_dir_path)
+    samples = []
+    for directory in os.listdir(path):
+        sample_path = os.path.join(path, directory)
+        if not os.path.isdir(sample_path):
+            continue
+        sample = SampleFiles(sample_id=directory, path=sample_path,
+                             metadata=_existing(os.path.join(sample_path, directory + '_metadata.tsv')))
+        for ionization in IONIZATIONS:
+            ionization_path = os.path.join(sample_path, ionization)
+            if not os.path.isdir(ionization_path):
+                continue
+            files = sample.ionization(ionization)
+            files.mgf = _existing(os.path.join(ionization_path, directory + '_features_ms2_' + ionization + '.mgf'))
+            files.isdb = _existing(os.path.join(ionization_path, 'isdb', directory + '_isdb_reweighted_flat_' + ionization + '.tsv'))
+            files.sirius = _existing(os.path.join(ionization_path, directory + '_WORKSPACE_SIRIUS', 'compound_identifications.tsv'))
+        samples.append(sample)
+    return samples
+
+
+def select_files(samples, kind, ionizations=IONIZATIONS) -> List[str]:
+    """ Return the existing files of a kind ('mgf', 'isdb', 'sirius' or 'metadata'), in samples then ionizations order """
+    if kind == 'metadata':
+        return [sample.metadata for sample in samples if sample.metadata is not None]
+    files = []
+    for sample in samples:
+        for ionization in ionizations:
+            file_path = getattr(sample.ionization(ionization), kind)
+            if file_path is not None:
+                files.append(file_path)
+    return files
+
+
+def n_workers(n_jobs):
+    """ Number of worker processes for n_jobs (-1: all cores) """
+    if (n_jobs is None) or (n_jobs < 1):
+        return os.cpu_count() or 1
+    return n_jobs
+
+
+def load_files(loader, files, n_jobs=-1, chunksize=8, desc=None, initializer=None, initargs=()):
+    """ Apply loader to every file, in a process pool, and return the results in files order
+
+    Workers are started with the platform's default start method: forked on Linux, so that they start with the
+    modules already imported by the caller, spawned on Windows and macOS. loader, initializer and initargs must
+    therefore be picklable (top-level functions, or partials of them). Files are only loaded in the main process
+    when a single worker is requested. initializer(*initargs) is run once in each worker (or in the main process),
+    e.g. to share large read-only state without pickling it for every file.
+    """
+    workers = min(n_workers(n_jobs), len(files))
+    if workers <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        return [loader(file_path) for file_path in tqdm(files, desc=desc)]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(),
+                             initializer=initializer, initargs=initargs) as executor:
+        return list(tqdm(executor.map(loader, files, chunksize=chunksize), total=len(files), desc=desc))
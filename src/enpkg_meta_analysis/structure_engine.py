@@ -0,0 +1,156 @@
+import os
+import sqlite3
+import sys
+
+import pandas as pd
+
+from . import sample_discovery
+
+DEFAULT_CACHE_PATH = os.path.join('output_data', 'sql_db', 'structures_cache.db')
+KINDS = ('smiles', 'inchi')
+RESULT_COLUMNS = ['smiles', 'inchikey', 'np_score']
+
+# SQLite limits the number of host parameters of a statement (999 in older versions)
+CHUNK_SIZE = 900
+
+# NP-likeness scorer (RDKit contrib) and model, loaded once per process by load_np_model
+_NP_MODEL = None
+
+
+def _import_npscorer():
+    """ The NP_Score module of the RDKit contrib directory, which is not a package """
+    from rdkit.Chem import RDConfig
+    path = os.path.join(RDConfig.RDContribDir, 'NP_Score')
+    if path not in sys.path:
+        sys.path.append(path)
+    import npscorer
+    return npscorer
+
+
+def load_np_model():
+    """ (npscorer module, NP model), loaded at the first call in a process """
+    global _NP_MODEL
+    if _NP_MODEL is None:
+        npscorer = _import_npscorer()
+        _NP_MODEL = npscorer, npscorer.readNPModel()
+    return _NP_MODEL
+
+
+def _init_worker(np_score):
+    from rdkit import RDLogger
+    RDLogger.DisableLog('rdApp.*')
+    if np_score:
+        load_np_model()
+
+
+def process_structure(structure, kind='smiles', np_model=None):
+    """ (smiles, inchikey, np_score) of a SMILES or InChI string, None if RDKit cannot parse it
+
+    smiles is the RDKit canonical (isomeric) SMILES; np_score is None unless np_model (see load_np_model) is given.
+    """
+    from rdkit.Chem import AllChem
+    mol = AllChem.MolFromSmiles(structure) if kind == 'smiles' else AllChem.MolFromInchi(structure)
+    if mol is None:
+        return None
+    np_score = np_model[0].scoreMol(mol, np_model[1]) if np_model is not None else None
+    return AllChem.MolToSmiles(mol), AllChem.MolToInchiKey(mol), np_score
+
+
+def _process_chunk(chunk):
+    kind, np_score, structures = chunk
+    np_model = load_np_model() if np_score else None
+    return [process_structure(structure, kind, np_model) for structure in structures]
+
+
+class StructureCache:
+    """ Persistent cache of processed structures, keyed by (kind, input string)
+
+    Unparsable inputs are cached too (valid = 0), so that they are not parsed again.
+
+    Args:
+        path (str): path to the cache SQLite DB, created if needed
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS structures (
+                                 kind TEXT NOT NULL,
+                                 input TEXT NOT NULL,
+                                 valid INTEGER NOT NULL,
+                                 smiles TEXT,
+                                 inchikey TEXT,
+                                 np_score REAL,
+                                 PRIMARY KEY (kind, input))''')
+        self.conn.commit()
+
+    def get_many(self, structures, kind='smiles'):
+        """ {input: (smiles, inchikey, np_score) or None} of the cached structures """
+        structures = list(structures)
+        results = {}
+        for start in range(0, len(structures), CHUNK_SIZE):
+            chunk = structures[start:start + CHUNK_SIZE]
+            query = f"SELECT input, valid, smiles, inchikey, np_score FROM structures WHERE kind = ? AND input IN ({','.join('?' * len(chunk))})"
+            for structure, valid, smiles, inchikey, np_score in self.conn.execute(query, [kind] + chunk):
+                results[structure] = (smiles, inchikey, np_score) if valid else None
+        return results
+
+    def put_many(self, results, kind='smiles'):
+        """ Store {input: (smiles, inchikey, np_score) or None} """
+        rows = [(kind, structure, 0, None, None, None) if result is None else (kind, structure, 1) + tuple(result)
+                for structure, result in results.items()]
+        self.conn.executemany('INSERT OR REPLACE INTO structures VALUES (?, ?, ?, ?, ?, ?)', rows)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def process_structures(structures, kind='smiles', np_score=False, cache=None, n_jobs=-1, chunk_size=500):
+    """ Canonical SMILES, InChIKey and (optionally) NP-likeness score of SMILES or InChI strings
+
+    Inputs are deduplicated first; those not in the StructureCache (or cached without NP score when
+    np_score is requested) are processed in a process pool, then cached. Chunks have at most chunk_size
+    inputs, and are smaller when needed to give every worker a chunk.
+
+    Returns:
+        pd.DataFrame: indexed by the unique valid inputs, with columns smiles, inchikey, np_score
+    """
+    if kind not in KINDS:
+        raise ValueError(f'kind must be one of {KINDS}')
+    structures = pd.Series(structures, dtype=object).dropna()
+    structures = list(pd.unique(structures[structures.str.strip() != '']))
+    results = {}
+    if cache is not None:
+        results = cache.get_many(structures, kind)
+        if np_score:
+            results = {structure: result for structure, result in results.items() if (result is None) or (result[2] is not None)}
+        cache.hits += len(results)
+    missing = [structure for structure in structures if structure not in results]
+    if cache is not None:
+        cache.misses += len(missing)
+    chunk_size = max(1, min(chunk_size, -(-len(missing) // sample_discovery.n_workers(n_jobs))))
+    chunks = [(kind, np_score, missing[start:start + chunk_size]) for start in range(0, len(missing), chunk_size)]
+    processed = []
+    if len(chunks) > 0:
+        processed = sample_discovery.load_files(_process_chunk, chunks, n_jobs=n_jobs, chunksize=1, desc='Processing structures',
+                                                initializer=_init_worker, initargs=(np_score,))
+    computed = {}
+    for (_, _, chunk), chunk_results in zip(chunks, processed):
+        computed.update(zip(chunk, chunk_results))
+    if cache is not None:
+        cache.put_many(computed, kind)
+    results.update(computed)
+    valid = {structure: result for structure, result in results.items() if result is not None}
+    return pd.DataFrame.from_dict(valid, orient='index', columns=RESULT_COLUMNS)
@@ -0,0 +1,153 @@
+import sqlite3
+
+import pandas as pd
+
+STRUCTURES_COLUMNS = ['wikidata_id', 'inchikey', 'isomeric_smiles', 'short_inchikey', 'smiles',
+                      'npc_pathway', 'npc_superclass', 'npc_class']
+CHECKPOINT_COLUMNS = ['short_inchikey', 'smiles', 'npc_pathway', 'npc_superclass', 'npc_class']
+
+# A short InChIKey can match several stereoisomers in Wikidata: one row per (short_inchikey, inchikey).
+# short_inchikey being the leading column of the primary key, lookups by short InChIKey use its index.
+SCHEMA = {
+    'structures_metadata': '''
+        CREATE TABLE IF NOT EXISTS structures_metadata (
+            wikidata_id TEXT,
+            inchikey TEXT NOT NULL,
+            isomeric_smiles TEXT,
+            short_inchikey TEXT NOT NULL,
+            smiles TEXT,
+            npc_pathway TEXT,
+            npc_superclass TEXT,
+            npc_class TEXT,
+            PRIMARY KEY (short_inchikey, inchikey)
+        )''',
+    'npc_checkpoint': '''
+        CREATE TABLE IF NOT EXISTS npc_checkpoint (
+            short_inchikey TEXT PRIMARY KEY,
+            smiles TEXT,
+            npc_pathway TEXT,
+            npc_superclass TEXT,
+            npc_class TEXT
+        )''',
+}
+KEYS = {
+    'structures_metadata': ['short_inchikey', 'inchikey'],
+    'npc_checkpoint': ['short_inchikey'],
+}
+COLUMNS = {
+    'structures_metadata': STRUCTURES_COLUMNS,
+    'npc_checkpoint': CHECKPOINT_COLUMNS,
+}
+
+# SQLite limits the number of host parameters of a statement (999 in older versions)
+CHUNK_SIZE = 900
+
+
+def connect(sql_path):
+    """ Open the structures metadata SQL DB in WAL mode, creating or migrating its tables if needed """
+    conn = sqlite3.connect(sql_path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    for table in SCHEMA:
+        migrate_legacy_table(conn, table)
+        conn.execute(SCHEMA[table])
+    conn.commit()
+    return conn
+
+
+def table_exists(conn, table):
+    query = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table,))
+    return query.fetchone() is not None
+
+
+def migrate_legacy_table(conn, table):
+    """ Rebuild a table created by pandas.to_sql (no primary key, possible duplicates) with the indexed schema
+
+    Duplicated keys keep their last inserted row, as the latest run is the most up to date.
+    """
+    if not table_exists(conn, table):
+        return
+    info = conn.execute(f'PRAGMA table_info({table})').fetchall()
+    if any(column[5] > 0 for column in info):
+        return
+    legacy_columns = [column[1] for column in info]
+    columns = [column for column in COLUMNS[table] if column in legacy_columns]
+    n_rows = conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+    print(f'Migrating legacy table {table} ({n_rows} rows)')
+    legacy = f'{table}_legacy'
+    conn.execute(f'ALTER TABLE {table} RENAME TO {legacy}')
+    conn.execute(SCHEMA[table])
+    selected = ', '.join(columns)
+    if 'inchikey' in KEYS[table] and 'inchikey' not in columns:
+        columns.append('inchikey')
+        selected += ", 'no_wikidata_match'"
+    conn.execute(f'''INSERT OR REPLACE INTO {table} ({', '.join(columns)})
+                     SELECT {selected} FROM {legacy}
+                     WHERE {' AND '.join(f'{key} IS NOT NULL' for key in KEYS[table] if key in legacy_columns)}
+                     ORDER BY rowid''')
+    conn.execute(f'DROP TABLE {legacy}')
+    conn.commit()
+
+
+def upsert(conn, table, dataframe):
+    """ Insert or update the rows of dataframe in table with a single executemany """
+    columns = COLUMNS[table]
+    keys = KEYS[table]
+    updates = ', '.join(f'{column}=excluded.{column}' for column in columns if column not in keys)
+    statement = f'''INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})
+                    ON CONFLICT({', '.join(keys)}) DO UPDATE SET {updates}'''
+    rows = dataframe.reindex(columns=columns)
+    rows = rows.astype(object).where(rows.notna(), None)
+    with conn:
+        conn.executemany(statement, rows.itertuples(index=False, name=None))
+
+
+def upsert_structures(conn, dataframe):
+    upsert(conn, 'structures_metadata', dataframe)
+
+
+def known_short_inchikeys(conn, candidates, table='structures_metadata'):
+    """ Return the subset of candidates short InChIKeys already in table, querying them by chunks """
+    candidates = list(set(candidates))
+    known = set()
+    for i in range(0, len(candidates), CHUNK_SIZE):
+        chunk = candidates[i:i + CHUNK_SIZE]
+        query = conn.execute(f'''SELECT DISTINCT short_inchikey FROM {table}
+                                 WHERE short_inchikey IN ({', '.join('?' * len(chunk))})''', chunk)
+        known.update(row[0] for row in query)
+    return known
+
+
+def unknown_short_inchikeys(conn, candidates):
+    """ Return the subset of candidates short InChIKeys in DB without any NPClassifier class """
+    candidates = list(set(candidates))
+    unknown = set()
+    for i in range(0, len(candidates), CHUNK_SIZE):
+        chunk = candidates[i:i + CHUNK_SIZE]
+        query = conn.execute(f'''SELECT DISTINCT short_inchikey FROM structures_metadata
+                                 WHERE short_inchikey IN ({', '.join('?' * len(chunk))})
+                                 AND npc_pathway = 'unknown' AND npc_superclass = 'unknown' AND npc_class = 'unknown'
+                                 ''', chunk)
+        unknown.update(row[0] for row in query)
+    return unknown
+
+
+def count_short_inchikeys(conn):
+    return conn.execute('SELECT COUNT(DISTINCT short_inchikey) FROM structures_metadata').fetchone()[0]
+
+
+def save_npc_checkpoint(conn, batch):
+    """ Store a {short_inchikey: metadata} batch of NPClassifier results """
+    df = pd.DataFrame.from_dict(batch, orient='index').reset_index().rename(columns={'index': 'short_inchikey'})
+    upsert(conn, 'npc_checkpoint', df)
+
+
+def load_npc_checkpoint(conn):
+    """ Load NPClassifier results checkpointed by a previous, interrupted run """
+    df = pd.read_sql('SELECT * FROM npc_checkpoint', conn)
+    return df.set_index('short_inchikey').to_dict(orient='index')
+
+
+def clear_npc_checkpoint(conn):
+    with conn:
+        conn.execute('DELETE FROM npc_checkpoint')
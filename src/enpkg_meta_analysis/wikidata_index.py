@@ -0,0 +1,175 @@
+import argparse
+import csv
+import os
+import sqlite3
+import textwrap
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pandas as pd
+import requests
+from tqdm import tqdm
+
+WD_URL = 'https://query.wikidata.org/sparql'
+DEFAULT_INDEX_PATH = os.path.join('output_data', 'wikidata', 'inchikey_index.db')
+QUERY = '''
+PREFIX wdt: <http://www.wikidata.org/prop/direct/>
+SELECT ?ik ?wd ?isomeric_smiles
+WHERE{
+    ?wd wdt:P235 ?ik .
+    optional { ?wd wdt:P2017 ?isomeric_smiles }
+}
+  '''
+COLUMNS = ['wikidata_id', 'inchikey', 'isomeric_smiles', 'short_inchikey']
+CHUNK_SIZE = 900
+
+
+def stream_wikidata_inchikeys(url=WD_URL, timeout=600, session=None):
+    """ Yield (wikidata_id, inchikey, isomeric_smiles) rows of the Wikidata P235 dump, parsed line by line as they are received
+
+    The request is sent through session (e.g. a requests.Session tracked by a RunReport) if given.
+    """
+    with (session or requests).get(url, params={'query': QUERY}, headers={'Accept': 'text/csv'}, stream=True, timeout=timeout) as r:
+        r.raise_for_status()
+        r.encoding = 'utf-8'
+        reader = csv.reader(r.iter_lines(decode_unicode=True))
+        header = next(reader)
+        ik, wd, smiles = header.index('ik'), header.index('wd'), header.index('isomeric_smiles')
+        for row in reader:
+            if len(row) != len(header):
+                continue
+            yield row[wd], row[ik], row[smiles] or None
+
+
+def refresh_index(index_path=DEFAULT_INDEX_PATH, url=WD_URL, batch_size=50000, session=None):
+    """ (Re)build the on-disk InChIKey index from the Wikidata SPARQL endpoint
+
+    The index is written to a temporary file and only replaces the existing one once complete,
+    so that an interrupted refresh leaves the previous index usable.
+    """
+    Path(index_path).parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = index_path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    conn.execute('PRAGMA journal_mode=OFF')
+    conn.execute('PRAGMA synchronous=OFF')
+    conn.execute('''CREATE TABLE wikidata_inchikeys (
+                        wikidata_id TEXT, inchikey TEXT, isomeric_smiles TEXT, short_inchikey TEXT)''')
+    conn.execute('CREATE TABLE metadata (key TEXT PRIMARY KEY, value TEXT)')
+    start = time.time()
+    n_rows = 0
+    batch = []
+    for wikidata_id, inchikey, isomeric_smiles in tqdm(stream_wikidata_inchikeys(url, session=session), unit=' InChIKeys'):
+        batch.append((wikidata_id, inchikey, isomeric_smiles, inchikey[:14]))
+        if len(batch) >= batch_size:
+            conn.executemany('INSERT INTO wikidata_inchikeys VALUES (?, ?, ?, ?)', batch)
+            n_rows += len(batch)
+            batch = []
+    conn.executemany('INSERT INTO wikidata_inchikeys VALUES (?, ?, ?, ?)', batch)
+    n_rows += len(batch)
+    conn.execute('CREATE INDEX idx_inchikey ON wikidata_inchikeys (inchikey)')
+    conn.execute('CREATE INDEX idx_short_inchikey ON wikidata_inchikeys (short_inchikey)')
+    metadata = {
+        'refreshed_at': datetime.now(timezone.utc).isoformat(),
+        'source': url,
+        'n_rows': str(n_rows),
+        'refresh_seconds': f'{time.time() - start:.1f}',
+    }
+    conn.executemany('INSERT INTO metadata VALUES (?, ?)', metadata.items())
+    conn.commit()
+    conn.close()
+    os.replace(tmp_path, index_path)
+    print(f'Wikidata InChIKey index refreshed: {n_rows} rows in {index_path}')
+    return metadata
+
+
+def index_metadata(index_path=DEFAULT_INDEX_PATH):
+    """ Return the freshness metadata of the index, None if it was never built """
+    if not os.path.exists(index_path):
+        return None
+    conn = sqlite3.connect(index_path)
+    try:
+        return dict(conn.execute('SELECT key, value FROM metadata').fetchall())
+    finally:
+        conn.close()
+
+
+def index_age_days(index_path=DEFAULT_INDEX_PATH):
+    metadata = index_metadata(index_path)
+    if metadata is None:
+        return None
+    refreshed_at = datetime.fromisoformat(metadata['refreshed_at'])
+    return (datetime.now(timezone.utc) - refreshed_at).total_seconds() / 86400
+
+
+def ensure_index(index_path=DEFAULT_INDEX_PATH, url=WD_URL, max_age_days=None, session=None):
+    """ Build the index if it does not exist, or refresh it if it is older than max_age_days """
+    age = index_age_days(index_path)
+    if age is None:
+        print(f'No Wikidata InChIKey index found at {index_path}: building it')
+        refresh_index(index_path, url, session=session)
+    elif (max_age_days is not None) and (age > max_age_days):
+        print(f'Wikidata InChIKey index is {age:.1f} days old: refreshing it')
+        refresh_index(index_path, url, session=session)
+
+
+def lookup(index_path=DEFAULT_INDEX_PATH, inchikeys=None, short_inchikeys=None):
+    """ Return the Wikidata matches (wikidata_id, inchikey, isomeric_smiles, short_inchikey) of full and/or short InChIKeys """
+    conn = sqlite3.connect(f'file:{index_path}?mode=ro', uri=True)
+    results = []
+    try:
+        for column, keys in [('inchikey', inchikeys), ('short_inchikey', short_inchikeys)]:
+            if keys is None:
+                continue
+            keys = list(set(keys))
+            for i in range(0, len(keys), CHUNK_SIZE):
+                chunk = keys[i:i + CHUNK_SIZE]
+                query = conn.execute(f'''SELECT {', '.join(COLUMNS)} FROM wikidata_inchikeys
+                                         WHERE {column} IN ({', '.join('?' * len(chunk))})''', chunk)
+                results.extend(query.fetchall())
+    finally:
+        conn.close()
+    return pd.DataFrame.from_records(results, columns=COLUMNS).drop_duplicates()
+
+
+def main(argv=None, prog=None):
+    """ Manage the Wikidata InChIKey index from the command line (sys.argv by default) """
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent('''\
+            Manage the local Wikidata InChIKey index shared by chemo_info_fetcher.py and download_chembl.py.
+             --------------------------------
+                refresh: download the Wikidata InChIKeys (P235) and rebuild the index
+                status: print the index freshness metadata
+            '''))
+    parser.add_argument('command', choices=['refresh', 'status'])
+    parser.add_argument('--index_path', default=DEFAULT_INDEX_PATH,
+                        help=f'Path of the index, default {DEFAULT_INDEX_PATH} (relative to the repository)')
+    parser.add_argument('--max_age_days', type=float, default=None,
+                        help='With refresh, only rebuild the index if it is older than this number of days')
+    parser.add_argument('--wd_url', default=WD_URL,
+                        help=f'With refresh, Wikidata SPARQL endpoint the index is built from, default {WD_URL}')
+    args = parser.parse_args(argv)
+
+    # The index is relative to the repository
+    index_path = os.path.join(Path(__file__).parents[2], args.index_path)
+    if args.command == 'refresh':
+        if args.max_age_days is None:
+            refresh_index(index_path, url=args.wd_url)
+        else:
+            ensure_index(index_path, url=args.wd_url, max_age_days=args.max_age_days)
+    else:
+        metadata = index_metadata(index_path)
+        if metadata is None:
+            print(f'No index at {index_path}')
+        else:
+            for key, value in metadata.items():
+                print(f'{key}: {value}')
+            print(f'age_days: {index_age_days(index_path):.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,11 @@
+import numpy as np
+import pytest
+
+# Synthetic data and mock services come from benchmarks/ (see pythonpath in pyproject.toml)
+from synthetic import random_structures
+
+
+@pytest.fixture
+def structures():
+    """ 200 synthetic (short_inchikey, smiles) pairs """
+    return random_structures(200, np.random.default_rng(0))
@@ -0,0 +1,105 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from enpkg_meta_analysis.chembl_client import ChEMBLActivityDownloader, ChEMBLRelease
+from mock_services import MockServices
+
+TARGET_ID = 'CHEMBL0000'
+
+
+@pytest.fixture
+def services(structures):
+    with MockServices(structures, n_activities=1200) as services:
+        yield services
+
+
+@pytest.fixture
+def chembl_db(services, tmp_path):
+    """ Tiny ChEMBL release with the activities served by the ChEMBL stand-in (for TARGET_ID), and an other target """
+    path = str(tmp_path / 'chembl_00.db')
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        CREATE TABLE version (name TEXT);
+        CREATE TABLE target_dictionary (tid INTEGER PRIMARY KEY, chembl_id TEXT, pref_name TEXT);
+        CREATE TABLE assays (assay_id INTEGER PRIMARY KEY, tid INTEGER, chembl_id TEXT);
+        CREATE TABLE docs (doc_id INTEGER PRIMARY KEY, journal TEXT, chembl_id TEXT);
+        CREATE TABLE molecule_dictionary (molregno INTEGER PRIMARY KEY, chembl_id TEXT);
+        CREATE TABLE compound_structures (molregno INTEGER PRIMARY KEY, canonical_smiles TEXT);
+        CREATE TABLE activities (activity_id INTEGER PRIMARY KEY, assay_id INTEGER, doc_id INTEGER, molregno INTEGER,
+                                 standard_relation TEXT, standard_value NUMERIC, standard_units TEXT, standard_type TEXT,
+                                 data_validity_comment TEXT, activity_comment TEXT);
+        CREATE INDEX idx_assays_tid ON assays (tid);
+        CREATE INDEX idx_act_assay_id ON activities (assay_id);
+        INSERT INTO version VALUES ('ChEMBL_00');
+        INSERT INTO target_dictionary VALUES (1, 'CHEMBL0000', 'Synthetic target'), (2, 'CHEMBL0001', 'Other target');
+    ''')
+    assays, docs, molecules = {}, {}, {}
+    for activity_id, activity in enumerate(services.activities + services.activities[:100]):
+        tid = 1 if activity_id < len(services.activities) else 2
+        assay_id = assays.setdefault((tid, activity['assay_chembl_id']), len(assays) + 1)
+        conn.execute('INSERT OR IGNORE INTO assays VALUES (?, ?, ?)', (assay_id, tid, activity['assay_chembl_id']))
+        doc_id = docs.setdefault((activity['document_chembl_id'], activity['document_journal']), len(docs) + 1)
+        conn.execute('INSERT OR IGNORE INTO docs VALUES (?, ?, ?)', (doc_id, activity['document_journal'], activity['document_chembl_id']))
+        molregno = molecules.setdefault(activity['molecule_chembl_id'], len(molecules) + 1)
+        conn.execute('INSERT OR IGNORE INTO molecule_dictionary VALUES (?, ?)', (molregno, activity['molecule_chembl_id']))
+        conn.execute('INSERT OR IGNORE INTO compound_structures VALUES (?, ?)', (molregno, activity['canonical_smiles']))
+        conn.execute('INSERT INTO activities VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                     (activity_id, assay_id, doc_id, molregno, activity['standard_relation'], float(activity['standard_value']),
+                      activity['standard_units'], activity['standard_type'], activity['data_validity_comment'], activity['activity_comment']))
+    conn.commit()
+    conn.close()
+    return path
+
+
+def pages(downloader):
+    pages = dict(downloader.iter_pages(TARGET_ID))
+    return pd.concat([pages[offset] for offset in sorted(pages)], ignore_index=True)
+
+
+def test_release_pages_match_api_pages(services, chembl_db, tmp_path):
+    with ChEMBLActivityDownloader(str(tmp_path / 'pages'), chembl_api=services.chembl_url, rate=0) as downloader:
+        api = pages(downloader)
+    with ChEMBLRelease(chembl_db) as release:
+        assert release.version() == 'ChEMBL_00'
+        offsets = [offset for offset, _ in release.iter_pages(TARGET_ID)]
+        local = pages(release)
+    assert offsets == [0, 1000]
+    assert list(local.columns) == list(api.columns)
+    assert len(local) == len(api) == 1200
+    api['standard_value'] = api['standard_value'].astype(float)
+    pd.testing.assert_frame_equal(local, api)
+
+
+def test_release_activities_are_cleaned_as_api_activities(services, chembl_db, tmp_path):
+    pytest.importorskip('rdkit')
+    from enpkg_meta_analysis import download_chembl
+    with ChEMBLActivityDownloader(str(tmp_path / 'pages'), chembl_api=services.chembl_url, rate=0) as downloader:
+        api = download_chembl.clean_DB(download_chembl.download_target(TARGET_ID, downloader), -1, n_jobs=1)
+    with ChEMBLRelease(chembl_db) as release:
+        local = download_chembl.clean_DB(download_chembl.download_target(TARGET_ID, release), -1, n_jobs=1)
+    assert not pd.api.types.is_numeric_dtype(api['standard_value']) and local['standard_value'].dtype == 'float64'
+    assert len(api) > 0
+    pd.testing.assert_frame_equal(local, api.astype({'standard_value': float}))
+
+
+def test_api_activity_values_are_written_unchanged():
+    pytest.importorskip('rdkit')
+    from enpkg_meta_analysis import download_chembl
+    activities = pd.DataFrame({'canonical_smiles': ['CCO', 'CCN', 'CCC'], 'standard_value': ['10', 'not a number', None],
+                               'data_validity_comment': [None, None, None], 'document_journal': ['J Nat Prod'] * 3})
+    cleaned = download_chembl.clean_DB(activities, 0, n_jobs=1)
+    assert list(cleaned['standard_value']) == ['10', 'not a number']
+
+
+def test_chembl_db_is_relative_to_the_working_directory(services, chembl_db, tmp_path, monkeypatch):
+    pytest.importorskip('rdkit')
+    from enpkg_meta_analysis import download_chembl
+    monkeypatch.setattr(download_chembl, 'REPO_ROOT', tmp_path / 'repo')
+    monkeypatch.chdir(tmp_path)
+    results = download_chembl.main(['--target_id', 'CHEMBL0001', '--chembl_db', 'chembl_00.db', '--n_jobs', '1',
+                                    '--wd_url', services.wd_url, '--wd_index', str(tmp_path / 'wd.db'),
+                                    '--structure_cache', str(tmp_path / 'structures.db')])
+    assert len(results['CHEMBL0001']) > 0
+    assert (results['CHEMBL0001']['target_pref_name'] == 'Other target').all()
@@ -0,0 +1,18 @@
+import pytest
+
+from enpkg_meta_analysis.chemo_info_fetcher import gnps_annotations_file
+
+
+def test_gnps_annotations_file_is_the_single_tsv(tmp_path):
+    result_dir = tmp_path / 'result_specnets_DB'
+    with pytest.raises(FileNotFoundError, match='No GNPS results'):
+        gnps_annotations_file(str(tmp_path))
+    result_dir.mkdir()
+    (result_dir / 'annotations.tsv.tmp').write_text('partial')
+    with pytest.raises(FileNotFoundError, match='No .tsv'):
+        gnps_annotations_file(str(tmp_path))
+    (result_dir / 'annotations.tsv').write_text('Smiles\tINCHI\n')
+    assert gnps_annotations_file(str(tmp_path)) == str(result_dir / 'annotations.tsv')
+    (result_dir / 'other.tsv').write_text('Smiles\tINCHI\n')
+    with pytest.raises(ValueError, match='Several .tsv files'):
+        gnps_annotations_file(str(tmp_path))
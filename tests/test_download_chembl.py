@@ -0,0 +1,96 @@
+import os
+
+import pandas as pd
+import pytest
+
+from enpkg_meta_analysis.chembl_client import ChEMBLActivityDownloader
+from mock_services import MockServices
+
+TARGET_ID = 'CHEMBL0000'
+PAGE_SIZE = 100
+
+
+def download(services, checkpoint_dir, refresh=False):
+    with ChEMBLActivityDownloader(str(checkpoint_dir), chembl_api=services.chembl_url, rate=0, page_size=PAGE_SIZE,
+                                  backoff_factor=0.01) as downloader:
+        pages = dict(downloader.iter_pages(TARGET_ID, refresh=refresh))
+    return pd.concat([pages[offset] for offset in sorted(pages)], ignore_index=True)
+
+
+def test_interrupted_download_resumes_missing_pages(structures, tmp_path):
+    with MockServices(structures, n_activities=1000) as services:
+        expected = download(services, tmp_path / 'reference')
+        # With one worker, at most 2 pages are in flight when the download is interrupted
+        with ChEMBLActivityDownloader(str(tmp_path / 'pages'), chembl_api=services.chembl_url, max_workers=1, rate=0,
+                                      page_size=PAGE_SIZE) as downloader:
+            pages = downloader.iter_pages(TARGET_ID)
+            for _ in range(3):
+                next(pages)
+            pages.close()
+        target_dir = tmp_path / 'pages' / TARGET_ID
+        saved = sorted(name for name in os.listdir(target_dir) if name.startswith('page_'))
+        assert 3 <= len(saved) <= 5
+        # A page interrupted while being written is never resumed
+        (target_dir / 'page_000000900.json.tmp').write_text('[{"canonical_smiles"')
+        services.counts.clear()
+        resumed = download(services, tmp_path / 'pages')
+    assert services.counts['chembl'] == 10 - len(saved)
+    pd.testing.assert_frame_equal(resumed, expected)
+
+
+def test_refresh_pages_downloads_all_pages_again(structures, tmp_path):
+    with MockServices(structures, n_activities=1000) as services:
+        download(services, tmp_path)
+        services.counts.clear()
+        download(services, tmp_path)
+        assert services.counts.get('chembl', 0) == 0
+        os.remove(tmp_path / TARGET_ID / 'page_000000300.json')
+        download(services, tmp_path)
+        assert services.counts['chembl'] == 1
+        services.counts.clear()
+        refreshed = download(services, tmp_path, refresh=True)
+    assert services.counts['chembl'] == 10
+    assert len(refreshed) == 1000
+
+
+def test_download_chembl_resumes_and_refreshes(structures, tmp_path, monkeypatch):
+    pytest.importorskip('rdkit')
+    from enpkg_meta_analysis import download_chembl
+    monkeypatch.setattr(download_chembl, 'REPO_ROOT', tmp_path)
+    with MockServices(structures, n_activities=2500) as services:
+        argv = ['--target_id', TARGET_ID, '--chembl_url', services.chembl_url, '--chembl_rate', '0', '--n_jobs', '2',
+                '--wd_url', services.wd_url, '--wd_index', str(tmp_path / 'wd.db'), '--structure_cache', str(tmp_path / 'structures.db')]
+        expected = download_chembl.main(argv)[TARGET_ID]
+        os.remove(tmp_path / 'output_data' / 'chembl' / 'pages' / TARGET_ID / 'page_000001000.json')
+        services.counts.clear()
+        resumed = download_chembl.main(argv)[TARGET_ID]
+        assert services.counts['chembl'] == 1
+        services.counts.clear()
+        refreshed = download_chembl.main(argv + ['--refresh_pages'])[TARGET_ID]
+        assert services.counts['chembl'] == 3
+    pd.testing.assert_frame_equal(resumed, expected)
+    pd.testing.assert_frame_equal(refreshed, expected)
+    assert len(expected) > 0
+
+
+def test_structures_of_all_targets_are_processed_at_once(structures, tmp_path, monkeypatch):
+    pytest.importorskip('rdkit')
+    from enpkg_meta_analysis import download_chembl
+    from enpkg_meta_analysis import structure_engine
+    monkeypatch.setattr(download_chembl, 'REPO_ROOT', tmp_path)
+    calls = []
+    process_structures = structure_engine.process_structures
+
+    def counted(structures, **kwargs):
+        calls.append(len(structures))
+        return process_structures(structures, **kwargs)
+
+    monkeypatch.setattr(structure_engine, 'process_structures', counted)
+    with MockServices(structures, n_activities=1500) as services:
+        results = download_chembl.main(['--target_id', TARGET_ID, 'CHEMBL0001', '--chembl_url', services.chembl_url, '--chembl_rate', '0',
+                                        '--n_jobs', '2', '--wd_url', services.wd_url, '--wd_index', str(tmp_path / 'wd.db'),
+                                        '--structure_cache', str(tmp_path / 'structures.db')])
+    assert len(calls) == 1
+    assert set(results) == {TARGET_ID, 'CHEMBL0001'}
+    assert len(results[TARGET_ID]) == len(results['CHEMBL0001']) > 0
+    assert (tmp_path / 'output_data' / 'chembl' / 'combined_np_like_min_-1.csv').exists()
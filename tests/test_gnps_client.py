@@ -0,0 +1,72 @@
+import json
+import os
+
+import pytest
+
+from enpkg_meta_analysis.gnps_client import GNPSJobDownloader, MANIFEST_NAME
+from mock_services import MockServices
+
+JOB_ID = '0123456789abcdef0123456789abcdef'
+MEMBER = f'result_specnets_DB/{JOB_ID}.tsv'
+
+
+def downloader(services, output_dir, **kwargs):
+    return GNPSJobDownloader(str(output_dir), gnps_url=services.gnps_url, backoff_factor=0.01, chunk_size=1 << 16, **kwargs)
+
+
+def test_truncated_download_resumes_with_a_range_request(structures, tmp_path):
+    with MockServices(structures, truncated_gnps=1) as services, downloader(services, tmp_path) as gnps:
+        job_dir = gnps.download(JOB_ID)
+        archive = services.gnps_archive(JOB_ID)
+    # The download resumes from the bytes received before the connection was closed
+    assert len(services.gnps_ranges) == 2
+    assert services.gnps_ranges[0] == 0
+    assert 0 < services.gnps_ranges[1] <= len(archive) // 2
+    with open(os.path.join(job_dir, MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+    assert manifest['size'] == len(archive)
+    assert manifest['extracted'] == [MEMBER]
+    assert not os.path.exists(gnps.zip_path(JOB_ID))
+
+
+def test_job_is_only_skipped_if_its_files_match_the_manifest(structures, tmp_path):
+    with MockServices(structures) as services, downloader(services, tmp_path) as gnps:
+        gnps.download(JOB_ID)
+        gnps.download(JOB_ID)
+        assert services.counts['gnps'] == 1
+        path = os.path.join(gnps.job_dir(JOB_ID), MEMBER)
+        with open(path) as f:
+            content = f.read()
+        with open(path, 'w') as f:
+            f.write(content[:len(content) // 2])
+        gnps.download(JOB_ID)
+        assert services.counts['gnps'] == 2
+        with open(path) as f:
+            assert f.read() == content
+        gnps.download(JOB_ID, refresh=True)
+        assert services.counts['gnps'] == 3
+
+
+def test_kept_archive_is_only_reused_if_it_matches_the_manifest(structures, tmp_path):
+    with MockServices(structures) as services, downloader(services, tmp_path, keep_zip=True) as gnps:
+        gnps.download(JOB_ID)
+        os.remove(os.path.join(gnps.job_dir(JOB_ID), MEMBER))
+        gnps.download(JOB_ID)
+        assert services.counts['gnps'] == 1
+        os.remove(os.path.join(gnps.job_dir(JOB_ID), MEMBER))
+        with open(gnps.zip_path(JOB_ID), 'r+b') as f:
+            f.seek(100)
+            f.write(b'corrupted')
+        gnps.download(JOB_ID)
+        assert services.counts['gnps'] == 2
+        assert os.path.exists(os.path.join(gnps.job_dir(JOB_ID), MEMBER))
+
+
+def test_failed_job_does_not_stop_the_others(structures, tmp_path):
+    with MockServices(structures, error_rate=1.0) as services:
+        with GNPSJobDownloader(str(tmp_path), gnps_url=services.gnps_url, max_retries=1, backoff_factor=0.01) as gnps:
+            results, errors = gnps.download_many([JOB_ID])
+    assert results == {}
+    assert set(errors) == {JOB_ID}
+    with pytest.raises(FileNotFoundError):
+        open(os.path.join(tmp_path, JOB_ID, MANIFEST_NAME))
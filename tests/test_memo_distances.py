@@ -0,0 +1,13 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('skbio')
+
+from enpkg_meta_analysis.memo_distances import pcoa
+
+
+def test_pcoa_needs_two_samples(tmp_path):
+    path = str(tmp_path / 'distances.npy')
+    np.save(path, np.zeros((1, 1), dtype=np.float32))
+    with pytest.raises(ValueError, match='at least 2 samples'):
+        pcoa(path, ['sample_0'], np.zeros(1))
@@ -0,0 +1,53 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+from enpkg_meta_analysis import memo_index
+from enpkg_meta_analysis.memo_index import MemoIndex
+from enpkg_meta_analysis.memo_matrix import SparseMemoMatrix
+from synthetic import random_memo_matrix
+
+
+def test_query_returns_the_exact_cosine_neighbours(tmp_path):
+    matrix = random_memo_matrix(220, 2000, 50, np.random.default_rng(1), n_clusters=20)
+    words = [f'peak_{k}' for k in range(2000)]
+    index = MemoIndex(str(tmp_path / 'index.db'))
+    index.add_matrix(SparseMemoMatrix(matrix[:100, :1500], [f'sample_{i}' for i in range(100)], words[:1500]))
+    index.add_matrix(SparseMemoMatrix(matrix[100:200], [f'sample_{i}' for i in range(100, 200)], words))
+    indexed = matrix[:200].toarray()
+    indexed[:100, 1500:] = 0
+    for row in matrix[200:]:
+        vector = dict(zip([words[j] for j in row.indices], row.data.tolist()))
+        vector['unindexed_word'] = 3.0
+        neighbours = index.query(vector, k=5, exclude=['sample_0'])
+
+        query = row.toarray().ravel()
+        distances = 1 - indexed @ query / (np.linalg.norm(indexed, axis=1) * np.sqrt(query @ query + 9))
+        distances[0] = np.inf
+        best = np.argsort(distances, kind='stable')[:5]
+        assert [sample_id for sample_id, _ in neighbours] == [f'sample_{i}' for i in best]
+        assert np.allclose([distance for _, distance in neighbours], distances[best], atol=1e-5)
+    index.close()
+
+
+def test_indexes_with_sketches_are_migrated(tmp_path):
+    path = str(tmp_path / 'index.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE words (word_id INTEGER PRIMARY KEY, word TEXT UNIQUE NOT NULL)')
+    conn.execute('CREATE TABLE samples (sample_id TEXT PRIMARY KEY, sketch BLOB NOT NULL, word_ids BLOB NOT NULL, counts BLOB NOT NULL)')
+    conn.executemany('INSERT INTO words VALUES (?, ?)', [(0, 'peak_0'), (1, 'peak_1')])
+    conn.execute('INSERT INTO samples VALUES (?, ?, ?, ?)', ('sample_0', b'', np.array([0, 1], dtype=np.int32).tobytes(),
+                                                             np.array([1, 2], dtype=np.float32).tobytes()))
+    conn.commit()
+    conn.close()
+    with MemoIndex(path) as index:
+        assert index.query({'peak_1': 1.0}, k=1) == [('sample_0', pytest.approx(1 - 2 / np.sqrt(5)))]
+
+
+@pytest.mark.parametrize('command', ['add', 'query'])
+def test_add_and_query_need_an_input(tmp_path, command, capsys):
+    (tmp_path / '003_memo_analysis').mkdir()
+    with pytest.raises(SystemExit):
+        memo_index.main([command, '-p', str(tmp_path)])
+    assert 'needs --input' in capsys.readouterr().err
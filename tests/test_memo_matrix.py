@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from enpkg_meta_analysis.memo_matrix import SparseMemoMatrix, load_matrix, load_metadata
+from synthetic import random_memo_matrix
+
+pytest.importorskip('pyarrow')
+
+
+@pytest.mark.parametrize('extension', ['parquet', 'feather'])
+def test_arrow_exports_round_trip(tmp_path, extension):
+    matrix = random_memo_matrix(50, 300, 20, np.random.default_rng(0))
+    words = [f'peak_{k}_pos' for k in range(200)] + [f'loss_{k}_neg' for k in range(100)]
+    table = SparseMemoMatrix(matrix, [f'sample_{i}' for i in range(50)], words)
+    metadata = {'ionizations': ['pos', 'neg'], 'suffixes': {'pos': '_pos', 'neg': '_neg'}}
+    path = str(tmp_path / f'memo.{extension}')
+    getattr(table, 'save_' + extension)(path, metadata, block_size=7)
+
+    loaded = load_matrix(path)
+    assert loaded.samples == table.samples and loaded.words == table.words
+    assert (loaded.matrix != table.matrix).nnz == 0
+    assert load_metadata(path) == dict(metadata, ionization_columns={'pos': [[0, 200]], 'neg': [[200, 300]]})
+
+
+@pytest.mark.parametrize('extension', ['parquet', 'feather'])
+def test_arrow_exports_select_samples_and_words(tmp_path, extension):
+    matrix = random_memo_matrix(50, 300, 20, np.random.default_rng(1)).tolil()
+    matrix[3] = 0
+    table = SparseMemoMatrix(matrix.tocsr(), [f'sample_{i}' for i in range(50)], [f'peak_{k}' for k in range(300)])
+    path = str(tmp_path / f'memo.{extension}')
+    getattr(table, 'save_' + extension)(path, block_size=8)
+
+    assert load_matrix(path).samples == table.samples
+    samples, words = ['sample_40', 'sample_3', 'sample_7'], ['peak_299', 'peak_0', 'peak_12']
+    selected = SparseMemoMatrix.load_arrow(path, samples=samples, words=words)
+    assert selected.samples == samples and selected.words == words
+    expected = table.select_samples(samples).matrix[:, [299, 0, 12]]
+    assert (selected.matrix != expected).nnz == 0
+
+
+def test_csv_export_is_loaded_by_chunks(tmp_path):
+    matrix = random_memo_matrix(30, 40, 10, np.random.default_rng(2))
+    table = SparseMemoMatrix(matrix, [f'sample_{i}' for i in range(30)], [f'peak_{k}' for k in range(40)])
+    path = str(tmp_path / 'memo.gz')
+    table.to_dataframe().to_csv(path, index=False)
+
+    loaded = SparseMemoMatrix.load_csv(path, max_cells=41 * 4)
+    assert loaded.samples == table.samples and loaded.words == table.words
+    assert (loaded.matrix != table.matrix).nnz == 0
+    assert load_matrix(path).samples == table.samples
@@ -0,0 +1,111 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('matchms')
+
+from enpkg_meta_analysis import mgf_aggregator  # noqa: E402
+from synthetic import make_sample_tree  # noqa: E402
+
+
+@pytest.fixture
+def sample_tree(tmp_path):
+    """ 4 samples, the spectra of one of them without CHARGE """
+    root = tmp_path / 'samples'
+    sample_ids = make_sample_tree(str(root), 4, np.random.default_rng(1), spectra_per_sample=15, blank_fraction=0)
+    mgf_path = root / sample_ids[1] / 'pos' / f'{sample_ids[1]}_features_ms2_pos.mgf'
+    mgf_path.write_text(''.join(line for line in mgf_path.read_text().splitlines(keepends=True) if not line.startswith('CHARGE=')))
+    return root
+
+
+def aggregate(root, output_name, *options):
+    mgf_aggregator.main(['-p', str(root), '-ion', 'pos', '-out', output_name, '--n_jobs', '2'] + list(options))
+    output_path = os.path.join(root, '001_aggregated_spectra', output_name)
+    with open(output_path + '.mgf') as mgf, open(output_path + '_metadata.csv') as metadata:
+        return mgf.read(), metadata.read()
+
+
+def test_streaming_output_is_identical(sample_tree):
+    mgf, metadata = aggregate(sample_tree, 'default')
+    assert aggregate(sample_tree, 'streaming', '--streaming') == (mgf, metadata)
+    # charge is missing from a sample: pandas writes the column as float
+    assert any(line.endswith(',1.0') for line in metadata.splitlines())
+
+
+def test_parallel_output_is_identical(sample_tree):
+    assert aggregate(sample_tree, 'parallel', '--parallel') == aggregate(sample_tree, 'default')
+
+
+def feature_ids(mgf):
+    return [int(line.partition('=')[2]) for line in mgf.splitlines() if line.startswith('FEATURE_ID=')]
+
+
+def read_manifest(root, output_name):
+    with open(os.path.join(root, '001_aggregated_spectra', output_name + '_manifest.json')) as f:
+        return json.load(f)
+
+
+def test_incremental_records_blanks(tmp_path, monkeypatch):
+    root = tmp_path / 'samples'
+    make_sample_tree(str(root), 6, np.random.default_rng(2), spectra_per_sample=5, blank_fraction=0.5)
+    mgf, _ = aggregate(root, 'incremental', '--incremental')
+    manifest = read_manifest(root, 'incremental')
+    blanks = [entry for entry in manifest['samples'].values() if entry['sample_type'] != 'sample']
+    assert len(manifest['samples']) == 6 and len(blanks) > 0
+    assert all(entry['last_feature_id'] < entry['first_feature_id'] for entry in blanks)
+    assert feature_ids(mgf) == feature_ids(aggregate(root, 'default')[0])
+
+    # Unchanged samples, blanks included, are not read again
+    reads = []
+    read_csv = mgf_aggregator.pd.read_csv
+    monkeypatch.setattr(mgf_aggregator.pd, 'read_csv', lambda *args, **kwargs: reads.append(args) or read_csv(*args, **kwargs))
+    assert aggregate(root, 'incremental', '--incremental')[0] == mgf
+    assert reads == []
+
+
+def test_non_incremental_run_removes_manifest(sample_tree):
+    aggregate(sample_tree, 'aggregate', '--incremental')
+    (sample_tree / 'SYN000003').rename(sample_tree.parent / 'SYN000003')
+    mgf, _ = aggregate(sample_tree, 'aggregate')
+    assert not os.path.exists(os.path.join(sample_tree, '001_aggregated_spectra', 'aggregate_manifest.json'))
+
+    (sample_tree.parent / 'SYN000003').rename(sample_tree / 'SYN000003')
+    ids = feature_ids(aggregate(sample_tree, 'aggregate', '--incremental')[0])
+    assert sorted(ids) == list(range(1, 4 * 15 + 1))
+
+
+def test_interrupted_incremental_run_does_not_duplicate_features(sample_tree, monkeypatch):
+    aggregate(sample_tree, 'aggregate', '--incremental')
+    moved = sample_tree.parent / 'SYN000003'
+    (sample_tree / 'SYN000003').rename(moved)
+    aggregate(sample_tree, 'aggregate', '--incremental')
+    moved.rename(sample_tree / 'SYN000003')
+    (sample_tree / 'SYN000002' / 'SYN000002_metadata.tsv').write_text(
+        'sample_id\tsample_type\tmassive_id\nSYN000002\tsample\tMSV000000001\n')
+
+    # Interrupted while parsing the new samples: the aggregate is untouched
+    renumber_spectrum = mgf_aggregator.renumber_spectrum
+    calls = []
+
+    def interrupted(*args):
+        calls.append(args)
+        if len(calls) == 20:
+            raise KeyboardInterrupt
+        return renumber_spectrum(*args)
+
+    monkeypatch.setattr(mgf_aggregator, 'renumber_spectrum', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        aggregate(sample_tree, 'aggregate', '--incremental')
+    monkeypatch.setattr(mgf_aggregator, 'renumber_spectrum', renumber_spectrum)
+    ids = feature_ids(aggregate(sample_tree, 'aggregate', '--incremental')[0])
+    assert len(ids) == len(set(ids)) == 4 * 15
+
+    # Interrupted while writing the aggregate: it no longer matches its manifest and is rebuilt
+    with open(os.path.join(sample_tree, '001_aggregated_spectra', 'aggregate.mgf'), 'a') as mgf:
+        mgf.write('BEGIN IONS\nFEATURE_ID=1\n')
+    next_feature_id = read_manifest(sample_tree, 'aggregate')['next_feature_id']
+    ids = feature_ids(aggregate(sample_tree, 'aggregate', '--incremental')[0])
+    assert len(ids) == len(set(ids)) == 4 * 15
+    assert min(ids) == next_feature_id
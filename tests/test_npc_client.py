@@ -0,0 +1,108 @@
+import time
+
+import pandas as pd
+
+from enpkg_meta_analysis import structures_db
+from enpkg_meta_analysis.chemo_info_fetcher import select_new_structures
+from enpkg_meta_analysis.npc_client import NPCClient
+from mock_services import MockServices
+
+
+def test_classify_many_is_concurrent(structures):
+    query = dict(structures[:100])
+    with MockServices(structures, latency=0.05) as services, \
+            NPCClient(services.npc_url, max_workers=10, rate=0) as client:
+        start = time.perf_counter()
+        results = client.classify_many(query)
+        elapsed = time.perf_counter() - start
+    assert set(results) == set(query)
+    assert all(result['npc_pathway'] != 'unknown' for result in results.values())
+    # 100 requests of 50 ms each take 5 s one after the other
+    assert elapsed < 100 * 0.05 / 4
+
+
+def test_failed_requests_are_retried(structures):
+    query = dict(structures[:100])
+    with MockServices(structures, error_rate=0.3) as services, \
+            NPCClient(services.npc_url, max_workers=8, rate=0, max_retries=10, backoff_factor=0.001) as client:
+        results = client.classify_many(query)
+    assert all(result['npc_pathway'] != 'unknown' for result in results.values())
+    assert services.counts['npclassifier'] > len(query)
+
+
+def test_retries_back_off_then_give_up(structures):
+    with MockServices(structures, error_rate=1.0) as services, \
+            NPCClient(services.npc_url, rate=0, max_retries=3, backoff_factor=0.05) as client:
+        start = time.perf_counter()
+        result = client.classify(structures[0][1])
+        elapsed = time.perf_counter() - start
+    assert result == {'npc_pathway': 'unknown', 'npc_superclass': 'unknown', 'npc_class': 'unknown'}
+    assert services.counts['npclassifier'] == 4
+    # Retries wait 0.05, 0.1 and 0.2 s
+    assert elapsed >= 0.35
+
+
+def test_request_rate_is_limited(structures):
+    query = dict(structures[:100])
+    with MockServices(structures) as services, \
+            NPCClient(services.npc_url, max_workers=8, rate=50) as client:
+        start = time.perf_counter()
+        client.classify_many(query)
+        elapsed = time.perf_counter() - start
+    # A burst of 50 requests, then 50 requests per second
+    assert elapsed >= (100 - 50) / 50 * 0.9
+
+
+def test_interrupted_run_resumes_from_checkpoint(structures, tmp_path):
+    query = dict(structures[:100])
+    conn = structures_db.connect(str(tmp_path / 'structures_metadata.db'))
+    batches = []
+
+    def on_batch(batch):
+        structures_db.save_npc_checkpoint(conn, batch)
+        batches.append(batch)
+        if len(batches) == 2:
+            raise KeyboardInterrupt
+
+    with MockServices(structures) as services:
+        with NPCClient(services.npc_url, max_workers=4, rate=0, batch_size=20) as client:
+            try:
+                client.classify_many(query, on_batch=on_batch)
+            except KeyboardInterrupt:
+                pass
+        checkpointed = {sik for batch in batches for sik in batch}
+        assert all(len(batch) >= 20 for batch in batches)
+
+        checkpoint = structures_db.load_npc_checkpoint(conn)
+        assert set(checkpoint) == checkpointed
+        new, resumed, _, _ = select_new_structures(query, [], conn, checkpoint=checkpoint)
+        assert set(resumed) == checkpointed
+        assert set(new) == set(query) - checkpointed
+
+        requests_before = services.counts['npclassifier']
+        with NPCClient(services.npc_url, max_workers=4, rate=0, batch_size=20) as client:
+            results = client.classify_many(new)
+        assert services.counts['npclassifier'] - requests_before == len(new)
+    assert set(results) | set(resumed) == set(query)
+    conn.close()
+
+
+def test_unknown_structures_missing_from_the_cache_are_not_retried_at_once(structures, tmp_path):
+    from enpkg_meta_analysis.npc_cache import NPCCache
+    candidates = dict(structures[:10])
+    conn = structures_db.connect(str(tmp_path / 'structures_metadata.db'))
+    structures_db.upsert_structures(conn, pd.DataFrame({
+        'short_inchikey': list(candidates), 'inchikey': [sik + '-UHFFFAOYSA-N' for sik in candidates], 'smiles': list(candidates.values()),
+        'npc_pathway': ['unknown'] * 5 + ['Alkaloids'] * 5, 'npc_superclass': 'unknown', 'npc_class': 'unknown'}))
+    unknown = set(list(candidates)[:5])
+    cache = NPCCache(str(tmp_path / 'npc_cache.db'), ttl_days=30)
+    new, _, _, retried = select_new_structures(candidates, [], conn, npc_cache=cache)
+    assert new == {} and retried == set()
+    assert set(cache.get_many(candidates)) == unknown
+    cache.close()
+    # Once expired, they are classified again
+    cache = NPCCache(str(tmp_path / 'npc_cache.db'), ttl_days=0)
+    new, _, _, retried = select_new_structures(candidates, [], conn, npc_cache=cache)
+    assert retried == unknown and set(new) == unknown
+    cache.close()
+    conn.close()
@@ -0,0 +1,96 @@
+import json
+import os
+import time
+
+import numpy as np
+import pytest
+import requests
+
+from enpkg_meta_analysis import run_report
+from enpkg_meta_analysis import wikidata_index
+from mock_services import MockServices
+
+
+def test_stage_peak_rss_is_measured_during_the_stage(tmp_path):
+    pytest.importorskip('psutil')
+    report = run_report.RunReport('test', str(tmp_path / 'report.json'))
+    with report.stage('allocate'):
+        array = np.ones(200 * 1024 ** 2 // 8)
+        time.sleep(0.3)
+        del array
+    with report.stage('small'):
+        time.sleep(0.3)
+    with open(report.write()) as f:
+        report = json.load(f)
+    allocate, small = report['stages']
+    assert allocate['peak_rss_mb'] - small['peak_rss_mb'] > 150
+    assert report['peak_rss_mb'] >= allocate['peak_rss_mb']
+    assert report['process_lifetime_peak_rss_mb'] >= allocate['peak_rss_mb'] - 1
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='fork is not available')
+def test_samplers_are_paused_around_fork():
+    pytest.importorskip('psutil')
+    sampler = run_report.MemorySampler(interval=0.001).start()
+    try:
+        for _ in range(20):
+            pid = os.fork()
+            if pid == 0:
+                # The child has no sampler thread: it must not wait for one, and its sampler lock must be free
+                os._exit(0 if (sampler.thread is None) and sampler.lock.acquire(timeout=1) and sampler.stop() else 1)
+            assert os.waitpid(pid, 0)[1] == 0
+            assert sampler.thread.is_alive() and sampler.lock.acquire(timeout=1)
+            sampler.lock.release()
+    finally:
+        sampler.stop()
+    assert sampler not in run_report._RUNNING_SAMPLERS
+
+
+def test_wikidata_index_requests_are_tracked(structures, tmp_path):
+    report = run_report.RunReport('test', str(tmp_path / 'report.json'))
+    with MockServices(structures) as services:
+        with report.track_session(requests.Session(), 'wikidata') as session:
+            wikidata_index.ensure_index(str(tmp_path / 'wd.db'), url=services.wd_url, session=session)
+    report.write()
+    assert report.http_summary()['wikidata']['requests'] == 1
+    assert len(wikidata_index.lookup(str(tmp_path / 'wd.db'), short_inchikeys=[structures[0][0]])) == 1
+
+
+def test_report_of_a_failed_run_is_written_when_it_fails(tmp_path):
+    report = run_report.RunReport('test', str(tmp_path / 'report.json'))
+    with pytest.raises(ValueError):
+        with report:
+            with report.stage('fails'):
+                raise ValueError
+    with open(tmp_path / 'report.json') as f:
+        written = json.load(f)
+    assert written['status'] == 'failed'
+    assert [stage['stage'] for stage in written['stages']] == ['fails']
+    # Not written again at exit
+    assert report.written
+    report._write_at_exit()
+    with open(tmp_path / 'report.json') as f:
+        assert json.load(f) == written
+
+
+def test_failed_batch_job_closes_its_resources_and_writes_its_report(tmp_path, monkeypatch):
+    pytest.importorskip('rdkit')
+    from enpkg_meta_analysis import enpkg
+    from enpkg_meta_analysis import download_chembl
+    from enpkg_meta_analysis import structure_engine
+    monkeypatch.setattr(download_chembl, 'REPO_ROOT', tmp_path)
+    closed = []
+    close = structure_engine.StructureCache.close
+
+    def recorded_close(cache):
+        closed.append(cache.path)
+        close(cache)
+
+    monkeypatch.setattr(structure_engine.StructureCache, 'close', recorded_close)
+    jobs = tmp_path / 'jobs.txt'
+    jobs.write_text(f'chembl --target_id CHEMBL0000 --chembl_db {tmp_path / "missing.db"} --structure_cache {tmp_path / "structures.db"} '
+                    f'--report {tmp_path / "chembl_run_report.json"}\n')
+    assert enpkg.run_batch(str(jobs)) == [1]
+    assert closed == [str(tmp_path / 'structures.db')]
+    with open(tmp_path / 'chembl_run_report.json') as f:
+        assert json.load(f)['status'] == 'failed'
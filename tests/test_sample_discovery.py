@@ -0,0 +1,21 @@
+import multiprocessing
+from functools import partial
+
+import numpy as np
+from scipy import sparse
+
+from enpkg_meta_analysis import memo_distances
+from enpkg_meta_analysis import sample_discovery
+
+
+def test_load_files_spawns_workers_where_fork_is_unavailable(monkeypatch):
+    spawn = multiprocessing.get_context('spawn')
+    monkeypatch.setattr(sample_discovery.multiprocessing, 'get_context', lambda: spawn)
+    assert sample_discovery.load_files(partial(int, base=16), ['a', 'ff', '10'], n_jobs=2) == [10, 255, 16]
+
+    matrix = sparse.random(40, 30, density=0.3, format='csr', random_state=0)
+    matrix.data = np.ceil(matrix.data * 5)
+    spawned = memo_distances.pairwise_distances(matrix, 'braycurtis', k=3, block_size=8, n_jobs=2)
+    serial = memo_distances.pairwise_distances(matrix, 'braycurtis', k=3, block_size=8, n_jobs=1)
+    for spawned_result, serial_result in zip(spawned, serial):
+        np.testing.assert_allclose(spawned_result, serial_result)
@@ -0,0 +1,25 @@
+import pytest
+
+pytest.importorskip('rdkit')
+
+from enpkg_meta_analysis import structure_engine
+
+
+def test_np_score_is_not_kept_after_serial_processing():
+    smiles = ['CCO', 'c1ccccc1O', 'not a smiles']
+    scored = structure_engine.process_structures(smiles, np_score=True, n_jobs=1)
+    assert scored['np_score'].notna().all()
+    assert 'not a smiles' not in scored.index
+    unscored = structure_engine.process_structures(smiles, np_score=False, n_jobs=1)
+    assert unscored['np_score'].isna().all()
+    assert list(unscored['inchikey']) == list(scored['inchikey'])
+
+
+def test_np_score_of_cached_structures_is_computed_when_requested(tmp_path):
+    cache = structure_engine.StructureCache(str(tmp_path / 'cache.db'))
+    try:
+        structure_engine.process_structures(['CCO'], cache=cache, n_jobs=1)
+        scored = structure_engine.process_structures(['CCO'], np_score=True, cache=cache, n_jobs=1)
+    finally:
+        cache.close()
+    assert scored['np_score'].notna().all()
@@ -0,0 +1,13 @@
+from enpkg_meta_analysis import wikidata_index
+from mock_services import MockServices
+
+
+def test_refresh_uses_the_given_endpoint(structures, tmp_path):
+    index_path = str(tmp_path / 'inchikey_index.db')
+    with MockServices(structures) as services:
+        wikidata_index.main(['refresh', '--index_path', index_path, '--wd_url', services.wd_url])
+        assert services.counts['wikidata'] == 1
+        wikidata_index.main(['refresh', '--index_path', index_path, '--wd_url', services.wd_url, '--max_age_days', '30'])
+        assert services.counts['wikidata'] == 1
+    assert wikidata_index.index_metadata(index_path)['source'] == services.wd_url
+    assert len(wikidata_index.lookup(index_path, short_inchikeys=[structures[0][0]])) == 1